@@ -0,0 +1,122 @@
+"""
+Compares the threaded and the async (`JENKINS_ASYNC_CLIENT`) Jenkins backends when many
+commands list job statuses at the same time against a local fake Jenkins with injected latency.
+
+Each command runs in its own thread, like errbot runs commands, and fetches the status of each
+job separately; the peak number of threads used by the commands and the plugin (not counting
+the fake Jenkins threads) shows how many threads each backend needs.
+
+Run from the repository root:
+
+    python benchmarks/bench_async_client.py
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from errbot.backends.test import TestBot
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fake_jenkins import FakeJenkins  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PeakThreadCount:
+    """
+    Samples the number of running client threads in the background, keeping the maximum.
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            count = sum(1 for t in threading.enumerate() if is_client_thread(t))
+            self.peak = max(self.peak, count)
+
+
+def is_client_thread(thread):
+    return thread.name.startswith(
+        ("command", "ThreadPoolExecutor", "AsyncJenkinsClient")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--commands", type=int, nargs="+", default=[1, 10, 40])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=32)
+    options = parser.parse_args()
+
+    jobs = {"job-{:04d}".format(i): "SUCCESS" for i in range(options.jobs)}
+    job_names = sorted(jobs)
+    testbot = TestBot(extra_plugin_dir=ROOT_DIR, loglevel=logging.ERROR)
+    testbot.start()
+    try:
+        plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name("Jenkins")
+        plugin._fetch_bulk_job_statuses = dict
+        with FakeJenkins(jobs, latency=options.latency) as fake_jenkins:
+            print(
+                "{} jobs per command, {:.0f} ms latency per request".format(
+                    options.jobs, options.latency * 1000
+                )
+            )
+            for use_async in (False, True):
+                plugin.config = {
+                    "JENKINS_URL": fake_jenkins.url,
+                    "JENKINS_USERNAME": "bench",
+                    "JENKINS_TOKEN": "bench",
+                    "JENKINS_MAX_WORKERS": options.workers,
+                    "JENKINS_POOL_SIZE": options.pool_size,
+                    "JENKINS_ASYNC_CLIENT": use_async,
+                    # measure the plugin itself, not the protection of Jenkins
+                    "JENKINS_RATE_LIMIT": 0,
+                }
+                # the rate limit is read on activation
+                plugin.deactivate()
+                plugin.activate()
+                # warm up connections (and the event loop of the async client)
+                plugin._fetch_job_statuses(job_names[:1])
+                for commands in options.commands:
+                    fake_jenkins.request_count = 0
+                    start = time.perf_counter()
+                    with PeakThreadCount() as peak:
+                        with ThreadPoolExecutor(
+                            max_workers=commands, thread_name_prefix="command"
+                        ) as executor:
+                            for _ in range(commands):
+                                executor.submit(plugin._fetch_job_statuses, job_names)
+                    elapsed = time.perf_counter() - start
+                    print(
+                        "  {:8s} commands={:3d}: {:7.3f} s, {:4d} requests, "
+                        "peak {:3d} threads".format(
+                            "async" if use_async else "threaded",
+                            commands,
+                            elapsed,
+                            fake_jenkins.request_count,
+                            peak.peak,
+                        )
+                    )
+    finally:
+        testbot.stop()
+
+
+if __name__ == "__main__":
+    main()
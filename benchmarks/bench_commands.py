@@ -0,0 +1,179 @@
+"""
+Drives the bot commands and the `jenkins` webhook through errbot's test backend against a local
+fake Jenkins, reporting latency percentiles and the number of requests to Jenkins of each
+command, so performance regressions can be compared between revisions.
+
+The fake Jenkins is configured with `--jobs`, `--folders`, `--latency`, `--error-rate` and
+`--test-report-cases`; errors are random but repeatable (see `--seed`). With `--cold` the caches
+of the plugin are dropped before each run of a command. The rate limit of requests to Jenkins is
+disabled unless given with `--rate-limit`.
+
+Run from the repository root:
+
+    python benchmarks/bench_commands.py
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from errbot.backends.test import TestBot, TestPerson
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fake_jenkins import FakeJenkins, make_jobs  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DummyRequest:
+    def __init__(self, params):
+        self.params = params
+
+
+class DummyNotifier:
+    def send_message(self, text, room_id):
+        pass
+
+    def close(self):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = max(0, int(round(p / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--folders", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--test-report-cases", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cold", action="store_true")
+    parser.add_argument("--async-client", action="store_true")
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0,
+        help="JENKINS_RATE_LIMIT, requests per second (0 disables it)",
+    )
+    options = parser.parse_args()
+
+    jobs = make_jobs(options.jobs, folders=options.folders)
+    fake_jenkins = FakeJenkins(
+        jobs,
+        latency=options.latency,
+        error_rate=options.error_rate,
+        test_report_cases=options.test_report_cases,
+        seed=options.seed,
+    )
+    testbot = TestBot(extra_plugin_dir=ROOT_DIR, loglevel=logging.ERROR)
+    testbot.start()
+    testbot.bot.sender = TestPerson("fry@localhost", nick="fry")
+    try:
+        plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name("Jenkins")
+        # failures injected with --error-rate are expected, don't log them
+        plugin.log.setLevel(logging.CRITICAL)
+        with fake_jenkins:
+            plugin.config = {
+                "JENKINS_URL": fake_jenkins.url,
+                "JENKINS_USERNAME": "bench",
+                "JENKINS_TOKEN": "bench",
+                "JENKINS_RETRY_BACKOFF": 0.01,
+                "JENKINS_ASYNC_CLIENT": options.async_client,
+                "JENKINS_RATE_LIMIT": options.rate_limit,
+                # send every listing in a single message
+                "LISTING_STATUS_WAIT": 60,
+            }
+            # the rate limit is read on activation
+            plugin.deactivate()
+            plugin.activate()
+            plugin._notifier = DummyNotifier()
+            settings = plugin.load_user_settings("fry")
+            settings["token"] = "secret"
+            plugin.save_user_settings("fry", settings)
+            build_number = [100]
+
+            def run_command(command, replies=1):
+                testbot.push_message(command)
+                for _ in range(replies):
+                    testbot.pop_message()
+
+            def run_webhook():
+                # a new build each time, so its test report is always fetched
+                build_number[0] += 1
+                job_name = sorted(jobs)[build_number[0] % len(jobs)]
+                plugin.jenkins(
+                    DummyRequest(
+                        {
+                            "number": str(build_number[0]),
+                            "job_name": job_name,
+                            "timestamp": "1508516240981",
+                            "event": "jenkins.job.completed",
+                            "result": "FAILURE",
+                            "userId": "fry",
+                            "url": "job/{}/{}/".format(job_name, build_number[0]),
+                        }
+                    )
+                )
+                plugin._webhook_dispatcher.join()
+
+            # the webhook runs first to fill the job history shown by !bhist
+            commands = [
+                ("jenkins webhook", run_webhook),
+                ("!bhist", lambda: run_command("!bhist")),
+                ("!find eden master", lambda: run_command("!find eden master", 2)),
+                ("!build 0 1 2", lambda: run_command("!build 0 1 2")),
+                ("!failures 0", lambda: run_command("!failures 0")),
+            ]
+            print(
+                "{} jobs in {} folders, {:.0f} ms latency, {:.0%} errors, {} test cases, "
+                "{} runs{}".format(
+                    options.jobs,
+                    options.folders,
+                    options.latency * 1000,
+                    options.error_rate,
+                    options.test_report_cases,
+                    options.runs,
+                    ", cold caches" if options.cold else "",
+                )
+            )
+            print(
+                "{:20s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}".format(
+                    "command", "p50 ms", "p90 ms", "p99 ms", "max ms", "requests"
+                )
+            )
+            for name, command in commands:
+                elapsed = []
+                requests = 0
+                for _ in range(options.runs):
+                    if options.cold:
+                        plugin.deactivate()
+                        plugin.activate()
+                        plugin._notifier = DummyNotifier()
+                    fake_jenkins.reset_counts()
+                    start = time.perf_counter()
+                    command()
+                    elapsed.append((time.perf_counter() - start) * 1000)
+                    requests += fake_jenkins.request_count
+                print(
+                    "{:20s} {:9.1f} {:9.1f} {:9.1f} {:9.1f} {:9.1f}".format(
+                        name,
+                        percentile(elapsed, 50),
+                        percentile(elapsed, 90),
+                        percentile(elapsed, 99),
+                        max(elapsed),
+                        requests / options.runs,
+                    )
+                )
+    finally:
+        testbot.stop()
+
+
+if __name__ == "__main__":
+    main()
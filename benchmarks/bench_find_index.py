@@ -0,0 +1,101 @@
+"""
+Measures the per-query latency of `!find` filtering over synthetic job names, comparing a linear
+scan of every job name with queries to a prebuilt `JobNameIndex`.
+
+Run from the repository root:
+
+    python benchmarks/bench_find_index.py --jobs 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from fnmatch import fnmatch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from esss_jenkins import JobNameIndex  # noqa: E402
+
+PROJECTS = ["alfasim", "eden", "etk", "fett", "simbr", "ben", "rocky", "kraken"]
+BRANCHES = ["master", "fb", "rb"]
+PLATFORMS = ["win64", "linux64", "win32"]
+PYTHONS = ["27", "36", "37"]
+
+QUERIES = [
+    "eden master win64",
+    "ASIM-501 app win64,linux64",
+    "network-refacto* linux*",
+    '"alfasim-fb-asim-1234-*"',
+    "rocky 36 win64,linux64",
+]
+
+
+def generate_job_names(count, seed=0):
+    rng = random.Random(seed)
+    job_names = set()
+    while len(job_names) < count:
+        branch = rng.choice(BRANCHES)
+        parts = [rng.choice(PROJECTS), branch]
+        if branch != "master":
+            parts += ["ASIM", str(rng.randint(1, 5000))]
+            parts += rng.sample(["network", "refactorings", "fix", "part1", "app"], 2)
+        parts += [rng.choice(PLATFORMS), rng.choice(PYTHONS)]
+        job_names.add("-".join(parts))
+    return sorted(job_names)
+
+
+def filter_linear(job_names, input_factors):
+    """The scan done for every query before the index existed."""
+    factors = []
+    for factor in input_factors:
+        if factor.startswith('"') and factor.endswith('"'):
+            word = factor[1:-1].lower()
+            job_names = [x for x in job_names if fnmatch(x.lower(), word)]
+        else:
+            factors.extend(factor.lower().split("-"))
+
+    and_factors = [x for x in factors if "," not in x]
+    or_factors = [y for x in factors if "," in x for y in x.split(",")]
+
+    def matches(fields):
+        fields = {x.lower() for x in fields}
+        if not all(any(fnmatch(x, f) for x in fields) for f in and_factors):
+            return False
+        return not or_factors or any(fnmatch(x, f) for f in or_factors for x in fields)
+
+    return [x for x in job_names if matches(set(x.split("-")))]
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args()
+
+    for count in options.jobs:
+        job_names = generate_job_names(count)
+        build_time, index = timeit(lambda: JobNameIndex(job_names), 1)
+        print("{} jobs (index built in {:.3f} s)".format(count, build_time))
+        for query in QUERIES:
+            factors = query.split()
+            linear_time, expected = timeit(
+                lambda: filter_linear(job_names, factors), options.repeat
+            )
+            index_time, found = timeit(lambda: index.find(factors), options.repeat)
+            assert found == expected, query
+            print(
+                "  {:32s} {:5d} matches: linear {:8.2f} ms, index {:8.2f} ms".format(
+                    query, len(found), linear_time * 1000, index_time * 1000
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
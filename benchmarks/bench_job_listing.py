@@ -0,0 +1,88 @@
+"""
+Measures how long `_generate_job_listing` takes against a local fake Jenkins with injected
+latency: until the first listing is generated (statuses still unknown after `--wait` seconds
+are listed as pending) and until all statuses arrived.
+
+By default statuses come from the bulk `api/json` request; `--per-job` disables it to compare
+serial status fetching with the concurrent worker pool used as fallback.
+
+Run from the repository root:
+
+    python benchmarks/bench_job_listing.py
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from errbot.backends.test import TestBot
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fake_jenkins import FakeJenkins  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 16, 32])
+    parser.add_argument("--wait", type=float, default=0.2)
+    parser.add_argument(
+        "--per-job",
+        action="store_true",
+        help="fetch the status of each job separately instead of in bulk",
+    )
+    options = parser.parse_args()
+
+    results = ["SUCCESS", "FAILURE", "UNSTABLE", None, "NOT_STARTED"]
+    jobs = {
+        "job-{:04d}".format(i): results[i % len(results)] for i in range(options.jobs)
+    }
+    testbot = TestBot(extra_plugin_dir=ROOT_DIR, loglevel=logging.ERROR)
+    testbot.start()
+    try:
+        plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name("Jenkins")
+        if options.per_job:
+            plugin._fetch_bulk_job_statuses = dict
+        with FakeJenkins(jobs, latency=options.latency) as fake_jenkins:
+            print(
+                "{} jobs, {:.0f} ms latency per request".format(
+                    options.jobs, options.latency * 1000
+                )
+            )
+            for workers in options.workers:
+                plugin.config = {
+                    "JENKINS_URL": fake_jenkins.url,
+                    "JENKINS_USERNAME": "bench",
+                    "JENKINS_TOKEN": "bench",
+                    "JENKINS_MAX_WORKERS": workers,
+                    "LISTING_STATUS_WAIT": options.wait,
+                    "LISTING_UPDATE_INTERVAL": options.wait,
+                    # measure the plugin itself, not the protection of Jenkins
+                    "JENKINS_RATE_LIMIT": 0,
+                }
+                # the rate limit is read on activation
+                plugin.deactivate()
+                plugin.activate()
+                fake_jenkins.request_count = 0
+                start = time.perf_counter()
+                listing = plugin._generate_job_listing(sorted(jobs), "bench")
+                next(listing)
+                first = time.perf_counter() - start
+                updates = sum(1 for _ in listing)
+                elapsed = time.perf_counter() - start
+                print(
+                    "  workers={:3d}: first listing {:7.3f} s, all statuses {:7.3f} s "
+                    "({} updates), {} requests".format(
+                        workers, first, elapsed, updates, fake_jenkins.request_count
+                    )
+                )
+    finally:
+        testbot.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Counts the storage writes made by each bot command, comparing all storage writes done now with
+the single whole-record write `save_user_settings` used to do for each call (`!find` also used to
+save the listing twice, so its "before" column is an underestimate).
+
+Run from the repository root:
+
+    python benchmarks/bench_settings_storage.py
+"""
+import logging
+import os
+import pickle
+import sys
+
+from errbot.backends.test import TestBot, TestPerson
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fake_jenkins import FakeJenkins  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DummyRequest:
+    def __init__(self, params):
+        self.params = params
+
+
+class DummyNotifier:
+    def send_message(self, text, room_id):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_job_event(job_name, number, event="jenkins.job.completed"):
+    return {
+        "number": str(number),
+        "job_name": job_name,
+        "timestamp": "1508516240981",
+        "builtOn": "dev-ubuntu16.04-linux-sv01-ci01",
+        "event": event,
+        "result": "SUCCESS",
+        "userId": "fry",
+        "url": "job/{}/{}/".format(job_name, number),
+    }
+
+
+def main():
+    jobs = {"eden-master-job-{:02d}".format(i): "SUCCESS" for i in range(40)}
+    testbot = TestBot(extra_plugin_dir=ROOT_DIR, loglevel=logging.ERROR)
+    testbot.start()
+    testbot.bot.sender = TestPerson("fry@localhost", nick="fry")
+    try:
+        plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name("Jenkins")
+        plugin._notifier = DummyNotifier()
+        with FakeJenkins(jobs) as fake_jenkins:
+            plugin.config = {
+                "JENKINS_URL": fake_jenkins.url,
+                "JENKINS_USERNAME": "bench",
+                "JENKINS_TOKEN": "bench",
+            }
+            settings = plugin.load_user_settings("fry")
+            settings["token"] = "secret"
+            settings["aliases"] = {"e": (["eden", "master"], "MODE=source")}
+            plugin.save_user_settings("fry", settings)
+            for i, job_name in enumerate(sorted(jobs)[:15]):
+                plugin._process_jenkins_event(make_job_event(job_name, i))
+
+            writes = []
+            saves = []
+            plugin_class = type(plugin)
+            original_setitem = plugin_class.__setitem__
+            original_save = plugin.save_user_settings
+
+            def counting_setitem(self, key, value):
+                writes.append(len(pickle.dumps(value)))
+                original_setitem(self, key, value)
+
+            def counting_save(user, settings):
+                saves.append(len(pickle.dumps(dict(settings))))
+                original_save(user, settings)
+
+            plugin_class.__setitem__ = counting_setitem
+            plugin.save_user_settings = counting_save
+
+            def run_command(command, replies=1):
+                testbot.push_message(command)
+                for _ in range(replies):
+                    testbot.pop_message()
+
+            def run_webhook():
+                plugin.jenkins(DummyRequest(make_job_event("eden-master-job-03", 99)))
+                plugin._webhook_dispatcher.join()
+
+            commands = [
+                ("!bhist", lambda: run_command("!bhist")),
+                ("!find eden master", lambda: run_command("!find eden master", 2)),
+                ("!jenkins token", lambda: run_command("!jenkins token secret2")),
+                ("!buildalias", lambda: run_command("!buildalias x eden 01")),
+                ("jenkins webhook", run_webhook),
+            ]
+            print(
+                "{:20s} {:>22s} {:>22s}".format(
+                    "command", "whole record (before)", "storage (after)"
+                )
+            )
+            try:
+                for name, run in commands:
+                    del writes[:]
+                    del saves[:]
+                    run()
+                    print(
+                        "{:20s} {:3d} writes {:8d} bytes {:3d} writes {:8d} bytes".format(
+                            name, len(saves), sum(saves), len(writes), sum(writes)
+                        )
+                    )
+            finally:
+                plugin_class.__setitem__ = original_setitem
+    finally:
+        testbot.stop()
+
+
+if __name__ == "__main__":
+    main()
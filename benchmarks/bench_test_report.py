@@ -0,0 +1,117 @@
+"""
+Measures memory and time needed to find the failed tests of a large synthetic test report,
+comparing loading the whole JSON document, decoding every test case with the streaming parser,
+and `summarize_test_report` as used by `_get_build_test_errors`, which decodes test cases only
+until it has enough to display and just counts the remaining failures.
+
+Run from the repository root:
+
+    python benchmarks/bench_test_report.py --size-mb 100
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from esss_jenkins import (  # noqa: E402
+    TestFailures,
+    iter_failed_test_cases,
+    summarize_test_report,
+)
+
+
+def generate_report(size_mb, suites=50, failure_ratio=0.01):
+    """Returns the report as bytes, roughly `size_mb` megabytes long."""
+    case_template = (
+        '{{"_class":"hudson.tasks.junit.CaseResult",'
+        '"name":"test_module_{suite}.TestSomething.test_case_number_{case}[param]",'
+        '"status":"{status}"}}'
+    )
+    case_size = len(case_template.format(suite=0, case=0, status="PASSED"))
+    cases_per_suite = int(size_mb * 1024 * 1024 / case_size / suites)
+    failure_every = int(1 / failure_ratio)
+    parts = ['{"_class":"hudson.tasks.junit.TestResult","suites":[']
+    for suite in range(suites):
+        cases = ",".join(
+            case_template.format(
+                suite=suite,
+                case=case,
+                status="FAILED" if case % failure_every == 0 else "PASSED",
+            )
+            for case in range(cases_per_suite)
+        )
+        parts.append(
+            '{{"_class":"hudson.tasks.junit.SuiteResult","cases":[{}]}}'.format(cases)
+        )
+        parts.append(",")
+    parts[-1] = "]}"
+    return "".join(parts).encode("utf-8")
+
+
+def iter_chunks(data, chunk_size=64 * 1024):
+    for i in range(0, len(data), chunk_size):
+        yield data[i : i + chunk_size].decode("utf-8")
+
+
+def load_whole(data, max_cases):
+    result = json.loads(data.decode("utf-8"))
+    errors = [
+        case
+        for suite in result["suites"]
+        for case in suite["cases"]
+        if case["status"] not in ["PASSED", "SKIPPED", "FIXED"]
+    ]
+    return len(errors), errors[:max_cases]
+
+
+def stream_all(data, max_cases):
+    count = 0
+    cases = []
+    for case in iter_failed_test_cases(iter_chunks(data)):
+        count += 1
+        if len(cases) < max_cases:
+            cases.append(case)
+    return TestFailures(count, cases)
+
+
+def stream(data, max_cases):
+    return summarize_test_report(iter_chunks(data), max_cases)
+
+
+def measure(func, data):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    count, cases = func(data, 10)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=100)
+    options = parser.parse_args()
+
+    data = generate_report(options.size_mb)
+    print("report with {:.1f} MB".format(len(data) / 1024 / 1024))
+    for name, func in [
+        ("json.loads", load_whole),
+        ("decode all", stream_all),
+        ("streaming", stream),
+    ]:
+        count, elapsed, peak = measure(func, data)
+        print(
+            "  {:10s}: {} failures, {:6.2f} s, peak memory {:8.1f} MB".format(
+                name, count, elapsed, peak / 1024 / 1024
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+A local stand-in for a Jenkins server, used by the benchmarks to measure the plugin against
+realistic HTTP round-trips without touching a real Jenkins instance.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+FOLDER_CLASS = "com.cloudbees.hudson.plugins.folder.Folder"
+
+
+def make_jobs(count, folders=0):
+    """
+    Returns ``count`` jobs for ``FakeJenkins`` with a mix of last build results, spread among
+    ``folders`` folders (all at the top level if zero).
+    """
+    results = ["SUCCESS", "FAILURE", "UNSTABLE", None, "NOT_STARTED"]
+    jobs = {}
+    for i in range(count):
+        job_name = "eden-{}-job-{:04d}".format("master" if i % 2 else "fb", i)
+        if folders:
+            job_name = "folder-{:02d}/{}".format(i % folders, job_name)
+        jobs[job_name] = results[i % len(results)]
+    return jobs
+
+
+class FakeJenkins:
+    """
+    Serves the subset of the Jenkins JSON API used by the plugin.
+
+    :param dict jobs: maps job full name (``folder/job`` for jobs inside folders) to the result
+        of its last build (``None`` means the job is currently running, ``"NOT_STARTED"`` means
+        it was never built).
+    :param float latency: seconds to sleep before answering each request.
+    :param dict endpoint_latency: overrides ``latency`` for some endpoints, given by method and
+        path with job names and numbers replaced by ``*`` (``"GET job/*/api/json"``).
+    :param float error_rate: fraction of the requests answered with 500.
+    :param dict endpoint_error_rates: overrides ``error_rate`` for some endpoints.
+    :param int test_report_cases: number of test cases in the test report of each build.
+    :param float failure_ratio: fraction of failed test cases in the test reports.
+    :param int seed: seed of the random errors, so runs are repeatable.
+    """
+
+    def __init__(
+        self,
+        jobs,
+        latency=0.0,
+        endpoint_latency=None,
+        error_rate=0.0,
+        endpoint_error_rates=None,
+        test_report_cases=0,
+        failure_ratio=0.01,
+        seed=0,
+    ):
+        self.jobs = dict(jobs)
+        self.latency = latency
+        self.endpoint_latency = dict(endpoint_latency or {})
+        self.error_rate = error_rate
+        self.endpoint_error_rates = dict(endpoint_error_rates or {})
+        self.test_report_cases = test_report_cases
+        self.failure_ratio = failure_ratio
+        self.request_count = 0
+        self.request_counts = Counter()
+        self.triggered = []
+        self._build_numbers = {job_name: 1 for job_name in self.jobs}
+        self._random = random.Random(seed)
+        self._test_report = None
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return "http://{}:{}/jenkins".format(host, port)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_count = 0
+            self.request_counts.clear()
+            del self.triggered[:]
+
+    def handle(self, method, path):
+        """
+        Returns ``(status_code, body)`` for the given request, ``body`` being ``bytes``.
+        """
+        path = urlparse(path).path.strip("/")
+        if path.startswith("jenkins/"):
+            path = path[len("jenkins/") :]
+        endpoint = "{} {}".format(method, get_endpoint_name(path))
+        with self._lock:
+            self.request_count += 1
+            self.request_counts[endpoint] += 1
+            error = self._random.random() < self.endpoint_error_rates.get(
+                endpoint, self.error_rate
+            )
+        latency = self.endpoint_latency.get(endpoint, self.latency)
+        if latency:
+            time.sleep(latency)
+        if error:
+            return 500, b""
+
+        job_name, rest = _split_job_path(path)
+        if method == "POST":
+            return self._handle_post(job_name, rest)
+        if job_name is None:
+            if rest == ["api", "json"]:
+                return _json(200, {"jobs": self._folder_items("")})
+            return 404, b""
+        if job_name in self.jobs:
+            return self._handle_job(job_name, rest)
+        if rest == ["api", "json"] and self._folder_items(job_name):
+            return _json(
+                200, {"_class": FOLDER_CLASS, "jobs": self._folder_items(job_name)}
+            )
+        return 404, b""
+
+    def _handle_post(self, job_name, rest):
+        if job_name not in self.jobs or rest not in (
+            ["build"],
+            ["buildWithParameters"],
+        ):
+            return 404, b""
+        with self._lock:
+            self.triggered.append(job_name)
+            self._build_numbers[job_name] += 1
+        return 201, b""
+
+    def _handle_job(self, job_name, rest):
+        result = self.jobs[job_name]
+        number = self._build_numbers[job_name]
+        if rest == ["api", "json"]:
+            last_build = None
+            if result != "NOT_STARTED":
+                last_build = {"number": number, "actions": []}
+            return _json(
+                200, {"name": job_name, "actions": [], "lastBuild": last_build}
+            )
+        if result == "NOT_STARTED" or len(rest) < 3 or rest[-2:] != ["api", "json"]:
+            return 404, b""
+        if rest[1:] == ["testReport", "api", "json"]:
+            return 200, self._get_test_report()
+        if len(rest) == 3:
+            return _json(
+                200, {"number": number, "building": result is None, "result": result}
+            )
+        return 404, b""
+
+    def _folder_items(self, folder):
+        """
+        Returns the Jenkins information of the items directly inside the given folder.
+        """
+        prefix = folder + "/" if folder else ""
+        items = {}
+        for job_name in self.jobs:
+            if not job_name.startswith(prefix):
+                continue
+            name, _, rest = job_name[len(prefix) :].partition("/")
+            if rest:
+                items[name] = {
+                    "_class": FOLDER_CLASS,
+                    "name": name,
+                    "fullName": prefix + name,
+                }
+            else:
+                items[name] = self._job_info(job_name, name)
+        return list(items.values())
+
+    def _job_info(self, job_name, name):
+        info = {
+            "_class": "hudson.model.FreeStyleProject",
+            "name": name,
+            "fullName": job_name,
+        }
+        result = self.jobs[job_name]
+        if result == "NOT_STARTED":
+            info.update(color="notbuilt", lastBuild=None)
+        else:
+            last_build = {"building": result is None, "result": result}
+            info.update(color="blue", lastBuild=last_build)
+        return info
+
+    def _get_test_report(self):
+        with self._lock:
+            if self._test_report is None:
+                self._test_report = generate_test_report(
+                    self.test_report_cases, self.failure_ratio
+                )
+            return self._test_report
+
+
+def generate_test_report(case_count, failure_ratio=0.01, suites=10):
+    """
+    Returns a test report with ``case_count`` test cases as ``bytes``.
+    """
+    failure_every = int(1 / failure_ratio) if failure_ratio else 0
+    cases = [
+        {
+            "name": "test_module.TestSomething.test_case_number_{}".format(i),
+            "className": "test_module.TestSomething",
+            "status": "FAILED"
+            if failure_every and i % failure_every == 0
+            else "PASSED",
+        }
+        for i in range(case_count)
+    ]
+    per_suite = max(1, -(-case_count // suites))
+    report = {
+        "_class": "hudson.tasks.junit.TestResult",
+        "suites": [
+            {"cases": cases[i : i + per_suite]} for i in range(0, case_count, per_suite)
+        ],
+    }
+    return json.dumps(report).encode("utf-8")
+
+
+def get_endpoint_name(path):
+    """
+    Replaces job names and build numbers in the path by ``*``, like the plugin does to group
+    its request statistics.
+    """
+    path = re.sub(r"(^|/)job/[^/]+", r"\1job/*", path)
+    return re.sub(r"/\d+(?=/|$)", "/*", path)
+
+
+def _split_job_path(path):
+    """
+    Splits ``job/a/job/b/rest`` into the job full name (``a/b``) and the rest of the path.
+    """
+    parts = path.split("/")
+    names = []
+    while len(parts) >= 2 and parts[0] == "job":
+        names.append(parts[1])
+        parts = parts[2:]
+    return ("/".join(names) if names else None), parts
+
+
+def _json(status_code, payload):
+    return status_code, json.dumps(payload).encode("utf-8")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def _make_handler(fake_jenkins):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            status_code, body = fake_jenkins.handle(self.command, self.path)
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
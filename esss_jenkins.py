@@ -1,12 +1,59 @@
+import asyncio
+import codecs
+import copy
+import inspect
 import json
+import queue
 import random
-from fnmatch import fnmatch
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing, contextmanager
+from fnmatch import translate
+from functools import lru_cache, wraps
+from itertools import islice
 from pprint import pformat
 from textwrap import dedent
 from urllib.parse import urlencode
 
 import requests
+from bottle import HTTPResponse
 from errbot import BotPlugin, botcmd, webhook, arg_botcmd
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+def traced(func):
+    """
+    Records the duration of a bot command, and of the spans of work done while it runs, in the
+    ``Tracer`` of the plugin (see ``!jenkins trace``).
+
+    The user who sent the command is kept along, so the requests made to Jenkins on their behalf
+    count against their share of the rate limit.
+    """
+    if inspect.isgeneratorfunction(func):
+
+        @wraps(func)
+        def wrapper(self, msg, *args, **kwargs):
+            with self._tracer.trace(func.__name__, msg.frm.nick):
+                yield from func(self, msg, *args, **kwargs)
+
+    else:
+
+        @wraps(func)
+        def wrapper(self, msg, *args, **kwargs):
+            with self._tracer.trace(func.__name__, msg.frm.nick):
+                return func(self, msg, *args, **kwargs)
+
+    return wrapper
 
 
 class JenkinsBot(BotPlugin):
@@ -23,6 +70,13 @@ class JenkinsBot(BotPlugin):
             super().__init__("{}: {}".format(context, response))
             self.response = response
 
+    class UnavailableError(Exception):
+        """
+        Raised instead of making a request to Jenkins when it is considered down (see
+        ``CircuitBreaker``) or too many requests are waiting for the rate limit. Inner class for
+        the same reason as ``ResponseError``.
+        """
+
     def get_configuration_template(self):
         return {
             "JENKINS_TOKEN": "",
@@ -31,58 +85,401 @@ class JenkinsBot(BotPlugin):
             "ROCKETCHAT_USER": "",
             "ROCKETCHAT_PASSWORD": "",
             "ROCKETCHAT_DOMAIN": "",
+            "JENKINS_MAX_WORKERS": 8,
+            "JENKINS_REQUEST_TIMEOUT": 30,
+            "JENKINS_POOL_SIZE": 10,
+            "JENKINS_RETRIES": 3,
+            "JENKINS_RETRY_BACKOFF": 0.5,
+            "JENKINS_ASYNC_CLIENT": False,
+            "JENKINS_RATE_LIMIT": 50,
+            "JENKINS_RATE_LIMIT_BURST": 100,
+            "JENKINS_RATE_LIMIT_USER_SHARE": 0.5,
+            "JENKINS_CIRCUIT_BREAKER_FAILURES": 5,
+            "JENKINS_CIRCUIT_BREAKER_RESET": 30,
+            "JOB_CATALOG_TTL": 300,
+            "JOB_PARAMETERS_TTL": 60,
+            "JOB_STATUS_TTL": 30 * 60,
+            "WEBHOOK_WORKERS": 4,
+            "WEBHOOK_QUEUE_SIZE": 1000,
+            "NOTIFY_COALESCE_SECONDS": 0,
+            "TEST_FAILURES_CACHE_SIZE": 500,
+            "TEST_FAILURES_CACHE_MAX_AGE": 30 * 24 * 60 * 60,
+            "WATCH_POLL_INTERVAL": 5 * 60,
+            "FIND_PAGE_SIZE": 50,
+            "LISTING_STATUS_WAIT": 2,
+            "LISTING_UPDATE_INTERVAL": 2,
         }
 
+    def _get_config(self, name):
+        """
+        Returns the configuration value for ``name``, falling back to the default in the
+        configuration template so configurations saved before a setting existed keep working.
+        """
+        config = self.config or {}
+        if name in config:
+            return config[name]
+        return self.get_configuration_template()[name]
+
+    def activate(self):
+        super().activate()
+        self._job_catalog = JobCatalog(lambda: self._fetch_all_job_names(), self.log)
+        self._job_crawler = JobFolderCrawler(
+            lambda folders: self._fetch_folders_items(folders)
+        )
+        self._jenkins_session = None
+        self._jenkins_session_lock = threading.Lock()
+        # serializes the migration of settings stored in the legacy single record
+        self._legacy_settings_lock = threading.Lock()
+        self._request_stats = RequestStats()
+        self._tracer = Tracer()
+        self._single_flight = SingleFlight()
+        self._rate_limiter = RateLimiter(
+            rate=self._get_config("JENKINS_RATE_LIMIT"),
+            burst=self._get_config("JENKINS_RATE_LIMIT_BURST"),
+            user_share=self._get_config("JENKINS_RATE_LIMIT_USER_SHARE"),
+        )
+        self._circuit_breaker = CircuitBreaker(
+            failure_threshold=self._get_config("JENKINS_CIRCUIT_BREAKER_FAILURES"),
+            reset_timeout=self._get_config("JENKINS_CIRCUIT_BREAKER_RESET"),
+        )
+        self._async_jenkins = None
+        self._async_jenkins_lock = threading.Lock()
+        if self._get_config("JENKINS_ASYNC_CLIENT") and aiohttp is None:
+            self.log.warning(
+                "JENKINS_ASYNC_CLIENT is enabled but aiohttp is not installed"
+            )
+        self._json_response_cache = ConditionalResponseCache(max_size=1000)
+        self._job_parameters_cache = TTLCache(max_size=1000)
+        self._job_status_table = JobStatusTable(max_size=10000)
+        self._test_failures_cache = TestFailuresCache(
+            self,
+            max_entries=self._get_config("TEST_FAILURES_CACHE_SIZE"),
+            max_age=self._get_config("TEST_FAILURES_CACHE_MAX_AGE"),
+        )
+        self._job_watches = JobWatches(self)
+        if self._get_config("WATCH_POLL_INTERVAL") > 0:
+            self.start_poller(
+                self._get_config("WATCH_POLL_INTERVAL"), self._poll_watched_jobs
+            )
+        self._notifier = None
+        self._notifier_lock = threading.Lock()
+        self._notification_coalescer = NotificationCoalescer(
+            self._on_notification_window_end
+        )
+        self._webhook_dispatcher = EventDispatcher(
+            self._process_jenkins_event,
+            workers=self._get_config("WEBHOOK_WORKERS"),
+            queue_size=self._get_config("WEBHOOK_QUEUE_SIZE"),
+            log=self.log,
+        )
+
+    def deactivate(self):
+        self._webhook_dispatcher.stop()
+        self._notification_coalescer.cancel()
+        for user in self._notification_coalescer.get_users():
+            self._send_completed_notifications(
+                user, self._notification_coalescer.pop(user)
+            )
+        if self._notifier is not None:
+            self._notifier.close()
+            self._notifier = None
+        if self._jenkins_session is not None:
+            self._jenkins_session.close()
+            self._jenkins_session = None
+        if self._async_jenkins is not None:
+            self._async_jenkins.close()
+            self._async_jenkins = None
+        super().deactivate()
+
     def load_user_settings(self, user):
-        key = "user:{}".format(user)
-        settings = {"token": "", "jobs": [], "last_job_listing": []}
-        loaded = self.get(key, settings)
-        settings.update(loaded)
+        """
+        Loads the settings of the user as a ``UserSettings``.
+
+        Each setting is stored as a separate record (see ``USER_SETTINGS_RECORDS``), so
+        ``save_user_settings`` only has to write the records which actually changed. The
+        records of ``LAZY_USER_SETTINGS``, which can be large, are only read when accessed.
+        """
+        settings = {"token": "", "jobs": [], "last_job_listing": [], "listing_page": 1}
+        loaded = {}
+        lazy_names = []
+        with self._tracer.span("storage_load"), self._legacy_settings_lock:
+            for name in USER_SETTINGS_RECORDS:
+                key = self._get_user_settings_key(user, name)
+                if key in self:
+                    if name in LAZY_USER_SETTINGS:
+                        lazy_names.append(name)
+                    else:
+                        loaded[name] = self[key]
+
+            legacy_key = "user:{}".format(user)
+            legacy = not loaded and not lazy_names and legacy_key in self
+            if legacy:
+                settings.update(self[legacy_key])
+            else:
+                settings.update(loaded)
+
+        def load(name):
+            with self._tracer.span("storage_load"):
+                return self[self._get_user_settings_key(user, name)]
+
+        settings = UserSettings(
+            settings, legacy=legacy, lazy_names=lazy_names, load=load
+        )
         self.log.debug("LOAD ({}) settings: {}".format(user, settings))
         return settings
 
     def save_user_settings(self, user, settings):
-        key = "user:{}".format(user)
-        self[key] = settings
-        self.log.debug("SAVE ({}) settings: {}".format(user, settings))
-
-    def _generate_job_listing(self, job_names, user):
-        items = []
-        for (i, job_name) in enumerate(job_names):
-            status = self._fetch_job_status(job_name)
-            emoji = get_emoji_for_job_status(status)
-            if status is not None:
-                fmt = "`{index:2d}`. {emoji} [{name}]({url})"
+        """
+        Saves the settings of the user, writing only the records which changed since they were
+        loaded with ``load_user_settings`` (all of them if ``settings`` is a plain dict).
+        """
+        if isinstance(settings, UserSettings):
+            dirty_names = settings.get_dirty_names()
+        else:
+            dirty_names = list(settings)
+        with self._tracer.span("storage_save"):
+            if isinstance(settings, UserSettings) and settings.legacy:
+                with self._legacy_settings_lock:
+                    # another save of the same user might have migrated the legacy record
+                    # already, then only the settings changed in this copy are written
+                    legacy_key = "user:{}".format(user)
+                    if legacy_key in self:
+                        dirty_names = list(settings)
+                    self._write_user_settings(user, settings, dirty_names)
+                    self.pop(legacy_key, None)
+                settings.legacy = False
             else:
-                fmt = "`{index:2d}`. {emoji} {name}"
-            items.append(
-                fmt.format(
-                    index=i, name=job_name, url=self._get_job_url(job_name), emoji=emoji
-                )
-            )
+                self._write_user_settings(user, settings, dirty_names)
+        self.log.debug(
+            "SAVE ({}) settings {}: {}".format(user, sorted(dirty_names), settings)
+        )
+
+    def _write_user_settings(self, user, settings, names):
+        for name in names:
+            self[self._get_user_settings_key(user, name)] = settings[name]
+        if isinstance(settings, UserSettings):
+            settings.mark_saved(names)
+
+    @staticmethod
+    def _get_user_settings_key(user, name):
+        return "user:{}:{}".format(user, USER_SETTINGS_RECORDS.get(name, name))
+
+    def _generate_job_listing(self, job_names, user, page=1, page_size=None):
+        """
+        Generates the listing items of the jobs in the given page (all jobs if ``page_size`` is
+        None), fetching the status of those jobs only.
+
+        The first value generated is the list of items of all jobs in the page; jobs whose
+        status is not known after ``LISTING_STATUS_WAIT`` seconds are listed with a placeholder
+        emoji, and the next values are lists with the items of those jobs, generated every
+        ``LISTING_UPDATE_INTERVAL`` seconds as their statuses arrive.
+
+        The whole ``job_names`` list is saved as the user's last job listing, so the indexes
+        used by `!build` refer to the same jobs in every page.
+        """
+        start = (page - 1) * page_size if page_size else 0
+        stop = start + page_size if page_size else len(job_names)
+        page_job_names = job_names[start:stop]
         settings = self.load_user_settings(user)
         settings["last_job_listing"] = job_names
+        settings["listing_page"] = page
         self.save_user_settings(user, settings)
-        return items
+
+        results = queue.Queue()
+        threading.Thread(
+            target=self._tracer.bind(self._put_job_statuses),
+            args=(page_job_names, results),
+            daemon=True,
+        ).start()
+
+        def format_items(statuses):
+            items = []
+            for (i, job_name) in enumerate(page_job_names, start):
+                if job_name not in statuses:
+                    continue
+                status = statuses[job_name]
+                if status is PENDING_STATUS:
+                    emoji = ":hourglass_flowing_sand:"
+                else:
+                    emoji = get_emoji_for_job_status(status)
+                if status is not None:
+                    fmt = "`{index:2d}`. {emoji} [{name}]({url})"
+                else:
+                    fmt = "`{index:2d}`. {emoji} {name}"
+                items.append(
+                    fmt.format(
+                        index=i,
+                        name=job_name,
+                        url=self._get_job_url(job_name),
+                        emoji=emoji,
+                    )
+                )
+            return items
+
+        statuses = dict.fromkeys(page_job_names, PENDING_STATUS)
+        finished = receive_job_statuses(
+            results, statuses, timeout=self._get_config("LISTING_STATUS_WAIT")
+        )
+        yield format_items(statuses)
+        while not finished:
+            statuses = {}
+            finished = receive_job_statuses(
+                results, statuses, timeout=self._get_config("LISTING_UPDATE_INTERVAL")
+            )
+            if statuses:
+                yield format_items(statuses)
+
+    def _put_job_statuses(self, job_names, results):
+        """
+        Puts ``(job_name, status)`` in the ``results`` queue as the statuses arrive, followed by
+        ``None`` when done (or the exception raised while fetching them).
+        """
+        try:
+            with self._tracer.span("status_fetch"):
+                for item in self._iter_job_statuses(job_names):
+                    results.put(item)
+        except Exception as e:
+            results.put(e)
+        else:
+            results.put(None)
+
+    def _generate_find_page(self, job_names, user, page):
+        page_size = self._get_config("FIND_PAGE_SIZE")
+        page_count = get_page_count(len(job_names), page_size)
+        if page > page_count:
+            yield "There are only **{}** pages of jobs.".format(page_count)
+            return
+        listing = self._generate_job_listing(job_names, user, page, page_size)
+        items = next(listing)
+        if page_count > 1:
+            header = "Found **{}** jobs, showing page {} of {}:".format(
+                len(job_names), page, page_count
+            )
+        else:
+            header = "Found these {} jobs:".format(len(job_names))
+        footer = "To trigger builds, use `!build <num1> <num2> <num3> ...`"
+        if page < page_count:
+            footer += "\nTo see the next page, use `!more`"
+        yield "\n{}\n\n{}\n\n{}\n".format(header, "\n".join(items), footer)
+        for items in listing:
+            yield STATUS_UPDATE_MSG.format("\n".join(items))
 
     @botcmd(split_args_with=None, admin_only=True)
     def debug_settings(self, msg, args):
         if not args:
             return "Enter user name"
         settings = self.load_user_settings(args[0])
-        return "User settings:\n```python\n{}```".format(pformat(settings))
+        return "User settings:\n```python\n{}```".format(pformat(dict(settings)))
+
+    @botcmd(admin_only=True)
+    def jenkins_stats(self, msg, args):
+        """Shows cache statistics of the plugin."""
+        stats = self._job_catalog.get_stats()
+        lines = [
+            "Job catalog: {jobs} jobs, {age} old".format(
+                jobs=stats["jobs"],
+                age="{:.0f}s".format(stats["age"]) if stats["age"] is not None else "-",
+            ),
+            "  hits: {hits}, stale hits: {stale_hits}, misses: {misses}, "
+            "refreshes: {refreshes}, invalidations: {invalidations}".format(**stats),
+        ]
+        lines.append(
+            "Job folders: {folders} cached, {fetches} fetches, {reuses} reuses, "
+            "{invalidations} invalidations".format(**self._job_crawler.get_stats())
+        )
+        lines.append(
+            "Webhook events: {submitted} submitted, {processed} processed, "
+            "{errors} errors, {dropped} dropped, {queued} queued".format(
+                **self._webhook_dispatcher.get_stats()
+            )
+        )
+        lines.append(
+            "Job status table: {jobs} jobs, {hits} hits, {misses} misses, "
+            "{updates} updates".format(**self._job_status_table.get_stats())
+        )
+        lines.append(
+            "Job watches: {jobs} jobs, {watches} watches, {updates} updates".format(
+                **self._job_watches.get_stats()
+            )
+        )
+        lines.append(
+            "Test failures cache: {entries} builds, {hits} hits, {misses} misses".format(
+                **self._test_failures_cache.get_stats()
+            )
+        )
+        lines.append(
+            "Coalesced requests: {calls} made, {shared} shared".format(
+                **self._single_flight.get_stats()
+            )
+        )
+        lines.append(
+            "Conditional response cache: {entries} responses, {not_modified} not modified, "
+            "{modified} modified, {misses} misses".format(
+                **self._json_response_cache.get_stats()
+            )
+        )
+        lines.append(
+            "Rate limiter: {acquired} requests, {throttled} throttled, "
+            "{rejected} rejected".format(**self._rate_limiter.get_stats())
+        )
+        lines.append(
+            "Circuit breaker: {state}, {failures} consecutive failures, {opens} opens, "
+            "{rejected} rejected".format(**self._circuit_breaker.get_stats())
+        )
+        lines.append("Jenkins requests:")
+        for endpoint, endpoint_stats in sorted(self._request_stats.get_stats().items()):
+            lines.append(
+                "  {endpoint}: {count} requests, {errors} errors, {size}, "
+                "avg {avg:.0f} ms, max {max:.0f} ms".format(
+                    endpoint=endpoint,
+                    count=endpoint_stats["count"],
+                    errors=endpoint_stats["errors"],
+                    size=format_size(endpoint_stats["bytes"]),
+                    avg=endpoint_stats["total"] / endpoint_stats["count"] * 1000,
+                    max=endpoint_stats["max"] * 1000,
+                )
+            )
+        return "Jenkins stats:\n```\n{}\n```".format("\n".join(lines))
+
+    @botcmd(admin_only=True)
+    def jenkins_trace(self, msg, args):
+        """Shows how long each command takes, split in spans (catalog fetch, filter, ...)."""
+        stats_by_command = {}
+        for (command, span), stats in self._tracer.get_stats().items():
+            stats_by_command.setdefault(command or "(background)", {})[span] = stats
+        if not stats_by_command:
+            return "No commands traced yet."
+        lines = []
+        for command, stats_by_span in sorted(stats_by_command.items()):
+            lines.append("{}:".format(command))
+            # the whole command first, then its spans
+            spans = sorted(stats_by_span, key=lambda x: (x != "total", x))
+            for span in spans:
+                lines.append(
+                    "  {}: {}".format(span, format_histogram_stats(stats_by_span[span]))
+                )
+        lines.append("Jenkins requests:")
+        for endpoint, stats in sorted(self._request_stats.get_stats().items()):
+            lines.append(
+                "  {}: {}, {}".format(
+                    endpoint, format_size(stats["bytes"]), format_histogram_stats(stats)
+                )
+            )
+        return "Jenkins traces:\n```\n{}\n```".format("\n".join(lines))
 
     @botcmd(split_args_with=None)
+    @traced
     def bhist(self, msg, args):
         """Returns a list with your job history, including running and previous runs."""
         user = args[0] if args else msg.frm.nick
         settings = self.load_user_settings(user)
-        infos = settings["jobs"]
-        if not infos:
-            return "You never ran anything. Or at least I don't remember."
+        history = load_job_history(settings["jobs"])
+        if not history:
+            yield "You never ran anything. Or at least I don't remember."
+            return
 
-        item_texts = self._generate_job_listing(
-            [info["job_name"] for info in infos], user
+        listing = self._generate_job_listing(
+            [entry.job_name for entry in history], user
         )
 
         s = dedent(
@@ -94,10 +491,13 @@ class JenkinsBot(BotPlugin):
             To trigger builds, use `!build <num1> <num2> <num3> ...`
         """
         )
-        return s.format("\n".join(item_texts))
+        yield s.format("\n".join(next(listing)))
+        for item_texts in listing:
+            yield STATUS_UPDATE_MSG.format("\n".join(item_texts))
 
     @arg_botcmd("user", type=str)
     @arg_botcmd("--confirm", action="store_true")
+    @traced
     def clear(self, msg, user, confirm):
         """Clears your job history."""
         if not confirm:
@@ -108,14 +508,22 @@ class JenkinsBot(BotPlugin):
         return "Job history on the trash."
 
     @botcmd(split_args_with=None)
+    @traced
     def find(self, msg, args):
-        """Finds jobs based on keywords, separated by spaces (`ETK 1456 sci20 win64,linux64`)."""
-        if not args:
+        """Finds jobs based on keywords, separated by spaces (`ETK 1456 sci20 win64,linux64 --page 2`)."""
+        try:
+            factors, page = parse_page_argument(args)
+        except ValueError as e:
+            yield str(e)
+            return
+
+        if not factors:
             yield dedent(
                 """\
                 Pass some search factors, for example:
                     `ASIM 507 win64,linux64`: matches jobs with `ASIM` *and* `507` *and* ( `win64` *or* `linux64` )
                     `"eden-master-win64-35"`: matches exactly the job named `eden-master-win64-35`
+                Large results are split in pages, use `--page N` or `!more` to see the other pages.
             """
             )
             return
@@ -124,40 +532,45 @@ class JenkinsBot(BotPlugin):
         user = msg.frm.nick
         yield "Hold on, lemme check..."
 
-        all_job_names = self._fetch_all_job_names()
+        try:
+            job_name_index = self._get_job_name_index()
+        except self.UnavailableError as e:
+            yield "Can't list the jobs: {}.".format(e)
+            return
         self.log.debug(
-            "found {} jobs in total, filtering by {!r}".format(len(all_job_names), args)
-        )
-
-        job_names = sorted(filter_jobs_by_find_string(all_job_names, args))
-        if len(job_names) > 50:
-            yield "This resulted in **{}** jobs, which is too much.\n" "Try to narrow your research.".format(
-                len(job_names)
+            "found {} jobs in total, filtering by {!r}".format(
+                len(job_name_index), factors
             )
-            return
+        )
 
+        with self._tracer.span("filter"):
+            job_names = sorted(job_name_index.find(factors))
         if job_names:
             self.log.debug("filtered {} jobs".format(len(job_names)))
-            items = self._generate_job_listing(job_names, user)
-            yield dedent(
-                """
-                Found these {} jobs:
-
-                {}
-
-                To trigger builds, use `!build <num1> <num2> <num3> ...`
-            """.format(
-                    len(items), "\n".join(items)
-                )
-            )
+            yield from self._generate_find_page(job_names, user, page)
         else:
             yield "No jobs found, sorry buddy."
+            settings = self.load_user_settings(user)
+            settings["last_job_listing"] = job_names
+            settings["listing_page"] = 1
+            self.save_user_settings(user, settings)
 
+    @botcmd
+    @traced
+    def more(self, msg, args):
+        """Shows the next page of jobs found by the last `!find` command"""
+        user = msg.frm.nick
         settings = self.load_user_settings(user)
-        settings["last_job_listing"] = job_names
-        self.save_user_settings(user, settings)
+        job_names = settings["last_job_listing"]
+        page = settings["listing_page"] + 1
+        page_count = get_page_count(len(job_names), self._get_config("FIND_PAGE_SIZE"))
+        if page > page_count:
+            yield "No more jobs to show."
+            return
+        yield from self._generate_find_page(job_names, user, page)
 
     @botcmd(split_args_with=None)
+    @traced
     def build(self, msg, args):
         """Triggers jobs by an alias or build number from last `!find` or `!history` commands"""
         user = msg.frm.nick
@@ -168,22 +581,53 @@ class JenkinsBot(BotPlugin):
             )
 
         def trigger_jobs(job_names, parameters):
-            for job_name in job_names:
-                self._trigger_job(job_name, user, parameters)
-
-            items = [
-                "[{job_name}]({url})".format(job_name=x, url=self._get_job_url(x))
-                for x in job_names
-            ]
-            return dedent(
-                """
-                Triggered **{}** jobs:
-
-                {}
-            """.format(
-                    len(items), "\n".join(items)
-                )
-            )
+            def trigger_job(job_name):
+                try:
+                    self._trigger_job(job_name, user, parameters)
+                except Exception as e:
+                    self.log.exception("Failed to trigger job {}".format(job_name))
+                    return e
+                return None
+
+            with self._tracer.span("trigger"):
+                if self._use_async_jenkins():
+                    client = self._get_async_jenkins()
+                    auth = (user, settings["token"])
+                    errors = client.map(
+                        lambda job_name: client.trigger_job(job_name, auth, parameters),
+                        job_names,
+                    )
+                    for job_name, error in zip(job_names, errors):
+                        if error is not None:
+                            self.log.error(
+                                "Failed to trigger job {}".format(job_name),
+                                exc_info=error,
+                            )
+                else:
+                    errors = self._map_concurrently(trigger_job, job_names)
+            triggered = [x for (x, e) in zip(job_names, errors) if e is None]
+            failed = [(x, e) for (x, e) in zip(job_names, errors) if e is not None]
+
+            lines = []
+            if triggered:
+                lines.append("Triggered **{}** jobs:\n".format(len(triggered)))
+                lines += [
+                    "[{job_name}]({url})".format(job_name=x, url=self._get_job_url(x))
+                    for x in triggered
+                ]
+            if failed:
+                if lines:
+                    lines.append("")
+                lines.append("Failed to trigger **{}** jobs:\n".format(len(failed)))
+                lines += [
+                    "[{job_name}]({url}): {error}".format(
+                        job_name=x,
+                        url=self._get_job_url(x),
+                        error=self._describe_error(e),
+                    )
+                    for (x, e) in failed
+                ]
+            return "\n".join(lines)
 
         aliases = settings.get("aliases")
         if aliases is not None and args and len(args) > 0:
@@ -191,7 +635,12 @@ class JenkinsBot(BotPlugin):
             if alias in aliases:
                 search_pattern, parameters = aliases[alias]
 
-                job_names = self._find_all_job_names_filtered(search_pattern + args[1:])
+                try:
+                    job_names = self._find_all_job_names_filtered(
+                        search_pattern + args[1:]
+                    )
+                except self.UnavailableError as e:
+                    return "Can't list the jobs: {}.".format(e)
                 if len(job_names) == 0:
                     return "No job found with pattern: `{}`".format(
                         search_pattern + args[1:]
@@ -232,6 +681,7 @@ class JenkinsBot(BotPlugin):
     @arg_botcmd("search_pattern", nargs="*", help="Job search pattern")
     @arg_botcmd("alias", nargs="?", help="Alias name")
     @arg_botcmd("--parameters", dest="parameters", help="Job parameters")
+    @traced
     def buildalias(self, msg, alias, search_pattern, parameters):
         """Adds a build alias based on keywords and parameters e.g: `!buildalias r30l rocky30 linux64 --parameters=BM='source'`)."""
         user = msg.frm.nick
@@ -264,6 +714,7 @@ class JenkinsBot(BotPlugin):
         )
 
     @botcmd(split_args_with=None)
+    @traced
     def jenkins_token(self, msg, args):
         """Set or get your Jenkins token"""
         user = msg.frm.nick
@@ -282,6 +733,149 @@ class JenkinsBot(BotPlugin):
             self.save_user_settings(user, settings)
             return "Token saved."
 
+    @botcmd(split_args_with=None)
+    @traced
+    def failures(self, msg, args):
+        """Shows the failed tests of a build (`!failures <index or job name> [build number]`)."""
+        if not args or len(args) > 2:
+            return "Usage: `!failures <index or job name> [build number]`"
+
+        job_name = args[0]
+        if job_name.isdigit():
+            last_job_listing = self.load_user_settings(msg.frm.nick)["last_job_listing"]
+            index = int(job_name)
+            if index >= len(last_job_listing):
+                return "No job with index {} in your last listing.".format(index)
+            job_name = last_job_listing[index]
+
+        build_number = args[1] if len(args) > 1 else None
+        if build_number is not None and not build_number.isdigit():
+            return "Invalid build number: `{}`".format(build_number)
+
+        test_failures = None
+        if build_number is not None:
+            test_failures = self._test_failures_cache.get(job_name, build_number)
+        if test_failures is None:
+            try:
+                build_info = self._get_jenkins_json_request(
+                    "{}/{}/api/json".format(
+                        get_job_path(job_name), build_number or "lastBuild"
+                    ),
+                    params={"tree": "number,building"},
+                )
+                build_number = str(build_info["number"])
+                if build_info.get("building"):
+                    test_failures = self._get_build_test_errors(job_name, build_number)
+                else:
+                    test_failures = self._get_finished_build_test_errors(
+                        job_name, build_number
+                    )
+            except self.ResponseError as e:
+                if e.response.status_code == 404:
+                    return "Build not found: `{}` {}".format(
+                        job_name, build_number or "(last build)"
+                    )
+                raise
+            except self.UnavailableError as e:
+                return "Can't get the failed tests: {}.".format(e)
+
+        header = "[{job_name}]({url}/{build_number}) build **{build_number}**".format(
+            job_name=job_name,
+            url=self._get_job_url(job_name),
+            build_number=build_number,
+        )
+        if not test_failures.count:
+            return "No failed tests in {}.".format(header)
+        return "Failed tests in {}:\n{}".format(
+            header, format_test_failures(test_failures.cases, test_failures.count)
+        )
+
+    @botcmd(split_args_with=None)
+    @traced
+    def watch(self, msg, args):
+        """Notifies you when the given jobs start or finish (`!watch <index1> <index2> ...` or `!watch <alias>`)."""
+        user = msg.frm.nick
+        if not args:
+            watched = self._job_watches.get_jobs(user)
+            if not watched:
+                return (
+                    "You are not watching any jobs: "
+                    "`!watch <index1> <index2> ...` or `!watch <alias>`."
+                )
+            return "You are watching:\n\n{}".format(
+                "\n".join(self._format_watched_jobs(watched))
+            )
+
+        try:
+            job_names = self._get_jobs_to_watch(user, args)
+        except ValueError as e:
+            return str(e)
+        except self.UnavailableError as e:
+            return "Can't list the jobs: {}.".format(e)
+        statuses = dict(zip(job_names, self._fetch_job_statuses(job_names)))
+        self._job_watches.add(user, statuses)
+        return "Watching **{}** jobs, I'll let you know when they start or finish:\n\n{}".format(
+            len(job_names), "\n".join(self._format_watched_jobs(statuses))
+        )
+
+    @botcmd(split_args_with=None)
+    @traced
+    def unwatch(self, msg, args):
+        """Stops watching the given jobs, or all jobs if none given (`!unwatch [<index1> ...|<alias>]`)."""
+        user = msg.frm.nick
+        job_names = None
+        if args:
+            try:
+                job_names = self._get_jobs_to_watch(user, args)
+            except ValueError as e:
+                return str(e)
+            except self.UnavailableError as e:
+                return "Can't list the jobs: {}.".format(e)
+        removed = self._job_watches.remove(user, job_names)
+        if not removed:
+            return "You were not watching those jobs."
+        return "Stopped watching **{}** jobs.".format(len(removed))
+
+    def _get_jobs_to_watch(self, user, args):
+        """
+        Returns the job names given to `!watch`/`!unwatch`, either indexes of the user's last
+        job listing or a build alias (see `!buildalias`), raising ``ValueError`` with a message
+        for the user if they are not valid.
+        """
+        settings = self.load_user_settings(user)
+        if all(x.isdigit() for x in args):
+            last_job_listing = settings["last_job_listing"]
+            job_names = []
+            for index in map(int, args):
+                if index >= len(last_job_listing):
+                    raise ValueError(
+                        "No job with index {} in your last listing.".format(index)
+                    )
+                job_names.append(last_job_listing[index])
+            return job_names
+
+        aliases = settings.get("aliases") or {}
+        if len(args) > 1 or args[0] not in aliases:
+            raise ValueError(
+                "Pass indexes of your last listing or an alias: "
+                "`!watch <index1> <index2> ...` or `!watch <alias>`"
+            )
+        search_pattern, _ = aliases[args[0]]
+        job_names = self._find_all_job_names_filtered(search_pattern)
+        if not job_names:
+            raise ValueError("No job found with pattern: `{}`".format(search_pattern))
+        return job_names
+
+    def _format_watched_jobs(self, statuses):
+        return [
+            "{emoji} [{job_name}]({url})".format(
+                emoji=get_emoji_for_job_status(status),
+                job_name=job_name,
+                url=self._get_job_url(job_name),
+            )
+            for (job_name, status) in sorted(statuses.items())
+        ]
+
     @webhook(raw=True)
     def jenkins(self, request):
         """
@@ -294,154 +888,602 @@ class JenkinsBot(BotPlugin):
          'userId': 'prusse',
          'url': 'job/fett-master-none-dev-ubuntu16.04-linux-sv01-ci01-execute_cmd/2/',
          }
+        The event is only validated here and then queued, so Jenkins doesn't have to wait for the
+        notification to be delivered: see ``_process_jenkins_event``.
+
         :param request:
         :return:
         """
-        from rocketchat.api import RocketChatAPI
-
-        rocket_api = RocketChatAPI(
-            settings={
-                "username": self.config["ROCKETCHAT_USER"],
-                "password": self.config["ROCKETCHAT_PASSWORD"],
-                "domain": self.config["ROCKETCHAT_DOMAIN"],
-            }
-        )
         self.log.debug(
             "Jenkins: received request: {}".format(pformat(dict(request.params)))
         )
         info = dict(request.params)
+        missing = [x for x in ("userId", "job_name", "event") if not info.get(x)]
+        if missing:
+            self.log.warning(
+                "Jenkins: ignoring event missing {}: {}".format(
+                    ", ".join(missing), info
+                )
+            )
+            return "Missing parameters: {}".format(", ".join(missing))
+
+        self._job_crawler.invalidate_if_unknown(info["job_name"])
+        self._job_catalog.invalidate_if_unknown(info["job_name"])
+        self._job_status_table.update_from_event(info)
+        # events of the same user are processed in order, so "started" is never
+        # delivered after "completed"
+        if not self._webhook_dispatcher.submit(info["userId"], info):
+            self.log.warning("Jenkins: event queue full, dropping {}".format(info))
+            return "Queue full"
+        return "OK"
 
-        settings = self.load_user_settings(info["userId"])
+    @webhook("/jenkins/metrics", methods=("GET",), raw=True)
+    def jenkins_metrics(self, request):
+        """
+        Exposes the command traces and Jenkins request statistics in the Prometheus text format,
+        to be scraped from ``/jenkins/metrics``.
+        """
+        lines = []
+        lines += format_prometheus_histograms(
+            "errbot_jenkins_command_duration_seconds",
+            "Duration of the bot commands and of their spans.",
+            [
+                ({"command": command or "", "span": span}, stats)
+                for ((command, span), stats) in self._tracer.get_stats().items()
+            ],
+        )
+        request_stats = sorted(self._request_stats.get_stats().items())
+        lines += format_prometheus_histograms(
+            "errbot_jenkins_request_duration_seconds",
+            "Duration of the requests to Jenkins.",
+            [({"endpoint": endpoint}, stats) for (endpoint, stats) in request_stats],
+        )
+        for name, key, help_text in [
+            (
+                "errbot_jenkins_request_errors_total",
+                "errors",
+                "Requests to Jenkins which failed or answered 5xx.",
+            ),
+            (
+                "errbot_jenkins_response_bytes_total",
+                "bytes",
+                "Size of the responses from Jenkins.",
+            ),
+        ]:
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} counter".format(name))
+            for endpoint, stats in request_stats:
+                lines.append(
+                    "{}{} {}".format(
+                        name,
+                        format_prometheus_labels({"endpoint": endpoint}),
+                        stats[key],
+                    )
+                )
+        return HTTPResponse(
+            "\n".join(lines) + "\n", headers={"Content-Type": PROMETHEUS_CONTENT_TYPE}
+        )
 
-        # move this job info to the first position
-        infos = settings["jobs"]
-        for index, existing_info in enumerate(infos):
-            if existing_info["job_name"] == info["job_name"]:
-                del infos[index]
-        infos.insert(0, info)
+    def _process_jenkins_event(self, info):
+        """
+        Updates the job history of the user and notifies them about a Jenkins event received by
+        the ``jenkins`` webhook.
+        """
+        with self._tracer.trace("webhook", info["userId"]):
+            user = info["userId"]
+            if info["event"] == FLUSH_NOTIFICATIONS_EVENT:
+                self._send_completed_notifications(
+                    user, self._notification_coalescer.pop(user)
+                )
+                return
 
-        # limit number of jobs
-        infos = infos[:15]
-        settings["jobs"] = infos
+            if info["event"] == "jenkins.job.started":
+                info["status"] = ":pray:"
+                self._add_to_job_history(user, info, failure_count=0)
 
-        if info["event"] == "jenkins.job.started":
-            template = JOB_STARTED_MSG
-            status = ":pray:"
-            fmt_kwargs = {"comment": get_job_state_comment("STARTED")}
-        else:
-            template = JOB_COMPLETED_MSG
-            status = ":white_check_mark:" if info["result"] == "SUCCESS" else ":x:"
-            comment = get_job_state_comment(info["result"])
-            info["test_failures"] = self._get_build_test_errors(
-                info["job_name"], info["number"]
-            )
-            if info["test_failures"]:
-                max_show = 10
-                failures_items = [
-                    "**{} failed tests**".format(len(info["test_failures"]))
-                ]
-                failures_items += [
-                    "`{}`".format(x["name"]) for x in info["test_failures"][:max_show]
-                ]
-                if len(info["test_failures"]) > max_show:
-                    failures_items.append(
-                        "... and {} more".format(len(info["test_failures"]) - max_show)
+                # deliver pending notifications first so they are not overtaken by this one
+                self._send_completed_notifications(
+                    user, self._notification_coalescer.pop(user)
+                )
+                fmt_kwargs = {"comment": get_job_state_comment("STARTED")}
+                fmt_kwargs["jenkins_url"] = self.config["JENKINS_URL"]
+                fmt_kwargs.update(info)
+                with self._tracer.span("notify"):
+                    self._get_notifier().send_message(
+                        JOB_STARTED_MSG.format(**fmt_kwargs).strip(), "@{}".format(user)
                     )
-                failures_msg = "\n".join(failures_items)
             else:
-                failures_msg = ""
+                info["status"] = get_emoji_for_completed_job(info["result"])
+                try:
+                    test_failures = self._get_finished_build_test_errors(
+                        info["job_name"], info["number"]
+                    )
+                except self.UnavailableError as e:
+                    # notify anyway, without the test failures
+                    self.log.warning("{}, skipping test failures of {}".format(e, info))
+                    test_failures = UNKNOWN_TEST_FAILURES
+                info["test_failures"] = test_failures.cases
+                info["test_failures_count"] = test_failures.count
+                self._add_to_job_history(user, info, failure_count=test_failures.count)
+
+                window = self._get_config("NOTIFY_COALESCE_SECONDS")
+                if window > 0:
+                    self._notification_coalescer.add(user, info, window)
+                else:
+                    self._send_completed_notifications(user, [info])
+
+            self._notify_watchers(info)
+
+    def _notify_watchers(self, info):
+        """
+        Notifies the users watching the job of the given webhook event about it, except the
+        user who ran the build, who already got the usual notification.
+        """
+        status = get_job_status_from_event(info)
+        if status is None:
+            return
+        watchers = self._job_watches.update(
+            info["job_name"], status, notified_user=info["userId"]
+        )
+        if not watchers:
+            return
+        fmt = "{emoji} [{job_name}]({jenkins_url}/{url}) build **{number}** "
+        if status == "RUNNING":
+            fmt += "started by {userId}"
+        else:
+            fmt += "finished: **{result}**"
+        item = fmt.format(
+            emoji=get_emoji_for_job_status(status),
+            jenkins_url=self.config["JENKINS_URL"],
+            **info
+        )
+        for watcher in watchers:
+            self._send_watch_update(watcher, [item])
 
-            fmt_kwargs = {"test_failures_msg": failures_msg, "comment": comment}
+    def _poll_watched_jobs(self):
+        """
+        Polls the status of all watched jobs in a batch, every ``WATCH_POLL_INTERVAL`` seconds,
+        notifying the watchers of the jobs whose status changed. This is only a fallback for
+        jobs which don't emit webhook events: the status of jobs with recent events comes from
+        the job status table, and their watchers were already notified by ``_notify_watchers``.
+        """
+        job_names = self._job_watches.get_job_names()
+        if not job_names:
+            return
+        with self._tracer.trace("watch_poll"):
+            items_by_user = {}
+            for job_name, status in self._iter_job_statuses(job_names):
+                for watcher in self._job_watches.update(job_name, status):
+                    items_by_user.setdefault(watcher, []).append(
+                        "{emoji} [{job_name}]({url}) is now **{status}**".format(
+                            emoji=get_emoji_for_job_status(status),
+                            job_name=job_name,
+                            url=self._get_job_url(job_name),
+                            status=status or "missing",
+                        )
+                    )
+            for watcher, items in sorted(items_by_user.items()):
+                self._send_watch_update(watcher, items)
 
-        info["status"] = status
-        self.save_user_settings(info["userId"], settings)
+    def _send_watch_update(self, user, items):
+        text = WATCHED_JOBS_MSG.format(jobs_msg="\n".join(items))
+        with self._tracer.span("notify"):
+            self._get_notifier().send_message(text.strip(), "@{}".format(user))
 
-        fmt_kwargs["jenkins_url"] = self.config["JENKINS_URL"]
-        fmt_kwargs.update(info)
-        rocket_api.send_message(
-            template.format(**fmt_kwargs).strip(), "@{}".format(info["userId"])
+    def _add_to_job_history(self, user, info, failure_count):
+        """
+        Moves the job of the given webhook event to the top of the user's job history.
+        """
+        settings = self.load_user_settings(user)
+        entry = JobHistoryEntry(
+            info["job_name"],
+            info.get("number"),
+            info.get("result"),
+            info.get("timestamp"),
+            failure_count,
         )
-        return "OK"
+        settings["jobs"] = add_to_job_history(settings["jobs"], entry)
+        self.save_user_settings(user, settings)
+
+    def _send_completed_notifications(self, user, infos):
+        """
+        Notifies the user about the given completed jobs: a single job gets the usual message,
+        while multiple jobs are summarized in a digest message, with the failed tests of each job.
+        """
+        if not infos:
+            return
+        if len(infos) == 1:
+            info = infos[0]
+            fmt_kwargs = {
+                "test_failures_msg": format_test_failures(
+                    info["test_failures"], info["test_failures_count"]
+                ),
+                "comment": get_job_state_comment(info["result"]),
+                "jenkins_url": self.config["JENKINS_URL"],
+            }
+            fmt_kwargs.update(info)
+            text = JOB_COMPLETED_MSG.format(**fmt_kwargs)
+        else:
+            counts = Counter(info["result"] for info in infos)
+            jobs_items = [
+                "{status} [{job_name}]({jenkins_url}/{url}) build **{number}**".format(
+                    jenkins_url=self.config["JENKINS_URL"], **info
+                )
+                for info in infos
+            ]
+            text = JOBS_COMPLETED_DIGEST_MSG.format(
+                count=len(infos),
+                results_msg=", ".join(
+                    "{} {} {}".format(get_emoji_for_completed_job(result), n, result)
+                    for (result, n) in counts.most_common()
+                ),
+                jobs_msg="\n".join(jobs_items),
+                test_failures_msg="\n\n".join(
+                    "{}: {}".format(
+                        info["job_name"],
+                        format_test_failures(
+                            info["test_failures"], info["test_failures_count"]
+                        ),
+                    )
+                    for info in infos
+                    if info["test_failures_count"]
+                ),
+            )
+        with self._tracer.span("notify"):
+            self._get_notifier().send_message(text.strip(), "@{}".format(user))
+
+    def _on_notification_window_end(self, user):
+        # flush through the dispatcher so notifications keep the order of the user events
+        event = {"event": FLUSH_NOTIFICATIONS_EVENT, "userId": user}
+        if not self._webhook_dispatcher.submit(user, event):
+            self._send_completed_notifications(
+                user, self._notification_coalescer.pop(user)
+            )
+
+    def _get_notifier(self):
+        """
+        Returns the ``RocketChatNotifier`` used to send notifications, shared by all webhook
+        events so the authentication token and connection are reused.
+        """
+        with self._notifier_lock:
+            if self._notifier is None:
+                self._notifier = RocketChatNotifier(
+                    domain=self.config["ROCKETCHAT_DOMAIN"],
+                    username=self.config["ROCKETCHAT_USER"],
+                    password=self.config["ROCKETCHAT_PASSWORD"],
+                    timeout=self._get_config("JENKINS_REQUEST_TIMEOUT"),
+                )
+            return self._notifier
+
+    def _describe_error(self, error):
+        """
+        Returns a short description of an error to show in chat.
+        """
+        if isinstance(error, self.ResponseError):
+            response = error.response
+            return "Jenkins answered {} {}".format(
+                response.status_code, response.reason or ""
+            ).strip()
+        return str(error) or type(error).__name__
 
     def _get_job_url(self, job_name):
-        return "{}/job/{}".format(self.config["JENKINS_URL"], job_name)
+        return "{}/{}".format(self.config["JENKINS_URL"], get_job_path(job_name))
+
+    def _get_build_test_errors(self, job_name, build_number, max_cases=10):
+        """
+        Returns a ``TestFailures`` with the number of non-passing test cases of the given build,
+        from all test suites, along with the first ``max_cases`` of them, or
+        ``UNKNOWN_TEST_FAILURES`` if the build has no test report or it could not be parsed.
 
-    def _get_build_test_errors(self, job_name, build_number):
+        The test report is parsed while it is downloaded, so huge reports are never held in
+        memory as a whole.
+        """
         if build_number is None:
             build_number = "lastBuild"
 
-        url = "job/{job_name}/{build_number}/testReport/api/json".format(
-            job_name=job_name, build_number=build_number
+        url = "{job_path}/{build_number}/testReport/api/json".format(
+            job_path=get_job_path(job_name), build_number=build_number
         )
-        try:
-            result = self._get_jenkins_json_request(
-                url, params={"tree": "suites[cases[name,status]]"}
+        with self._tracer.span("test_report"):
+            r = self._jenkins_request(
+                "GET",
+                url,
+                auth=(self.config["JENKINS_USERNAME"], self.config["JENKINS_TOKEN"]),
+                params={"tree": "suites[cases[name,status]]"},
+                stream=True,
             )
-        except self.ResponseError as e:
-            if e.response.status_code == 404:
-                return []
-            raise
-        try:
-            cases = result["suites"][0]["cases"]
-        except:
-            self.log.exception("Failed to get cases: {}".format(url))
-            return []
-
-        errors = []
-        for case in cases:
-            if case["status"] not in ["PASSED", "SKIPPED", "FIXED"]:
-                errors.append(case)
+            with closing(r):
+                if r.status_code == 404:
+                    return UNKNOWN_TEST_FAILURES
+                if r.status_code not in [200, 201]:
+                    raise self.ResponseError(
+                        "json request to {url}".format(url=r.url), r
+                    )
+                try:
+                    return summarize_test_report(iter_response_text(r), max_cases)
+                except (ValueError, KeyError, TypeError):
+                    self.log.exception("Failed to get cases: {}".format(url))
+                    return UNKNOWN_TEST_FAILURES
 
-        return errors
+    def _get_finished_build_test_errors(self, job_name, build_number):
+        """
+        Same as ``_get_build_test_errors``, for a build which is known to be finished: its
+        failures can never change, so they are kept in the test failures cache (unless they
+        are ``UNKNOWN_TEST_FAILURES``, which are fetched again next time).
+        """
+        test_failures = self._test_failures_cache.get(job_name, build_number)
+        if test_failures is None:
+            test_failures = self._get_build_test_errors(job_name, build_number)
+            if test_failures is not UNKNOWN_TEST_FAILURES:
+                self._test_failures_cache.set(job_name, build_number, test_failures)
+        return test_failures
 
     def _fetch_all_job_names(self):
+        """
+        Returns the full names of all jobs, including the ones inside folders and multibranch
+        projects (``folder/job``).
+
+        Called on each job catalog refresh, so folders fetched more than ``JOB_CATALOG_TTL``
+        seconds ago are fetched again; conditional requests make that cheap for unchanged folders.
+        """
+        return self._job_crawler.crawl(ttl=self._get_config("JOB_CATALOG_TTL"))
+
+    def _fetch_folders_items(self, folders):
+        """
+        Fetches the items of the given folders concurrently (see ``_fetch_folder_items``).
+        """
+        if self._use_async_jenkins():
+            client = self._get_async_jenkins()
+            user = self._tracer.get_user()
+            results = client.map(
+                lambda folder: client.fetch_folder_items(folder, user), folders
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            return results
+        return self._map_concurrently(self._fetch_folder_items, folders)
+
+    def _fetch_folder_items(self, folder):
+        """
+        Returns ``(name, is_folder)`` for each item directly inside the given folder (``""`` for
+        the top-level items).
+        """
         result = self._get_jenkins_json_request(
-            "api/json", params={"tree": "jobs[fullName]"}
+            get_folder_api_url(folder), params={"tree": "jobs[name]"}
         )
-        return [job["fullName"] for job in result["jobs"]]
+        return parse_folder_items(result)
+
+    def _get_job_name_index(self):
+        """
+        Returns the ``JobNameIndex`` of all jobs from the job catalog, which is refreshed from
+        Jenkins at most every ``JOB_CATALOG_TTL`` seconds.
+        """
+        with self._tracer.span("catalog_fetch"):
+            return self._job_catalog.get_index(ttl=self._get_config("JOB_CATALOG_TTL"))
 
     def _find_all_job_names_filtered(self, args):
-        all_job_names = self._fetch_all_job_names()
+        job_name_index = self._get_job_name_index()
         self.log.debug(
-            "found {} jobs in total, filtering by {!r}".format(len(all_job_names), args)
+            "found {} jobs in total, filtering by {!r}".format(
+                len(job_name_index), args
+            )
         )
 
-        return sorted(filter_jobs_by_find_string(all_job_names, args))
+        with self._tracer.span("filter"):
+            return sorted(job_name_index.find(args))
 
     def _get_jenkins_json_request(self, query_url, params=None):
         """
         returns None if fails to request
+
+        Identical requests made concurrently share a single request to Jenkins and its parsed
+        result, so callers must not modify the returned object.
+        """
+        key = (query_url, tuple(sorted((params or {}).items())))
+        return self._single_flight.do(
+            key, lambda: self._do_get_jenkins_json_request(query_url, params, key)
+        )
+
+    def _do_get_jenkins_json_request(self, query_url, params, key):
+        """
+        Makes the request for ``_get_jenkins_json_request``: when an earlier response had
+        validators (``ETag``/``Last-Modified``) the request is conditional, and the body parsed
+        back then is reused if Jenkins answers 304 Not Modified, or if Jenkins is unavailable.
         """
         user = self.config["JENKINS_USERNAME"]
         token = self.config["JENKINS_TOKEN"]
-        url = self.config["JENKINS_URL"]
-        if not url.endswith("/"):
-            url += "/"
-        url += query_url
-
-        r = requests.get(url, auth=(user, token), params=params)
+        cached = self._json_response_cache.get(key)
+        headers = {"Accept-Encoding": "gzip"}
+        if cached is not None:
+            headers.update(cached.validators)
+        try:
+            r = self._jenkins_request(
+                "GET", query_url, auth=(user, token), params=params, headers=headers
+            )
+        except self.UnavailableError as e:
+            if cached is None:
+                raise
+            self.log.warning("{}, using cached response of {}".format(e, query_url))
+            return cached.value
+        if r.status_code == 304 and cached is not None:
+            self._json_response_cache.record_not_modified()
+            return cached.value
+        url = r.url
         if r.status_code not in [200, 201]:
             self.log.debug("_get_jenkins_json_request invalid response: {}".format(r))
             raise self.ResponseError("json request to {url}".format(url=url), r)
-        return json.loads(r.text)
+        result = json.loads(r.text)
+        self._json_response_cache.set(key, r.headers, result)
+        return result
 
-    def _fetch_job_status(self, job_name, build=None):
+    def _jenkins_request(self, method, query_url, auth, user=None, **kwargs):
         """
-        Fetch the status of the given job name:
-        * 'SUCCESS'
-        * 'FAILURE'
-        * 'ABORTED'
-        * 'UNSTABLE'
-        * 'NOT_STARTED'
-        * 'RUNNING'
+        Makes a request to the Jenkins API through the shared session (see
+        ``_jenkins_request_attempt``), retrying it up to ``JENKINS_RETRIES`` times with
+        exponential backoff.
+
+        GET requests are retried on connection errors and 5xx responses, other requests only
+        when the connection could not be established; timeouts are never retried. Each attempt
+        goes through the rate limiter and the circuit breaker, so retries stop as soon as the
+        circuit opens.
+        """
+        if user is None:
+            user = self._tracer.get_user()
+        retries = self._get_config("JENKINS_RETRIES")
+        failure = None
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(
+                    self._get_config("JENKINS_RETRY_BACKOFF") * 2 ** (attempt - 1)
+                )
+            try:
+                r = self._jenkins_request_attempt(
+                    method, query_url, auth, user, **kwargs
+                )
+            except self.UnavailableError:
+                if failure is None:
+                    raise
+                break
+            except requests.ConnectionError as e:
+                if attempt == retries or not is_retriable_jenkins_error(method, e):
+                    raise
+                failure = e
+            else:
+                if (
+                    attempt == retries
+                    or method != "GET"
+                    or r.status_code not in RETRY_STATUS_CODES
+                ):
+                    return r
+                r.close()
+                failure = r
+        # the circuit opened (or the rate limit ran out) while retrying
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    def _jenkins_request_attempt(self, method, query_url, auth, user, **kwargs):
+        """
+        Makes a single request to the Jenkins API through the shared session, recording its
+        latency and the size of its response.
+
+        Requests wait for the rate limit, counting against the share of ``user``, and fail fast
+        with ``UnavailableError`` while the circuit breaker is open.
+        """
+        url = self.config["JENKINS_URL"]
+        if not url.endswith("/"):
+            url += "/"
+        url += query_url
+
+        delay = reserve_jenkins_request(
+            self._circuit_breaker,
+            self._rate_limiter,
+            user,
+            max_delay=self._get_config("JENKINS_REQUEST_TIMEOUT"),
+            error_class=self.UnavailableError,
+        )
+        if delay:
+            time.sleep(delay)
+
+        session = self._get_jenkins_session()
+        start = time.monotonic()
+        ok = False
+        size = 0
+        try:
+            try:
+                r = session.request(
+                    method,
+                    url,
+                    auth=auth,
+                    timeout=self._get_config("JENKINS_REQUEST_TIMEOUT"),
+                    **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                self._circuit_breaker.record(ok=False)
+                raise
+            ok = r.status_code < 500
+            self._circuit_breaker.record(ok)
+            if kwargs.get("stream"):
+                # the body is not downloaded yet, count its declared length
+                size = int(r.headers.get("Content-Length") or 0)
+            else:
+                size = len(r.content)
+            return r
+        finally:
+            self._request_stats.record(
+                "{} {}".format(method, get_endpoint_name(query_url)),
+                time.monotonic() - start,
+                ok,
+                size,
+            )
+
+    def _get_jenkins_session(self):
+        """
+        Returns the ``requests.Session`` shared by all requests to Jenkins, which keeps
+        connections alive. The session itself doesn't retry requests, ``_jenkins_request`` does.
+
+        Authentication is passed on each request, so the same connection pool serves both the
+        bot's own requests and the ones made on behalf of users.
+        """
+        with self._jenkins_session_lock:
+            if self._jenkins_session is None:
+                adapter = HTTPAdapter(
+                    pool_maxsize=self._get_config("JENKINS_POOL_SIZE"), max_retries=0
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._jenkins_session = session
+            return self._jenkins_session
+
+    def _use_async_jenkins(self):
+        return bool(self._get_config("JENKINS_ASYNC_CLIENT")) and aiohttp is not None
+
+    def _get_async_jenkins(self):
+        """
+        Returns the ``AsyncJenkinsClient`` used to fan out requests to Jenkins when
+        ``JENKINS_ASYNC_CLIENT`` is enabled, created on first use.
+        """
+        with self._async_jenkins_lock:
+            if self._async_jenkins is None:
+                self._async_jenkins = AsyncJenkinsClient(
+                    url=self.config["JENKINS_URL"],
+                    auth=(
+                        self.config["JENKINS_USERNAME"],
+                        self.config["JENKINS_TOKEN"],
+                    ),
+                    timeout=self._get_config("JENKINS_REQUEST_TIMEOUT"),
+                    pool_size=self._get_config("JENKINS_POOL_SIZE"),
+                    retries=self._get_config("JENKINS_RETRIES"),
+                    retry_backoff=self._get_config("JENKINS_RETRY_BACKOFF"),
+                    request_stats=self._request_stats,
+                    rate_limiter=self._rate_limiter,
+                    circuit_breaker=self._circuit_breaker,
+                    error_class=self.ResponseError,
+                    unavailable_error_class=self.UnavailableError,
+                    job_parameters_cache=self._job_parameters_cache,
+                    job_parameters_ttl=self._get_config("JOB_PARAMETERS_TTL"),
+                )
+            return self._async_jenkins
+
+    def _fetch_job_status(self, job_name, build=None):
+        """
+        Fetch the status of the given job name:
+        * 'SUCCESS'
+        * 'FAILURE'
+        * 'ABORTED'
+        * 'UNSTABLE'
+        * 'NOT_STARTED'
+        * 'RUNNING'
         * None: does not exist
         """
         if build is None:
             build = "lastBuild"
         try:
             response = self._get_jenkins_json_request(
-                "job/{job_name}/{build}/api/json".format(
-                    job_name=job_name, build=build
+                "{job_path}/{build}/api/json".format(
+                    job_path=get_job_path(job_name), build=build
                 ),
                 params={"tree": "result"},
             )
@@ -450,7 +1492,7 @@ class JenkinsBot(BotPlugin):
             if e.response.status_code == 404:
                 try:
                     self._get_jenkins_json_request(
-                        "job/{job_name}/api/json".format(job_name=job_name)
+                        "{job_path}/api/json".format(job_path=get_job_path(job_name))
                     )
                     return "NOT_STARTED"
                 except self.ResponseError as e:
@@ -466,53 +1508,134 @@ class JenkinsBot(BotPlugin):
                 result = "RUNNING"
             return result
 
-    def _get_job_status_emoji(self, job_name):
-        return get_emoji_for_job_status(self._fetch_job_status(job_name))
+    def _fetch_job_statuses(self, job_names):
+        """
+        Fetch the status of all the given job names, returning the statuses in the same order as
+        ``job_names`` (see ``_fetch_job_status``).
 
-    def _get_job_parameters(self, job_name):
-        query_url = "job/{job_name}/api/json".format(job_name=job_name)
-        result = self._get_jenkins_json_request(
-            query_url, params={"tree": "actions[parameterDefinitions[name]]"}
+        The statuses of all jobs are obtained with a single request, falling back to fetching
+        the status of each job concurrently only for jobs missing from that response.
+        """
+        statuses = dict(self._iter_job_statuses(job_names))
+        return [statuses[x] for x in job_names]
+
+    def _iter_job_statuses(self, job_names):
+        """
+        Generates ``(job_name, status)`` for each of the given job names as soon as its status is
+        known: first the jobs with a recent webhook event in the job status table, then the jobs
+        found in the bulk status request, then the missing ones as their individual requests
+        complete.
+
+        While Jenkins is unavailable the jobs are listed anyway, with ``UNKNOWN_STATUS``.
+        """
+        known = self._job_status_table.get_statuses(
+            job_names, ttl=self._get_config("JOB_STATUS_TTL")
         )
-        actions = result.get("actions")
-        if actions:
-            for action in actions:
-                parameter_definitions = action.get("parameterDefinitions", [])
-                return [p["name"] for p in parameter_definitions]
-        return []
+        yield from known.items()
+        job_names = [x for x in job_names if x not in known]
+        if not job_names:
+            return
+
+        try:
+            statuses = self._fetch_bulk_job_statuses()
+        except self.UnavailableError as e:
+            self.log.warning("{}, listing jobs with unknown status".format(e))
+            statuses = dict.fromkeys(job_names, UNKNOWN_STATUS)
+        missing = []
+        for job_name in job_names:
+            if job_name in statuses:
+                yield job_name, statuses[job_name]
+            else:
+                missing.append(job_name)
+        if missing:
+            self.log.debug("fetching status of {} jobs one by one".format(len(missing)))
+            if self._use_async_jenkins():
+                client = self._get_async_jenkins()
+                user = self._tracer.get_user()
+
+                async def fetch_job_status(job_name):
+                    try:
+                        return await client.fetch_job_status(job_name, user)
+                    except self.UnavailableError:
+                        return UNKNOWN_STATUS
+
+                yield from client.iter_completed(fetch_job_status, missing)
+            else:
+
+                def fetch_job_status(job_name):
+                    try:
+                        return self._fetch_job_status(job_name)
+                    except self.UnavailableError:
+                        return UNKNOWN_STATUS
+
+                yield from self._map_concurrently_unordered(fetch_job_status, missing)
 
-    def _get_job_builds(self, job_name):
+    def _fetch_bulk_job_statuses(self):
+        """
+        Fetch the status of all jobs in a single request, returning a dict mapping job name to its
+        status (see ``_fetch_job_status``).
+        """
         result = self._get_jenkins_json_request(
-            "job/{}/api/json".format(job_name), params={"tree": "builds[number]"}
+            "api/json",
+            params={"tree": "jobs[fullName,color,lastBuild[result,building]]"},
         )
-        if result is None or "builds" not in result:
-            return None
+        return {
+            job["fullName"]: get_job_status_from_job_info(job) for job in result["jobs"]
+        }
 
-        return [x["number"] for x in result["builds"]]
+    def _map_concurrently(self, func, items):
+        """
+        Calls ``func`` for each item using a pool of at most ``JENKINS_MAX_WORKERS`` threads,
+        returning the results in the same order as ``items``.
+        """
+        items = list(items)
+        func = self._tracer.bind(func)
+        max_workers = min(self._get_config("JENKINS_MAX_WORKERS"), len(items))
+        if max_workers <= 1:
+            return [func(x) for x in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def _map_concurrently_unordered(self, func, items):
+        """
+        Like ``_map_concurrently``, but generates ``(item, result)`` in the order the calls
+        complete.
+        """
+        items = list(items)
+        func = self._tracer.bind(func)
+        max_workers = min(self._get_config("JENKINS_MAX_WORKERS"), len(items))
+        if max_workers <= 1:
+            for item in items:
+                yield item, func(item)
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(func, x): x for x in items}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _get_job_status_emoji(self, job_name):
+        return get_emoji_for_job_status(self._fetch_job_status(job_name))
 
-    def _get_job_build_parameters_values(self, job_name, build_number="lastBuild"):
-        query = "job/{}/{}/api/json".format(job_name, build_number)
+    def _get_job_metadata(self, job_name):
+        """
+        Fetch in a single request the metadata needed to trigger a job: the number of its last
+        build, the names of its parameters and the parameter values used by its last build.
+        """
         result = self._get_jenkins_json_request(
-            query, params={"tree": "actions[parameters[name,value]]"}
+            "{}/api/json".format(get_job_path(job_name)),
+            params={"tree": JOB_METADATA_TREE},
         )
-        actions = result.get("actions", [])
-        for action in actions:
-            parameters = action.get("parameters")
-            if parameters:
-                return [(p["name"], p["value"]) for p in parameters]
-        return []
+        metadata = parse_job_metadata(result)
+        self._job_parameters_cache.set(job_name, metadata.parameter_names)
+        return metadata
 
     def _post_jenkins_json_request(self, post_url, user):
-        jenkins_url = self.config["JENKINS_URL"]
         token = self.load_user_settings(user)["token"]
         if not token:
             raise RuntimeError("Token for user {} not configured".format(user))
 
-        if not jenkins_url.endswith("/"):
-            jenkins_url += "/"
-
-        post_url = jenkins_url + post_url
-        r = requests.post(post_url, auth=(user, token))
+        r = self._jenkins_request("POST", post_url, auth=(user, token), user=user)
+        post_url = r.url
         self.log.debug(
             "post_jenkins_json_request: url {} = {}".format(post_url, r.status_code)
         )
@@ -526,27 +1649,29 @@ class JenkinsBot(BotPlugin):
 
     def _trigger_job(self, job_name, user, parameters=None):
         if parameters is not None:
-            post_url = "job/{}/buildWithParameters?{}".format(job_name, parameters)
+            post_url = "{}/buildWithParameters?{}".format(
+                get_job_path(job_name), parameters
+            )
             self._post_jenkins_json_request(post_url, user)
+            return
 
-        else:
-            builds = self._get_job_builds(job_name)
-            parameters = self._get_job_parameters(job_name)
-
-            never_built = not builds
-            takes_parameters = bool(parameters)
-            if never_built or not takes_parameters:
-                post_url = (
-                    "job/{}/build" if not parameters else "job/{}/buildWithParameters"
-                )
-                post_url = post_url.format(job_name)
-                self._post_jenkins_json_request(post_url, user)
-            elif takes_parameters:
-                parameters_values = self._get_job_build_parameters_values(job_name)
-                post_url = "job/{}/buildWithParameters?{}".format(
-                    job_name, urlencode(parameters_values)
+        parameter_names = self._job_parameters_cache.get(
+            job_name, ttl=self._get_config("JOB_PARAMETERS_TTL")
+        )
+        if parameter_names == []:
+            # known to take no parameters, no need to ask Jenkins anything else
+            try:
+                self._post_jenkins_json_request(
+                    "{}/build".format(get_job_path(job_name)), user
                 )
-                self._post_jenkins_json_request(post_url, user)
+            except self.ResponseError:
+                # the job might have changed since its parameters were cached
+                self._job_parameters_cache.pop(job_name)
+                raise
+            return
+
+        metadata = self._get_job_metadata(job_name)
+        self._post_jenkins_json_request(get_trigger_url(job_name, metadata), user)
 
 
 def get_job_state_comment(key):
@@ -554,6 +1679,402 @@ def get_job_state_comment(key):
     return random.choice(comments)
 
 
+def get_job_status_from_job_info(job_info):
+    """
+    Returns the status of a job (see ``JenkinsBot._fetch_job_status``) given its information
+    as returned by the ``jobs[fullName,color,lastBuild[result,building]]`` tree query.
+    """
+    last_build = job_info.get("lastBuild")
+    if last_build is None:
+        return "NOT_STARTED"
+    if last_build.get("building") or last_build.get("result") is None:
+        return "RUNNING"
+    return last_build["result"]
+
+
+def get_job_status_from_event(info):
+    """
+    Returns the status of a job (see ``JenkinsBot._fetch_job_status``) after the given
+    ``jenkins`` webhook event, or None if the event doesn't tell.
+    """
+    if info["event"] == "jenkins.job.started":
+        return "RUNNING"
+    if info["event"] == "jenkins.job.completed" and info.get("result"):
+        return info["result"]
+    return None
+
+
+def get_folder_api_url(folder):
+    return "{}/api/json".format(get_job_path(folder)) if folder else "api/json"
+
+
+def parse_folder_items(folder_info):
+    """
+    Returns ``(name, is_folder)`` for each item of a folder given its information as returned
+    by the ``jobs[name]`` tree query.
+    """
+    return [
+        (job["name"], job.get("_class") in FOLDER_CLASSES)
+        for job in folder_info["jobs"]
+    ]
+
+
+def parse_job_metadata(job_info):
+    """
+    Returns the ``JobMetadata`` of a job given its information as returned by the
+    ``JOB_METADATA_TREE`` tree query.
+    """
+    parameter_names = []
+    for action in job_info.get("actions") or []:
+        parameter_definitions = (action or {}).get("parameterDefinitions")
+        if parameter_definitions:
+            parameter_names = [p["name"] for p in parameter_definitions]
+            break
+
+    last_build = job_info.get("lastBuild")
+    last_build_number = None
+    last_parameters_values = []
+    if last_build is not None:
+        last_build_number = last_build.get("number")
+        for action in last_build.get("actions") or []:
+            parameters = (action or {}).get("parameters")
+            if parameters:
+                last_parameters_values = [(p["name"], p["value"]) for p in parameters]
+                break
+    return JobMetadata(last_build_number, parameter_names, last_parameters_values)
+
+
+def get_trigger_url(job_name, metadata):
+    """
+    Returns the url used to trigger a new build of the given job, reusing the parameter values
+    of its last build if the job takes parameters.
+    """
+    never_built = metadata.last_build_number is None
+    takes_parameters = bool(metadata.parameter_names)
+    if not takes_parameters:
+        return "{}/build".format(get_job_path(job_name))
+    if never_built:
+        return "{}/buildWithParameters".format(get_job_path(job_name))
+    return "{}/buildWithParameters?{}".format(
+        get_job_path(job_name), urlencode(metadata.last_parameters_values)
+    )
+
+
+def get_endpoint_name(query_url):
+    """
+    Returns the name used to group statistics of requests to the given Jenkins API url,
+    replacing job names and build numbers by ``*``:
+
+    ``job/eden-win64/12/api/json?tree=result`` -> ``job/*/*/api/json``
+    """
+    path = query_url.split("?", 1)[0]
+    path = re.sub(r"(^|/)job/[^/]+", r"\1job/*", path)
+    return re.sub(r"/\d+(?=/|$)", "/*", path)
+
+
+def format_size(size):
+    """
+    Returns a human readable size in bytes: ``1536`` -> ``1.5 KiB``.
+    """
+    if size < 1024:
+        return "{} B".format(size)
+    for unit in ("KiB", "MiB"):
+        size /= 1024.0
+        if size < 1024 or unit == "MiB":
+            return "{:.1f} {}".format(size, unit)
+
+
+def get_histogram_percentile(stats, percentile):
+    """
+    Returns an upper bound of the given percentile of the values in a histogram (see
+    ``Histogram.get_stats``): the bound of the first bucket reaching it, or the maximum value
+    if it is beyond all buckets.
+    """
+    rank = percentile / 100.0 * stats["count"]
+    for bound, count in stats["buckets"]:
+        if count >= rank:
+            return min(bound, stats["max"])
+    return stats["max"]
+
+
+def format_histogram_stats(stats):
+    """
+    Summarizes a latency histogram (see ``Histogram.get_stats``) in a single line.
+    """
+    return (
+        "{count} calls, avg {avg:.0f} ms, p50 {p50:.0f} ms, p90 {p90:.0f} ms, "
+        "p99 {p99:.0f} ms, max {max:.0f} ms"
+    ).format(
+        count=stats["count"],
+        avg=stats["total"] / stats["count"] * 1000,
+        p50=get_histogram_percentile(stats, 50) * 1000,
+        p90=get_histogram_percentile(stats, 90) * 1000,
+        p99=get_histogram_percentile(stats, 99) * 1000,
+        max=stats["max"] * 1000,
+    )
+
+
+def format_prometheus_labels(labels):
+    """
+    Formats labels for the Prometheus text format: ``{"endpoint": "GET api/json"}`` ->
+    ``{endpoint="GET api/json"}``.
+    """
+    items = []
+    for name, value in sorted(labels.items()):
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        items.append('{}="{}"'.format(name, value))
+    return "{{{}}}".format(",".join(items))
+
+
+def format_prometheus_histograms(name, help_text, labeled_stats):
+    """
+    Returns the lines of a Prometheus histogram metric, given a list of ``(labels, stats)``
+    (see ``Histogram.get_stats``).
+    """
+    lines = ["# HELP {} {}".format(name, help_text), "# TYPE {} histogram".format(name)]
+    for labels, stats in sorted(labeled_stats, key=lambda x: sorted(x[0].items())):
+        for bound, count in stats["buckets"] + [("+Inf", stats["count"])]:
+            bucket_labels = dict(labels, le=str(bound))
+            lines.append(
+                "{}_bucket{} {}".format(
+                    name, format_prometheus_labels(bucket_labels), count
+                )
+            )
+        lines.append(
+            "{}_sum{} {}".format(name, format_prometheus_labels(labels), stats["total"])
+        )
+        lines.append(
+            "{}_count{} {}".format(
+                name, format_prometheus_labels(labels), stats["count"]
+            )
+        )
+    return lines
+
+
+def reserve_jenkins_request(
+    circuit_breaker, rate_limiter, user, max_delay, error_class
+):
+    """
+    Checks whether a request to Jenkins can be made on behalf of ``user``, returning how many
+    seconds to wait for the rate limit before making it.
+
+    Raises ``error_class`` (``JenkinsBot.UnavailableError``) if the circuit breaker is open or
+    the wait would be longer than ``max_delay`` seconds.
+    """
+    if not circuit_breaker.allow():
+        raise error_class(
+            JENKINS_DOWN_MSG.format(seconds=circuit_breaker.get_retry_after())
+        )
+    delay = rate_limiter.reserve(user, max_delay)
+    if delay is None:
+        raise error_class(RATE_LIMITED_MSG)
+    return delay
+
+
+def is_retriable_jenkins_error(method, error):
+    """
+    Returns True if a request which failed with the given ``requests.ConnectionError`` can be
+    made again: timeouts are never retried, and requests other than GET only when the connection
+    could not be established, so a build is never triggered twice.
+    """
+    if isinstance(error, requests.Timeout):
+        return False
+    if method == "GET":
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def get_job_path(job_name):
+    """
+    Returns the path of the given job in the Jenkins urls, with each folder of the job's full
+    name as a separate ``job`` segment:
+
+    ``eden/master-win64`` -> ``job/eden/job/master-win64``
+    """
+    return "/".join("job/{}".format(x) for x in job_name.split("/"))
+
+
+def load_job_history(stored_history):
+    """
+    Returns the ``JobHistoryEntry`` objects of a job history as stored in the user settings.
+
+    Entries are stored as plain tuples; older versions stored the whole webhook parameters dict.
+    """
+    history = []
+    for stored in stored_history:
+        if isinstance(stored, dict):
+            failure_count = stored.get("test_failures_count")
+            if failure_count is None:
+                failure_count = len(stored.get("test_failures") or [])
+            entry = JobHistoryEntry(
+                stored["job_name"],
+                stored.get("number"),
+                stored.get("result"),
+                stored.get("timestamp"),
+                failure_count,
+            )
+        else:
+            entry = JobHistoryEntry(*stored)
+        history.append(entry)
+    return history
+
+
+def add_to_job_history(stored_history, entry, max_entries=15):
+    """
+    Returns a new job history, to be stored in the user settings, with ``entry`` as its first
+    entry and without any other entry of the same job.
+    """
+    history = OrderedDict((x.job_name, x) for x in load_job_history(stored_history))
+    history[entry.job_name] = entry
+    history.move_to_end(entry.job_name, last=False)
+    return [tuple(x) for x in islice(history.values(), max_entries)]
+
+
+def get_emoji_for_completed_job(result):
+    return ":white_check_mark:" if result == "SUCCESS" else ":x:"
+
+
+def format_test_failures(test_failures, count, max_show=10):
+    """
+    Formats the names of the given failed test cases, out of a total of ``count`` failures.
+    """
+    if not count:
+        return ""
+    shown = test_failures[:max_show]
+    failures_items = ["**{} failed tests**".format(count)]
+    failures_items += ["`{}`".format(x["name"]) for x in shown]
+    if count > len(shown):
+        failures_items.append("... and {} more".format(count - len(shown)))
+    return "\n".join(failures_items)
+
+
+def summarize_test_report(chunks, max_cases):
+    """
+    Returns the ``TestFailures`` of a test report given as text chunks (see
+    ``iter_failed_test_cases``), with the first ``max_cases`` failed test cases.
+
+    Test cases are only decoded until ``max_cases`` failed ones are found; the rest of the report
+    is just scanned to count the failures (see ``FailedTestCounter``), which is several times
+    faster than decoding every case.
+    """
+    counter = FailedTestCounter()
+
+    def iter_counted_chunks():
+        for chunk in chunks:
+            counter.feed(chunk)
+            yield chunk
+
+    counted_chunks = iter_counted_chunks()
+    cases = list(islice(iter_failed_test_cases(counted_chunks), max_cases))
+    for _ in counted_chunks:
+        pass
+    return TestFailures(counter.count, cases)
+
+
+class FailedTestCounter:
+    """
+    Counts the test cases which did not pass in a test report fed as text chunks, by looking
+    for their ``"status"`` members instead of decoding the cases.
+
+    Quotes inside test names are escaped (``\\"``), so ``"status":`` only appears in the text
+    as a member of a test case.
+    """
+
+    # enough to hold a "status" member split between two chunks
+    TAIL_SIZE = 256
+
+    def __init__(self):
+        self.count = 0
+        self._buffer = ""
+
+    def feed(self, text):
+        buffer = self._buffer + text
+        end = 0
+        for match in _FAILED_STATUS_RE.finditer(buffer):
+            self.count += 1
+            end = match.end()
+        # keep the text after the last match, which might hold the start of the next one
+        self._buffer = buffer[max(end, len(buffer) - self.TAIL_SIZE) :]
+
+
+def iter_response_text(response, chunk_size=64 * 1024):
+    """
+    Yields the body of a streamed ``requests.Response`` as text chunks.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+        errors="replace"
+    )
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def iter_failed_test_cases(chunks):
+    """
+    Yields the test cases which did not pass from all suites of a test report, given as text
+    chunks of the JSON returned by ``testReport/api/json?tree=suites[cases[name,status]]``.
+
+    Only one test case at a time is decoded, so memory usage doesn't depend on the report size.
+    """
+    for case in iter_test_report_cases(chunks):
+        if case["status"] not in ["PASSED", "SKIPPED", "FIXED"]:
+            yield case
+
+
+def iter_test_report_cases(chunks):
+    """
+    Incrementally parses a test report, yielding each test case object of every ``cases`` array.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    in_cases = False
+    while True:
+        if not in_cases:
+            match = _CASES_START_RE.search(buffer, pos)
+            if match is not None:
+                in_cases = True
+                pos = match.end()
+                continue
+            # keep enough of the end of the buffer for a match split between two chunks
+            buffer = buffer[max(pos, len(buffer) - 32) :]
+            pos = 0
+        else:
+            pos = _SEPARATORS_RE.match(buffer, pos).end()
+            if pos < len(buffer):
+                if buffer[pos] == "]":
+                    in_cases = False
+                    pos += 1
+                    continue
+                try:
+                    case, pos = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    pass  # incomplete object, needs more data
+                else:
+                    yield case
+                    continue
+            buffer = buffer[pos:]
+            pos = 0
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            if in_cases:
+                raise ValueError("Unexpected end of test report")
+            return
+        buffer += chunk
+
+
+_CASES_START_RE = re.compile(r'"cases"\s*:\s*\[')
+_FAILED_STATUS_RE = re.compile(r'"status"\s*:\s*"(?!(?:PASSED|SKIPPED|FIXED)")[A-Z_]*"')
+_SEPARATORS_RE = re.compile(r"[\s,]*")
+
+
 def get_emoji_for_job_status(result):
     return {
         "SUCCESS": ":white_check_mark:",
@@ -562,42 +2083,1636 @@ def get_emoji_for_job_status(result):
         "NOT_STARTED": ":white_circle:",
         "UNSTABLE": ":warning:",
         "RUNNING": ":arrows_counterclockwise:",
+        UNKNOWN_STATUS: ":grey_question:",
         None: ":grey_question:",
     }.get(result, result)
 
 
 def filter_jobs_by_find_string(job_names, input_factors):
+    return JobNameIndex(job_names).find(input_factors)
+
+
+def receive_job_statuses(results, statuses, timeout):
+    """
+    Moves the ``(job_name, status)`` items put in the ``results`` queue by
+    ``_put_job_statuses`` to the ``statuses`` dict, for at most ``timeout`` seconds.
+
+    Returns True if all statuses were received.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            item = results.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            return False
+        if item is None:
+            return True
+        if isinstance(item, Exception):
+            raise item
+        job_name, status = item
+        statuses[job_name] = status
+
+
+def parse_page_argument(args):
+    """
+    Removes the ``--page N`` (or ``--page=N``) option from the given `!find` arguments,
+    returning the remaining arguments and the (1-based) page number.
+    """
     factors = []
-    for factor in input_factors:
-        if factor.startswith('"') and factor.endswith('"'):
-            word = factor[1:-1].lower()
-            job_names = [x for x in job_names if fnmatch(x.lower(), word)]
-        else:
-            factor = factor.lower()
-            factors.extend(factor.split("-"))
-
-    and_factors = []
-    or_factors = []
-    for factor in factors:
-        if "," in factor:
-            or_factors.extend(factor.split(","))
+    page = 1
+    args = iter(args)
+    for arg in args:
+        if arg == "--page":
+            value = next(args, "")
+        elif arg.startswith("--page="):
+            value = arg[len("--page=") :]
         else:
-            and_factors.append(factor)
-
-    def matches(fields):
-        fields = {x.lower() for x in fields}
-        for test_field in and_factors:
-            if not any(fnmatch(x, test_field) for x in fields):
-                return False
-        if not or_factors:
-            return True
-        for or_factor in or_factors:
-            if any(fnmatch(x, or_factor) for x in fields):
+            factors.append(arg)
+            continue
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError("Invalid page number: `{}`".format(value))
+        page = int(value)
+    return factors, page
+
+
+def get_page_count(item_count, page_size):
+    return max(1, -(-item_count // page_size))
+
+
+class JobNameIndex:
+    """
+    Inverted index from the lower-cased tokens of job names (separated by ``-``, or by ``/``
+    for jobs inside folders) to the jobs containing them, used to answer `!find` queries without
+    scanning every job name.
+
+    Build it once for a list of job names and query it as many times as needed with ``find``.
+    """
+
+    def __init__(self, job_names):
+        self.job_names = list(job_names)
+        self._ids_by_name = {}
+        self._ids_by_token = {}
+        for job_id, job_name in enumerate(self.job_names):
+            job_name = job_name.lower()
+            self._ids_by_name.setdefault(job_name, set()).add(job_id)
+            for token in _JOB_NAME_SEPARATORS_RE.split(job_name):
+                self._ids_by_token.setdefault(token, set()).add(job_id)
+
+    def __len__(self):
+        return len(self.job_names)
+
+    def find(self, input_factors):
+        """
+        Returns the job names matching the given search factors, in the original order:
+
+        * ``"name"`` (quoted) must match the whole job name, possibly with wildcards;
+        * other factors are split by ``-`` and ``/``, each part must match one of the job name
+          tokens;
+        * parts with ``,`` are alternatives, at least one of them must match.
+        """
+        required_ids = []
+        factors = []
+        for factor in input_factors:
+            if factor.startswith('"') and factor.endswith('"'):
+                word = factor[1:-1].lower()
+                required_ids.append(self._find_ids(self._ids_by_name, word))
+            else:
+                factor = factor.lower()
+                factors.extend(_JOB_NAME_SEPARATORS_RE.split(factor))
+
+        or_factors = []
+        for factor in factors:
+            if "," in factor:
+                or_factors.extend(factor.split(","))
+            else:
+                required_ids.append(self._find_ids(self._ids_by_token, factor))
+
+        if or_factors:
+            or_ids = set()
+            for or_factor in or_factors:
+                or_ids |= self._find_ids(self._ids_by_token, or_factor)
+            required_ids.append(or_ids)
+
+        if not required_ids:
+            return list(self.job_names)
+        # intersecting starting from the smallest set is the cheapest
+        required_ids.sort(key=len)
+        ids = required_ids[0].intersection(*required_ids[1:])
+        return [self.job_names[x] for x in sorted(ids)]
+
+    @staticmethod
+    def _find_ids(ids_by_key, pattern):
+        if not _has_wildcards(pattern):
+            return ids_by_key.get(pattern, set())
+        match = _compile_find_pattern(pattern)
+        result = set()
+        for key, ids in ids_by_key.items():
+            if match(key):
+                result |= ids
+        return result
+
+
+_JOB_NAME_SEPARATORS_RE = re.compile(r"[-/]")
+
+
+def _has_wildcards(pattern):
+    return "*" in pattern or "?" in pattern or "[" in pattern
+
+
+@lru_cache(maxsize=256)
+def _compile_find_pattern(pattern):
+    return re.compile(translate(pattern)).match
+
+
+class JobCatalog:
+    """
+    In-process cache of the names of all Jenkins jobs, along with their ``JobNameIndex``.
+
+    Names are fresh for ``ttl`` seconds after being fetched; after that the stale names are
+    still returned while a background thread fetches them again (stale-while-revalidate), so only
+    the very first access has to wait for Jenkins.
+
+    :param callable fetch: called without arguments to fetch the list of all job names.
+    :param logging.Logger log: logger used to report failures of background refreshes.
+    """
+
+    def __init__(self, fetch, log):
+        self._fetch = fetch
+        self._log = log
+        self._lock = threading.Lock()
+        self._index = None
+        self._known_job_names = frozenset()
+        self._fetched_at = None
+        self._refreshing = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    def get_job_names(self, ttl):
+        return self.get_index(ttl).job_names
+
+    def get_index(self, ttl):
+        """
+        Returns the ``JobNameIndex`` of all job names.
+        """
+        with self._lock:
+            if self._index is None:
+                self.misses += 1
+            elif time.monotonic() - self._fetched_at < ttl:
+                self.hits += 1
+                return self._index
+            else:
+                self.stale_hits += 1
+                self._start_background_refresh()
+                return self._index
+        return self.refresh()
+
+    def refresh(self):
+        """
+        Fetches the job names from Jenkins and indexes them, returning the new index.
+        """
+        job_names = self._fetch()
+        index = JobNameIndex(job_names)
+        with self._lock:
+            self._index = index
+            self._known_job_names = frozenset(job_names)
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+        return index
+
+    def invalidate_if_unknown(self, job_name):
+        """
+        Refreshes the catalog in the background if ``job_name`` is not part of it, which
+        means a job was created since the catalog was last fetched.
+        """
+        with self._lock:
+            if self._index is None or job_name in self._known_job_names:
+                return
+            self.invalidations += 1
+            self._start_background_refresh()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._known_job_names),
+                "age": time.monotonic() - self._fetched_at
+                if self._fetched_at is not None
+                else None,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "invalidations": self.invalidations,
+            }
+
+    def _start_background_refresh(self):
+        # must be called with the lock held
+        if self._refreshing:
+            return
+        self._refreshing = True
+        thread = threading.Thread(
+            target=self._background_refresh, name="JobCatalog refresh", daemon=True
+        )
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            self._log.exception("Failed to refresh the job catalog")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+class JobFolderCrawler:
+    """
+    Lists the full names of all jobs by walking the Jenkins folders, one level at a time with
+    the folders of each level fetched concurrently.
+
+    The items of each folder are cached separately for ``ttl`` seconds, so a crawl only fetches
+    the folders whose cached items expired or were invalidated by ``invalidate_if_unknown``.
+
+    :param callable fetch_folders: called with a list of folder full names (``""`` for the top
+        level) to fetch, concurrently, ``(name, is_folder)`` for each item of each folder; returns
+        the items of each folder in the same order.
+    """
+
+    def __init__(self, fetch_folders):
+        self._fetch_folders = fetch_folders
+        self._items = TTLCache(max_size=100000)
+        self._lock = threading.Lock()
+        self._fetches = 0
+        self._reuses = 0
+        self._invalidations = 0
+
+    def crawl(self, ttl):
+        """
+        Returns the full names of all jobs (``folder/job``).
+        """
+        job_names = []
+        folders = [""]
+        while folders:
+            all_items = self._get_items(folders, ttl)
+            next_folders = []
+            for folder, items in zip(folders, all_items):
+                for name, is_folder in items:
+                    full_name = "{}/{}".format(folder, name) if folder else name
+                    if is_folder:
+                        next_folders.append(full_name)
+                    else:
+                        job_names.append(full_name)
+            folders = next_folders
+        return job_names
+
+    def invalidate_if_unknown(self, job_name):
+        """
+        Drops the cached items of the folder where ``job_name`` should be listed, if it is
+        not there (the job or one of its folders was created since the folder was fetched).
+        """
+        parts = job_name.split("/")
+        for depth in range(len(parts) - 1, -1, -1):
+            folder = "/".join(parts[:depth])
+            items = self._items.get(folder, ttl=float("inf"))
+            if items is None:
+                # folder not known either, look for it in its parent
+                continue
+            if parts[depth] not in {name for (name, is_folder) in items}:
+                self._items.pop(folder)
+                with self._lock:
+                    self._invalidations += 1
+            return
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "folders": len(self._items),
+                "fetches": self._fetches,
+                "reuses": self._reuses,
+                "invalidations": self._invalidations,
+            }
+
+    def _get_items(self, folders, ttl):
+        all_items = [self._items.get(folder, ttl) for folder in folders]
+        missing = [
+            folder for (folder, items) in zip(folders, all_items) if items is None
+        ]
+        fetched = dict(zip(missing, self._fetch_folders(missing) if missing else []))
+        for folder, items in fetched.items():
+            self._items.set(folder, items)
+        with self._lock:
+            self._fetches += len(missing)
+            self._reuses += len(folders) - len(missing)
+        return [
+            items if items is not None else fetched[folder]
+            for (folder, items) in zip(folders, all_items)
+        ]
+
+
+class RequestStats:
+    """
+    Thread-safe latency histograms, error counts and response sizes of requests, grouped by
+    endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = Counter()
+        self._bytes = Counter()
+
+    def record(self, endpoint, elapsed, ok=True, size=0):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+            self._bytes[endpoint] += size
+            if not ok:
+                self._errors[endpoint] += 1
+
+    def get_stats(self):
+        """
+        Returns a dict mapping each endpoint to its histogram stats (see
+        ``Histogram.get_stats``) plus its ``errors`` and ``bytes``.
+        """
+        with self._lock:
+            result = {}
+            for endpoint, histogram in self._histograms.items():
+                stats = histogram.get_stats()
+                stats.update(errors=self._errors[endpoint], bytes=self._bytes[endpoint])
+                result[endpoint] = stats
+            return result
+
+
+class Histogram:
+    """
+    Counts of observed values in buckets with the given upper bounds, like a Prometheus
+    histogram. Not thread-safe, callers must hold their own lock.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self._counts = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self._counts[i] += 1
+                break
+
+    def get_stats(self):
+        """
+        Returns ``count``, ``total`` and ``max`` of the observed values, and ``buckets``, a list
+        of ``(bound, count)`` with the cumulative count of values up to each bound.
+        """
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self._counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class Tracer:
+    """
+    Thread-safe duration histograms of bot commands and of the spans of work done while they
+    run (catalog fetch, filter, status fetch, ...), grouped by ``(command, span)``.
+
+    The command being traced, and the user who ran it, are kept per thread: work done in other
+    threads on behalf of a command is attributed to it with ``bind``, spans outside any command
+    are attributed to ``None``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+
+    def get_command(self):
+        return getattr(self._local, "command", None)
+
+    def get_user(self):
+        return getattr(self._local, "user", None)
+
+    @contextmanager
+    def attach(self, command, user=None):
+        """
+        Attributes the spans in the block to ``command`` run by ``user``, without tracing the
+        command itself.
+        """
+        previous = (self.get_command(), self.get_user())
+        self._local.command = command
+        self._local.user = user
+        try:
+            yield
+        finally:
+            self._local.command, self._local.user = previous
+
+    def bind(self, func):
+        """
+        Returns a function which calls ``func`` attached to the current command and user, to
+        be called from other threads.
+        """
+        command = self.get_command()
+        user = self.get_user()
+
+        @wraps(func)
+        def bound(*args, **kwargs):
+            with self.attach(command, user):
+                return func(*args, **kwargs)
+
+        return bound
+
+    @contextmanager
+    def trace(self, command, user=None):
+        """
+        Traces the block as a run of ``command`` by ``user``: its whole duration is recorded as
+        the ``total`` span, and the spans inside it are attributed to ``command``.
+        """
+        with self.attach(command, user), self.span("total"):
+            yield
+
+    @contextmanager
+    def span(self, name):
+        command = self.get_command()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                histogram = self._histograms.get((command, name))
+                if histogram is None:
+                    histogram = Histogram(LATENCY_BUCKETS)
+                    self._histograms[(command, name)] = histogram
+                histogram.observe(elapsed)
+
+    def get_stats(self):
+        """
+        Returns a dict mapping ``(command, span)`` to its histogram stats (see
+        ``Histogram.get_stats``).
+        """
+        with self._lock:
+            return {key: h.get_stats() for key, h in self._histograms.items()}
+
+
+class TokenBucket:
+    """
+    Bucket of at most ``capacity`` tokens, refilled at ``rate`` tokens per second. Not
+    thread-safe, callers must hold their own lock.
+
+    Tokens may be taken in advance, leaving the bucket in debt: ``get_delay`` then tells how
+    long until the debt is paid.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def get_delay(self, now):
+        """
+        Returns how many seconds until a token is available (0 if one is available now).
+        """
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting requests to ``rate`` per second, with bursts of at most
+    ``burst`` requests. Each user also has a bucket with ``user_share`` of the rate and burst,
+    so a single user can't take the whole capacity; requests without a user only count against
+    the global bucket. A ``rate`` of zero disables the limit.
+
+    At most ``max_users`` user buckets are kept, evicting the least recently used ones first.
+    """
+
+    def __init__(self, rate, burst, user_share, max_users=1000):
+        self.rate = rate
+        self.burst = burst
+        self.user_share = user_share
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self._user_buckets = OrderedDict()
+        self._acquired = 0
+        self._throttled = 0
+        self._rejected = 0
+
+    def reserve(self, user, max_delay):
+        """
+        Reserves a request for ``user``, returning how many seconds the caller must wait before
+        making it, or None (reserving nothing) if that would be more than ``max_delay`` seconds.
+        """
+        if self._bucket is None:
+            return 0.0
+        with self._lock:
+            buckets = [self._bucket]
+            if user is not None and self.user_share > 0:
+                buckets.append(self._get_user_bucket(user))
+            now = time.monotonic()
+            delay = max(bucket.get_delay(now) for bucket in buckets)
+            if delay > max_delay:
+                self._rejected += 1
+                return None
+            for bucket in buckets:
+                bucket.take()
+            self._acquired += 1
+            if delay > 0:
+                self._throttled += 1
+            return delay
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "acquired": self._acquired,
+                "throttled": self._throttled,
+                "rejected": self._rejected,
+            }
+
+    def _get_user_bucket(self, user):
+        bucket = self._user_buckets.pop(user, None)
+        if bucket is None:
+            bucket = TokenBucket(
+                self.rate * self.user_share, max(1, self.burst * self.user_share)
+            )
+        self._user_buckets[user] = bucket
+        while len(self._user_buckets) > self.max_users:
+            self._user_buckets.popitem(last=False)
+        return bucket
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker: after ``failure_threshold`` consecutive failed requests
+    (connection errors, timeouts or 5xx responses) the circuit opens and requests are not made
+    at all, so commands fail fast instead of piling up while Jenkins is down.
+
+    While open, a single trial request is allowed every ``reset_timeout`` seconds; the circuit
+    closes again as soon as one succeeds.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._opens = 0
+        self._rejected = 0
+
+    def allow(self):
+        """
+        Returns True if a request can be made now.
+        """
+        with self._lock:
+            if self._opened_at is None:
                 return True
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # let this request through as a trial, the next one in another reset_timeout
+                self._opened_at = now
+                return True
+            self._rejected += 1
+            return False
 
-        return False
+    def record(self, ok):
+        """
+        Records the outcome of a request made after ``allow``.
+        """
+        with self._lock:
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is None and self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._opens += 1
+
+    def get_retry_after(self):
+        """
+        Returns how many seconds until the next trial request is allowed (0 if closed).
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "state": "closed" if self._opened_at is None else "open",
+                "failures": self._failures,
+                "opens": self._opens,
+                "rejected": self._rejected,
+            }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: while a call is in flight, other calls with
+    the same key wait for it and get its result (or exception) instead of calling again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._made = 0
+        self._shared = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _SingleFlightCall()
+                self._made += 1
+            else:
+                self._shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def get_stats(self):
+        with self._lock:
+            return {"calls": self._made, "shared": self._shared}
+
+
+class _SingleFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ConditionalResponseCache:
+    """
+    Thread-safe cache of parsed response bodies along with their validators (``ETag`` and
+    ``Last-Modified``), used to make conditional requests and skip downloading and parsing
+    responses which did not change.
+
+    Only responses with validators are kept; at most ``max_size`` of them, evicting the least
+    recently used ones first.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._not_modified = 0
+        self._modified = 0
+        self._misses = 0
+
+    def get(self, key):
+        """
+        Returns the ``CachedResponse`` for ``key``, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, headers, value):
+        """
+        Stores the parsed ``value`` of a response with the given headers; responses without
+        validators are not stored (and replace older entries for ``key``).
+        """
+        validators = {}
+        if headers.get("ETag"):
+            validators["If-None-Match"] = headers["ETag"]
+        if headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = headers["Last-Modified"]
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._modified += 1
+            if not validators:
+                return
+            self._entries[key] = CachedResponse(validators, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def record_not_modified(self):
+        with self._lock:
+            self._not_modified += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "not_modified": self._not_modified,
+                "modified": self._modified,
+                "misses": self._misses,
+            }
+
+
+CachedResponse = namedtuple("CachedResponse", "validators value")
+
+TestFailures = namedtuple("TestFailures", "count cases")
+
+JobHistoryEntry = namedtuple(
+    "JobHistoryEntry", "job_name number result timestamp failure_count"
+)
+
+JobMetadata = namedtuple(
+    "JobMetadata", "last_build_number parameter_names last_parameters_values"
+)
+
+
+class TTLCache:
+    """
+    Thread-safe cache whose entries expire after a time-to-live given when reading them.
+
+    At most ``max_size`` entries are kept, evicting the least recently set ones first.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, ttl, default=None):
+        """
+        Returns the value of ``key`` if it was set less than ``ttl`` seconds ago.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, set_at = entry
+            if time.monotonic() - set_at >= ttl:
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.monotonic())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class JobStatusTable:
+    """
+    Status of the jobs (as returned by ``_fetch_job_status``) kept up to date by the events
+    received by the ``jenkins`` webhook, so listings don't need to ask Jenkins about jobs which
+    had recent events.
+    """
+
+    def __init__(self, max_size):
+        self._statuses = TTLCache(max_size=max_size)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._updates = 0
+
+    def update_from_event(self, info):
+        status = get_job_status_from_event(info)
+        if status is None:
+            return
+        self._statuses.set(info["job_name"], status)
+        with self._lock:
+            self._updates += 1
+
+    def get_statuses(self, job_names, ttl):
+        """
+        Returns a dict with the statuses of the given jobs which had an event in the last ``ttl``
+        seconds.
+        """
+        result = {}
+        for job_name in job_names:
+            status = self._statuses.get(job_name, ttl)
+            if status is not None:
+                result[job_name] = status
+        with self._lock:
+            self._hits += len(result)
+            self._misses += len(job_names) - len(result)
+        return result
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._statuses),
+                "hits": self._hits,
+                "misses": self._misses,
+                "updates": self._updates,
+            }
+
+
+class EventDispatcher:
+    """
+    Processes events in a pool of worker threads.
+
+    Events are distributed among the workers by key, so events with the same key are always
+    handled by the same worker in the order they were submitted. Each worker has a queue of at
+    most ``queue_size`` events; events submitted while the queue is full are dropped.
+
+    :param callable handler: called with each event.
+    :param int workers: number of worker threads.
+    :param int queue_size: maximum number of events waiting in each worker queue.
+    :param logging.Logger log: logger used to report errors raised by ``handler``.
+    """
+
+    _STOP = object()
+
+    def __init__(self, handler, workers, queue_size, log):
+        self._handler = handler
+        self._log = log
+        self._lock = threading.Lock()
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(max(workers, 1))]
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(q,),
+                name="EventDispatcher worker {}".format(i),
+                daemon=True,
+            )
+            for (i, q) in enumerate(self._queues)
+        ]
+        self.submitted = 0
+        self.processed = 0
+        self.errors = 0
+        self.dropped = 0
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, event):
+        """
+        Queues ``event`` to be processed, returning False if it had to be dropped because the
+        queue is full.
+        """
+        q = self._queues[hash(key) % len(self._queues)]
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def join(self):
+        """
+        Blocks until all queued events have been processed.
+        """
+        for q in self._queues:
+            q.join()
+
+    def stop(self, timeout=10.0):
+        """
+        Stops the workers after they process the events already queued.
+        """
+        for q in self._queues:
+            q.put(self._STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "queued": sum(q.qsize() for q in self._queues),
+            }
+
+    def _work(self, q):
+        while True:
+            event = q.get()
+            try:
+                if event is self._STOP:
+                    return
+                try:
+                    self._handler(event)
+                except Exception:
+                    self._log.exception("Error processing event: {}".format(event))
+                    with self._lock:
+                        self.errors += 1
+                with self._lock:
+                    self.processed += 1
+            finally:
+                q.task_done()
+
+
+class AsyncJenkinsClient:
+    """
+    Jenkins client based on ``aiohttp``, running on its own event loop in a dedicated thread.
+
+    Blocking callers (errbot command handlers) use ``map`` and ``iter_completed`` to fan out many
+    requests at once: they all run concurrently in the event loop thread, so a command doesn't
+    need a thread for each request it makes. At most ``pool_size`` connections are open at the
+    same time; requests are retried like the ones made with ``requests`` (see
+    ``JenkinsBot._jenkins_request``), recorded in ``request_stats`` and share the
+    ``rate_limiter`` and ``circuit_breaker`` of the plugin.
+
+    Failed requests raise ``error_class`` (``JenkinsBot.ResponseError``) with an
+    ``AsyncResponse`` as response, and requests which can't be made now raise
+    ``unavailable_error_class`` (``JenkinsBot.UnavailableError``).
+    """
+
+    def __init__(
+        self,
+        url,
+        auth,
+        timeout,
+        pool_size,
+        retries,
+        retry_backoff,
+        request_stats,
+        rate_limiter,
+        circuit_breaker,
+        error_class,
+        unavailable_error_class,
+        job_parameters_cache,
+        job_parameters_ttl,
+    ):
+        self.url = url if url.endswith("/") else url + "/"
+        self.auth = auth
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.request_stats = request_stats
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.error_class = error_class
+        self.unavailable_error_class = unavailable_error_class
+        self.job_parameters_cache = job_parameters_cache
+        self.job_parameters_ttl = job_parameters_ttl
+        self._loop = asyncio.new_event_loop()
+        # only accessed from the event loop thread
+        self._in_flight = {}
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="AsyncJenkinsClient", daemon=True
+        )
+        self._thread.start()
+        self._session = self.run(self._create_session())
+
+    async def _create_session(self):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    def run(self, coroutine):
+        """
+        Runs the coroutine in the event loop, blocking until it is done.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def map(self, func, items):
+        """
+        Runs the coroutine ``func(item)`` for each item concurrently, blocking until all are done.
+
+        Returns the results in the same order as ``items``, with the exception raised instead
+        of the result of calls which failed.
+        """
+
+        async def gather():
+            return await asyncio.gather(
+                *(func(x) for x in items), return_exceptions=True
+            )
+
+        return self.run(gather())
+
+    def iter_completed(self, func, items):
+        """
+        Runs the coroutine ``func(item)`` for each item concurrently, generating
+        ``(item, result)`` in the order the calls complete.
+        """
+        futures = {
+            asyncio.run_coroutine_threadsafe(func(x), self._loop): x for x in items
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def close(self):
+        self.run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def request(self, method, query_url, auth=None, params=None, user=None):
+        """
+        Makes a request to the Jenkins API, returning ``(AsyncResponse, body)``.
+
+        ``user`` is the user whose share of the rate limit is used, by default the user of
+        ``auth`` if given. Requests are retried like in ``JenkinsBot._jenkins_request``.
+        """
+        if user is None and auth is not None:
+            user = auth[0]
+        failure = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+            try:
+                response, body = await self._request_attempt(
+                    method, query_url, auth, params, user
+                )
+            except self.unavailable_error_class:
+                if failure is None:
+                    raise
+                break
+            except asyncio.TimeoutError:
+                raise
+            except aiohttp.ClientConnectorError as e:
+                if attempt == self.retries:
+                    raise
+                failure = e
+            except aiohttp.ClientError as e:
+                # the request might have reached Jenkins, only retry reads
+                if method != "GET" or attempt == self.retries:
+                    raise
+                failure = e
+            else:
+                if (
+                    attempt == self.retries
+                    or method != "GET"
+                    or response.status_code not in RETRY_STATUS_CODES
+                ):
+                    return response, body
+                failure = (response, body)
+        # the circuit opened (or the rate limit ran out) while retrying
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    async def _request_attempt(self, method, query_url, auth, params, user):
+        delay = reserve_jenkins_request(
+            self.circuit_breaker,
+            self.rate_limiter,
+            user,
+            max_delay=self.timeout,
+            error_class=self.unavailable_error_class,
+        )
+        if delay:
+            await asyncio.sleep(delay)
+
+        username, token = auth or self.auth
+        start = time.monotonic()
+        ok = False
+        size = 0
+        try:
+            try:
+                async with self._session.request(
+                    method,
+                    self.url + query_url,
+                    params=params,
+                    auth=aiohttp.BasicAuth(username, token),
+                ) as r:
+                    body = await r.read()
+                    response = AsyncResponse(r.status, r.reason, str(r.url))
+                    size = len(body)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.circuit_breaker.record(ok=False)
+                raise
+            ok = response.status_code < 500
+            self.circuit_breaker.record(ok)
+            return response, body
+        finally:
+            self.request_stats.record(
+                "{} {}".format(method, get_endpoint_name(query_url)),
+                time.monotonic() - start,
+                ok,
+                size,
+            )
+
+    async def get_json(self, query_url, params=None, user=None):
+        """
+        Like ``JenkinsBot._get_jenkins_json_request``: identical requests made concurrently
+        share a single request to Jenkins and its parsed result.
+        """
+        key = (query_url, tuple(sorted((params or {}).items())))
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+        in_flight = self._in_flight[key] = self._loop.create_future()
+        try:
+            result = await self._get_json(query_url, params, user)
+        except Exception as e:
+            in_flight.set_exception(e)
+            # mark the exception as retrieved, there might be no other callers waiting
+            in_flight.exception()
+            raise
+        else:
+            in_flight.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    async def _get_json(self, query_url, params, user):
+        response, body = await self.request("GET", query_url, params=params, user=user)
+        if response.status_code not in (200, 201):
+            raise self.error_class(
+                "json request to {url}".format(url=response.url), response
+            )
+        return json.loads(body.decode("utf-8"))
+
+    async def post(self, query_url, auth):
+        response, body = await self.request("POST", query_url, auth=auth)
+        if response.status_code not in (200, 201):
+            raise self.error_class(
+                "Error posting to {url}: {r}\n{text}".format(
+                    url=response.url,
+                    r=response,
+                    text=body.decode("utf-8", errors="replace"),
+                ),
+                response,
+            )
+
+    async def fetch_folder_items(self, folder, user=None):
+        """
+        See ``JenkinsBot._fetch_folder_items``.
+        """
+        result = await self.get_json(
+            get_folder_api_url(folder), params={"tree": "jobs[name]"}, user=user
+        )
+        return parse_folder_items(result)
+
+    async def fetch_job_status(self, job_name, user=None):
+        """
+        See ``JenkinsBot._fetch_job_status``.
+        """
+        job_path = get_job_path(job_name)
+        try:
+            response = await self.get_json(
+                "{}/lastBuild/api/json".format(job_path),
+                params={"tree": "result"},
+                user=user,
+            )
+        except self.error_class as e:
+            if e.response.status_code != 404:
+                raise
+            # no result yet, check if the job exists then
+            try:
+                await self.get_json("{}/api/json".format(job_path), user=user)
+            except self.error_class as e:
+                if e.response.status_code == 404:
+                    return None
+                raise
+            return "NOT_STARTED"
+        return response.get("result") or "RUNNING"
+
+    async def get_job_metadata(self, job_name, user=None):
+        """
+        See ``JenkinsBot._get_job_metadata``.
+        """
+        result = await self.get_json(
+            "{}/api/json".format(get_job_path(job_name)),
+            params={"tree": JOB_METADATA_TREE},
+            user=user,
+        )
+        metadata = parse_job_metadata(result)
+        self.job_parameters_cache.set(job_name, metadata.parameter_names)
+        return metadata
+
+    async def trigger_job(self, job_name, auth, parameters=None):
+        """
+        See ``JenkinsBot._trigger_job``; ``auth`` is the ``(user, token)`` of the user.
+        """
+        if parameters is not None:
+            post_url = "{}/buildWithParameters?{}".format(
+                get_job_path(job_name), parameters
+            )
+            await self.post(post_url, auth)
+            return
+
+        parameter_names = self.job_parameters_cache.get(
+            job_name, ttl=self.job_parameters_ttl
+        )
+        if parameter_names == []:
+            try:
+                await self.post("{}/build".format(get_job_path(job_name)), auth)
+            except self.error_class:
+                self.job_parameters_cache.pop(job_name)
+                raise
+            return
+
+        metadata = await self.get_job_metadata(job_name, user=auth[0])
+        await self.post(get_trigger_url(job_name, metadata), auth)
+
+
+AsyncResponse = namedtuple("AsyncResponse", "status_code reason url")
+
+
+class RocketChatNotifier:
+    """
+    Long-lived Rocket.Chat client used to send direct messages.
+
+    Logs in lazily on the first message and keeps the authentication token and the HTTP
+    connection between messages, logging in again only if the server answers 401.
+    """
+
+    def __init__(self, domain, username, password, timeout=None):
+        self.domain = domain.rstrip("/")
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._auth_headers = None
+        self.logins = 0
+
+    def send_message(self, text, room_id):
+        auth_headers = self._get_auth_headers()
+        r = self._post_message(text, room_id, auth_headers)
+        if r.status_code == 401:
+            auth_headers = self._get_auth_headers(expired=auth_headers)
+            r = self._post_message(text, room_id, auth_headers)
+        r.raise_for_status()
+        return r.json()
+
+    def close(self):
+        self._session.close()
+
+    def _post_message(self, text, room_id, auth_headers):
+        return self._session.post(
+            self.domain + "/api/v1/chat.postMessage",
+            json={"text": text, "roomId": room_id},
+            headers=auth_headers,
+            timeout=self.timeout,
+        )
+
+    def _get_auth_headers(self, expired=None):
+        """
+        Returns the authentication headers, logging in if there are none yet or if they are the
+        same as ``expired`` (another thread might have logged in again in the meantime).
+        """
+        with self._lock:
+            if self._auth_headers is None or self._auth_headers is expired:
+                r = self._session.post(
+                    self.domain + "/api/v1/login",
+                    data={"user": self.username, "password": self.password},
+                    timeout=self.timeout,
+                )
+                r.raise_for_status()
+                data = r.json()["data"]
+                self._auth_headers = {
+                    "X-Auth-Token": data["authToken"],
+                    "X-User-Id": data["userId"],
+                }
+                self.logins += 1
+            return self._auth_headers
+
+
+class NotificationCoalescer:
+    """
+    Groups notifications per user during a time window.
+
+    The first notification added for a user opens a window of ``window`` seconds; when it ends
+    ``on_window_end`` is called with the user, who should then ``pop`` the notifications.
+    """
+
+    def __init__(self, on_window_end):
+        self._on_window_end = on_window_end
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timers = {}
+
+    def add(self, user, notification, window):
+        with self._lock:
+            if user not in self._pending:
+                self._pending[user] = []
+                timer = threading.Timer(window, self._on_window_end, args=(user,))
+                timer.daemon = True
+                timer.start()
+                self._timers[user] = timer
+            self._pending[user].append(notification)
+
+    def pop(self, user):
+        """
+        Returns the pending notifications of the user, closing their window.
+        """
+        with self._lock:
+            timer = self._timers.pop(user, None)
+            if timer is not None:
+                timer.cancel()
+            return self._pending.pop(user, [])
+
+    def get_users(self):
+        with self._lock:
+            return list(self._pending)
+
+    def cancel(self):
+        """
+        Cancels all open windows, keeping the pending notifications.
+        """
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+
+
+class TestFailuresCache:
+    """
+    Persistent LRU cache of the ``TestFailures`` of finished builds, keyed by job name and build
+    number.
+
+    Each entry is saved under its own key in ``storage`` (the plugin storage), along with an
+    index of all entries in least recently used order. At most ``max_entries`` entries are kept,
+    and entries older than ``max_age`` seconds are discarded.
+    """
+
+    INDEX_KEY = "test_failures_cache"
+
+    def __init__(self, storage, max_entries, max_age):
+        self._storage = storage
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._index = OrderedDict(
+            (tuple(key), stored_at)
+            for (key, stored_at) in storage.get(self.INDEX_KEY, [])
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, job_name, build_number):
+        key = (job_name, str(build_number))
+        with self._lock:
+            stored_at = self._index.get(key)
+            entry = None
+            if stored_at is not None:
+                if time.time() - stored_at < self.max_age:
+                    entry = self._storage.get(self._get_entry_key(key))
+                if entry is None:
+                    self._evict(key)
+                    self._save_index()
+            if entry is None:
+                self.misses += 1
+                return None
+            # persist the new order, so eviction stays LRU after a restart (not needed when
+            # the entry already is the most recently used one)
+            if next(reversed(self._index)) != key:
+                self._index.move_to_end(key)
+                self._save_index()
+            self.hits += 1
+            count, cases = entry
+            return TestFailures(count, cases)
+
+    def set(self, job_name, build_number, test_failures):
+        key = (job_name, str(build_number))
+        cases = [
+            {"name": x["name"], "status": x.get("status")} for x in test_failures.cases
+        ]
+        with self._lock:
+            self._storage[self._get_entry_key(key)] = (test_failures.count, cases)
+            self._index.pop(key, None)
+            self._index[key] = time.time()
+
+            expired = [
+                k
+                for (k, stored_at) in self._index.items()
+                if time.time() - stored_at >= self.max_age
+            ]
+            for k in expired:
+                self._evict(k)
+            while len(self._index) > self.max_entries:
+                self._evict(next(iter(self._index)))
+            self._save_index()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self, key):
+        del self._index[key]
+        try:
+            del self._storage[self._get_entry_key(key)]
+        except KeyError:
+            pass
+
+    def _save_index(self):
+        self._storage[self.INDEX_KEY] = list(self._index.items())
+
+    @staticmethod
+    def _get_entry_key(key):
+        return "test_failures:{}#{}".format(*key)
+
+
+class JobWatches:
+    """
+    Persistent set of the jobs watched by each user (see ``!watch``), along with the last status
+    of each job the watcher knows about, so they are only notified about changes.
+
+    All watches are saved in ``storage`` (the plugin storage) as a single record, mapping each
+    job name to a dict of watcher to status.
+    """
 
-    return [x for x in job_names if matches(set(x.split("-")))]
+    STORAGE_KEY = "job_watches"
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._lock = threading.Lock()
+        self._watches = {
+            job_name: dict(watchers)
+            for (job_name, watchers) in storage.get(self.STORAGE_KEY, {}).items()
+        }
+        self._updates = 0
+
+    def add(self, user, statuses):
+        """
+        Starts watching the jobs in the ``statuses`` dict, which maps job name to its current
+        status.
+        """
+        with self._lock:
+            for job_name, status in statuses.items():
+                self._watches.setdefault(job_name, {})[user] = status
+            self._save()
+
+    def remove(self, user, job_names=None):
+        """
+        Stops watching the given jobs (all of them if None), returning the names of the jobs
+        which were watched.
+        """
+        with self._lock:
+            if job_names is None:
+                job_names = list(self._watches)
+            removed = []
+            for job_name in job_names:
+                watchers = self._watches.get(job_name, {})
+                if user in watchers:
+                    del watchers[user]
+                    removed.append(job_name)
+                if not watchers:
+                    self._watches.pop(job_name, None)
+            if removed:
+                self._save()
+            return sorted(removed)
+
+    def get_jobs(self, user):
+        """
+        Returns a dict mapping the jobs watched by the user to their last known status.
+        """
+        with self._lock:
+            return {
+                job_name: watchers[user]
+                for (job_name, watchers) in self._watches.items()
+                if user in watchers
+            }
+
+    def get_job_names(self):
+        with self._lock:
+            return sorted(self._watches)
+
+    def update(self, job_name, status, notified_user=None):
+        """
+        Records the new status of a job, returning the watchers who didn't know about it yet
+        and should be notified (except ``notified_user``, which was notified already).
+
+        ``UNKNOWN_STATUS`` is ignored, and watchers who didn't know the status of the job
+        before are not notified.
+        """
+        if status == UNKNOWN_STATUS:
+            return []
+        with self._lock:
+            watchers = self._watches.get(job_name)
+            if not watchers:
+                return []
+            to_notify = [
+                user
+                for (user, known_status) in watchers.items()
+                if known_status not in (status, UNKNOWN_STATUS)
+                and user != notified_user
+            ]
+            changed = any(known != status for known in watchers.values())
+            if changed:
+                for user in watchers:
+                    watchers[user] = status
+                self._save()
+            self._updates += len(to_notify)
+            return sorted(to_notify)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._watches),
+                "watches": sum(len(x) for x in self._watches.values()),
+                "updates": self._updates,
+            }
+
+    def _save(self):
+        self._storage[self.STORAGE_KEY] = {
+            job_name: dict(watchers) for (job_name, watchers) in self._watches.items()
+        }
+
+
+class UserSettings(MutableMapping):
+    """
+    Settings of a user, as returned by ``JenkinsBot.load_user_settings``.
+
+    Keeps a copy of the values as they were loaded, so only the settings which were changed
+    (either assigned or modified in place) are written back by ``save_user_settings``.
+
+    The settings named in ``lazy_names`` are only read with ``load`` (called with the setting
+    name) when first accessed, so commands which don't use them never read nor copy them;
+    assigning one of them doesn't read it either.
+    """
+
+    def __init__(self, settings, legacy=False, lazy_names=(), load=None):
+        self._lazy_names = set(lazy_names)
+        self._values = {
+            name: value
+            for (name, value) in settings.items()
+            if name not in self._lazy_names
+        }
+        self._loaded = copy.deepcopy(self._values)
+        self._load = load
+        # loaded from the single record used by older versions
+        self.legacy = legacy
+
+    def __getitem__(self, name):
+        if name in self._lazy_names:
+            self._lazy_names.discard(name)
+            self._values[name] = self._load(name)
+            self._loaded[name] = copy.deepcopy(self._values[name])
+        return self._values[name]
+
+    def __setitem__(self, name, value):
+        self._lazy_names.discard(name)
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        if name in self._lazy_names:
+            self._lazy_names.discard(name)
+        else:
+            del self._values[name]
+
+    def __iter__(self):
+        yield from self._values
+        yield from sorted(self._lazy_names)
+
+    def __len__(self):
+        return len(self._values) + len(self._lazy_names)
+
+    def __repr__(self):
+        return "UserSettings({!r}, not loaded: {})".format(
+            self._values, sorted(self._lazy_names)
+        )
+
+    def get_dirty_names(self):
+        return [
+            name
+            for (name, value) in self._values.items()
+            if name not in self._loaded or self._loaded[name] != value
+        ]
+
+    def mark_saved(self, names):
+        for name in names:
+            self._loaded[name] = copy.deepcopy(self._values[name])
 
 
 COMMENTS = {
@@ -616,6 +3731,61 @@ COMMENTS = {
     ],
 }
 
+# name of the storage record of each user setting
+USER_SETTINGS_RECORDS = {
+    "token": "credentials",
+    "jobs": "history",
+    "last_job_listing": "listing",
+    "listing_page": "listing_page",
+    "aliases": "aliases",
+}
+
+# user settings which are only read from the storage when accessed
+LAZY_USER_SETTINGS = ("jobs", "last_job_listing")
+
+# placeholder status of jobs in a listing whose status did not arrive yet
+PENDING_STATUS = object()
+
+# responses to GET requests which are retried
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# status of the jobs listed while Jenkins is unavailable
+UNKNOWN_STATUS = "UNKNOWN"
+
+# test failures of builds whose test report is missing or could not be read, never cached
+UNKNOWN_TEST_FAILURES = TestFailures(0, [])
+
+# tree query of the job information needed by ``parse_job_metadata``
+JOB_METADATA_TREE = (
+    "actions[parameterDefinitions[name]],"
+    "lastBuild[number,actions[parameters[name,value]]]"
+)
+
+# classes of the Jenkins items which contain other jobs
+FOLDER_CLASSES = {
+    "com.cloudbees.hudson.plugins.folder.Folder",
+    "jenkins.branch.OrganizationFolder",
+    "org.jenkinsci.plugins.workflow.multibranch.WorkflowMultiBranchProject",
+}
+
+# upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+JENKINS_DOWN_MSG = "Jenkins is not responding, trying again in {seconds:.0f}s"
+
+RATE_LIMITED_MSG = "Too many requests to Jenkins, try again later"
+
+# internal event used to deliver the notifications grouped by NotificationCoalescer
+FLUSH_NOTIFICATIONS_EVENT = "esss_jenkins.flush_notifications"
+
+STATUS_UPDATE_MSG = """\
+Status update:
+
+{}
+"""
+
 NO_TOKEN_MSG = """
 **Jenkins API Token not configured**.
 Find your API Token [here]({jenkins_url}/user/{user}/configure) (make sure you are logged in) and execute:
@@ -625,6 +3795,13 @@ Find your API Token [here]({jenkins_url}/user/{user}/configure) (make sure you a
 This only needs to be done once.
 """
 
+WATCHED_JOBS_MSG = """
+**Watched Jobs**!
+{jobs_msg}
+
+To stop watching them, use `!unwatch`.
+"""
+
 JOB_STARTED_MSG = """
 **Job Started**!
 {status} [{job_name}]({jenkins_url}/{url}) build **{number}**
@@ -636,3 +3813,10 @@ JOB_COMPLETED_MSG = """
 {status} [{job_name}]({jenkins_url}/{url}) build **{number}**
 {test_failures_msg}
 """
+
+JOBS_COMPLETED_DIGEST_MSG = """
+**{count} Jobs Completed**!
+{results_msg}
+{jobs_msg}
+{test_failures_msg}
+"""
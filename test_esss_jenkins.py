@@ -14,6 +14,36 @@ def testbot(testbot):
     return testbot
 
 
+class DummyRequest:
+    """
+    Request given to the ``jenkins`` webhook, with the given parameters.
+    """
+
+    def __init__(self, **params):
+        self.params = params
+
+
+def make_response(
+    status_code, content=b"", headers=None, url=None, reason=None, stream=False
+):
+    """
+    Returns a ``requests.Response`` with the given status code and content (bytes); with
+    ``stream`` the content is only read from the response as it is iterated.
+    """
+    import io
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.url = url
+    response.headers.update(headers or {})
+    if stream:
+        response.raw = io.BytesIO(content)
+    else:
+        response._content = content
+    return response
+
+
 @pytest.fixture(autouse=True)
 def jenkins_plugin(testbot):
     jenkins_plugin = testbot.bot.plugin_manager.get_plugin_obj_by_name("Jenkins")
@@ -43,6 +73,95 @@ def test_token(testbot):
     assert response == "You API Token is: secret-token (user: fry)"
 
 
+def test_user_settings_records(jenkins_plugin, mocker):
+    settings = jenkins_plugin.load_user_settings("fry")
+    assert settings == {
+        "token": "",
+        "jobs": [],
+        "last_job_listing": [],
+        "listing_page": 1,
+    }
+
+    setitem = mocker.spy(type(jenkins_plugin), "__setitem__")
+    settings["token"] = "secret"
+    jenkins_plugin.save_user_settings("fry", settings)
+    assert [args[1] for (args, kwargs) in setitem.call_args_list] == [
+        "user:fry:credentials"
+    ]
+
+    # unchanged settings are not written again, but changes in place are detected
+    setitem.reset_mock()
+    jenkins_plugin.save_user_settings("fry", settings)
+    assert setitem.call_count == 0
+    settings["jobs"].append(dict(job_name="job-A"))
+    jenkins_plugin.save_user_settings("fry", settings)
+    assert [args[1] for (args, kwargs) in setitem.call_args_list] == [
+        "user:fry:history"
+    ]
+
+    assert jenkins_plugin.load_user_settings("fry") == {
+        "token": "secret",
+        "jobs": [dict(job_name="job-A")],
+        "last_job_listing": [],
+        "listing_page": 1,
+    }
+
+    # the job history and listing are only read when accessed
+    settings["last_job_listing"] = ["job-A", "job-B"]
+    jenkins_plugin.save_user_settings("fry", settings)
+    getitem = mocker.spy(type(jenkins_plugin), "__getitem__")
+    settings = jenkins_plugin.load_user_settings("fry")
+    assert [args[1] for (args, kwargs) in getitem.call_args_list] == [
+        "user:fry:credentials"
+    ]
+    getitem.reset_mock()
+    settings["last_job_listing"] = ["job-C"]
+    assert getitem.call_count == 0
+    assert settings["jobs"] == [dict(job_name="job-A")]
+    assert [args[1] for (args, kwargs) in getitem.call_args_list] == [
+        "user:fry:history"
+    ]
+    setitem.reset_mock()
+    jenkins_plugin.save_user_settings("fry", settings)
+    assert [args[1] for (args, kwargs) in setitem.call_args_list] == [
+        "user:fry:listing"
+    ]
+    assert jenkins_plugin.load_user_settings("fry")["last_job_listing"] == ["job-C"]
+
+
+def test_user_settings_legacy_record(jenkins_plugin):
+    jenkins_plugin["user:fry"] = {
+        "token": "secret",
+        "jobs": [dict(job_name="job-A")],
+        "last_job_listing": ["job-A"],
+        "aliases": {"a": (["job"], None)},
+    }
+    settings = jenkins_plugin.load_user_settings("fry")
+    assert settings["token"] == "secret"
+    assert settings["aliases"] == {"a": (["job"], None)}
+
+    jenkins_plugin.save_user_settings("fry", settings)
+    assert "user:fry" not in jenkins_plugin
+    assert jenkins_plugin["user:fry:aliases"] == {"a": (["job"], None)}
+    assert jenkins_plugin.load_user_settings("fry") == settings
+
+
+def test_user_settings_legacy_record_concurrent_saves(jenkins_plugin):
+    jenkins_plugin["user:fry"] = {"token": "secret", "jobs": [dict(job_name="job-A")]}
+    settings_1 = jenkins_plugin.load_user_settings("fry")
+    settings_2 = jenkins_plugin.load_user_settings("fry")
+    settings_1["jobs"].append(dict(job_name="job-B"))
+    jenkins_plugin.save_user_settings("fry", settings_1)
+
+    # the stale copy only writes what it changed
+    settings_2["token"] = "new-secret"
+    jenkins_plugin.save_user_settings("fry", settings_2)
+    assert "user:fry" not in jenkins_plugin
+    settings = jenkins_plugin.load_user_settings("fry")
+    assert settings["token"] == "new-secret"
+    assert settings["jobs"] == [dict(job_name="job-A"), dict(job_name="job-B")]
+
+
 def test_build_alias(testbot):
     from unittest.mock import patch
 
@@ -100,28 +219,101 @@ def test_build_alias(testbot):
             assert "Triggered 1 jobs:" in response
 
 
-def test_webhook(jenkins_plugin, mocker):
-    import rocketchat.api
+def test_build_reports_failures(testbot, jenkins_plugin, mocker):
+    jenkins_plugin.save_user_settings(
+        "fry",
+        {"token": "secret-token", "last_job_listing": ["job-A", "job-B", "job-C"]},
+    )
+    response_500 = make_response(500, reason="Server Error")
 
-    mocker.patch.object(rocketchat.api.RocketChatAPI, "send_message", autospec=True)
+    def trigger_job(job_name, user, parameters):
+        if job_name == "job-B":
+            raise jenkins_plugin.ResponseError("Error posting", response_500)
 
-    class DummyRequest:
-        pass
+    trigger = mocker.patch.object(
+        jenkins_plugin, "_trigger_job", side_effect=trigger_job
+    )
+    testbot.push_message("!build 0 1 2")
+    response = testbot.pop_message()
+    assert trigger.call_count == 3
+    assert "Triggered 2 jobs:" in response
+    assert "job-A" in response
+    assert "job-C" in response
+    assert "Failed to trigger 1 jobs:" in response
+    assert (
+        "job-B (https://my-server.com/jenkins/job/job-B): Jenkins answered 500"
+        in response
+    )
 
-    request = DummyRequest()
-    request.params = {
-        "number": "2",
-        "job_name": "fett-master-linux64",
-        "timestamp": "1508516240981",
-        "builtOn": "dev-ubuntu16.04-linux-sv01-ci01",
-        "event": "jenkins.job.started",
-        "userId": "fry",
-        "url": "job/fett-master-linux64/2/",
+
+def test_trigger_job(jenkins_plugin, mocker):
+    metadata = {
+        "job-params": {
+            "actions": [
+                {},
+                {"parameterDefinitions": [{"name": "MODE"}, {"name": "SKIP"}]},
+            ],
+            "lastBuild": {
+                "number": 12,
+                "actions": [{"parameters": [{"name": "MODE", "value": "source"}]}, {}],
+            },
+        },
+        "job-no-params": {"actions": [{}], "lastBuild": {"number": 3, "actions": []}},
+        "job-never-built": {
+            "actions": [{"parameterDefinitions": [{"name": "MODE"}]}],
+            "lastBuild": None,
+        },
     }
-    jenkins_plugin.jenkins(request)
-    args, kwargs = rocketchat.api.RocketChatAPI.send_message.call_args
+    get_request = mocker.patch.object(
+        jenkins_plugin,
+        "_get_jenkins_json_request",
+        side_effect=lambda url, params: metadata[url.split("/")[1]],
+    )
+    post_request = mocker.patch.object(jenkins_plugin, "_post_jenkins_json_request")
+
+    for _ in range(2):
+        jenkins_plugin._trigger_job("job-params", "fry")
+    assert get_request.call_count == 2
+    assert (
+        post_request.call_args_list
+        == [mocker.call("job/job-params/buildWithParameters?MODE=source", "fry")] * 2
+    )
+
+    get_request.reset_mock()
+    post_request.reset_mock()
+    for _ in range(2):
+        jenkins_plugin._trigger_job("job-no-params", "fry")
+    # parameter definitions are cached: the second time only the POST is needed
+    assert get_request.call_count == 1
+    assert (
+        post_request.call_args_list
+        == [mocker.call("job/job-no-params/build", "fry")] * 2
+    )
+
+    post_request.reset_mock()
+    jenkins_plugin._trigger_job("job-never-built", "fry")
+    post_request.assert_called_once_with(
+        "job/job-never-built/buildWithParameters", "fry"
+    )
+
+
+def test_webhook(jenkins_plugin, mocker):
+    notifier = mocker.patch.object(jenkins_plugin, "_get_notifier").return_value
+
+    request = DummyRequest(
+        number="2",
+        job_name="fett-master-linux64",
+        timestamp="1508516240981",
+        builtOn="dev-ubuntu16.04-linux-sv01-ci01",
+        event="jenkins.job.started",
+        userId="fry",
+        url="job/fett-master-linux64/2/",
+    )
+    assert jenkins_plugin.jenkins(request) == "OK"
+    jenkins_plugin._webhook_dispatcher.join()
+    args, kwargs = notifier.send_message.call_args
     assert kwargs == {}
-    _, text, user = args
+    text, user = args
     assert "Job Started" in text
     assert (
         "[fett-master-linux64](https://my-server.com/jenkins/job/fett-master-linux64/2/)"
@@ -129,6 +321,458 @@ def test_webhook(jenkins_plugin, mocker):
     )
     assert user == "@fry"
 
+    settings = jenkins_plugin.load_user_settings("fry")
+    assert settings["jobs"] == [("fett-master-linux64", "2", None, "1508516240981", 0)]
+
+
+def test_job_status_table(jenkins_plugin, mocker):
+    from esss_jenkins import TestFailures
+
+    mocker.patch.object(jenkins_plugin, "_get_notifier")
+    mocker.patch.object(
+        jenkins_plugin,
+        "_get_finished_build_test_errors",
+        return_value=TestFailures(0, []),
+    )
+    bulk_statuses = mocker.patch.object(
+        jenkins_plugin, "_fetch_bulk_job_statuses", return_value={"job-C": "FAILURE"}
+    )
+
+    def make_request(**params):
+        return DummyRequest(userId="fry", number="2", url="job/x/2/", **params)
+
+    jenkins_plugin.jenkins(make_request(job_name="job-A", event="jenkins.job.started"))
+    jenkins_plugin.jenkins(make_request(job_name="job-B", event="jenkins.job.started"))
+    jenkins_plugin.jenkins(
+        make_request(job_name="job-B", event="jenkins.job.completed", result="UNSTABLE")
+    )
+    jenkins_plugin._webhook_dispatcher.join()
+
+    # jobs with recent events are not polled
+    assert jenkins_plugin._fetch_job_statuses(["job-A", "job-B"]) == [
+        "RUNNING",
+        "UNSTABLE",
+    ]
+    assert bulk_statuses.call_count == 0
+    assert jenkins_plugin._fetch_job_statuses(["job-A", "job-C"]) == [
+        "RUNNING",
+        "FAILURE",
+    ]
+    assert bulk_statuses.call_count == 1
+
+    # after the TTL Jenkins is polled again
+    jenkins_plugin.config["JOB_STATUS_TTL"] = 0
+    assert jenkins_plugin._fetch_job_statuses(["job-C"]) == ["FAILURE"]
+    assert bulk_statuses.call_count == 2
+    assert jenkins_plugin._job_status_table.get_stats() == {
+        "jobs": 2,
+        "hits": 3,
+        "misses": 2,
+        "updates": 3,
+    }
+
+
+def test_add_to_job_history():
+    from esss_jenkins import add_to_job_history, load_job_history, JobHistoryEntry
+
+    # entries stored by older versions are converted
+    history = [
+        dict(job_name="job-A", number="1", result="SUCCESS", userId="fry"),
+        dict(job_name="job-B", number="5", test_failures=[{"name": "test_a"}] * 3),
+    ]
+    history = add_to_job_history(
+        history, JobHistoryEntry("job-C", "7", None, "1508516240981", 0)
+    )
+    assert history == [
+        ("job-C", "7", None, "1508516240981", 0),
+        ("job-A", "1", "SUCCESS", None, 0),
+        ("job-B", "5", None, None, 3),
+    ]
+    history = add_to_job_history(
+        history, JobHistoryEntry("job-B", "6", "FAILURE", None, 1), max_entries=2
+    )
+    assert [type(x) for x in history] == [tuple, tuple]
+    assert load_job_history(history) == [
+        JobHistoryEntry("job-B", "6", "FAILURE", None, 1),
+        JobHistoryEntry("job-C", "7", None, "1508516240981", 0),
+    ]
+
+
+def test_webhook_coalesces_completed_jobs(jenkins_plugin, mocker):
+    from esss_jenkins import TestFailures
+
+    notifier = mocker.patch.object(jenkins_plugin, "_get_notifier").return_value
+    jenkins_plugin.config["NOTIFY_COALESCE_SECONDS"] = 0.2
+    failures = {
+        "job-A": [{"name": "test_foo", "status": "FAILED"}],
+        "job-B": [],
+        "job-C": [
+            {"name": "test_foo", "status": "FAILED"},
+            {"name": "test_bar", "status": "REGRESSION"},
+        ],
+    }
+    mocker.patch.object(
+        jenkins_plugin,
+        "_get_build_test_errors",
+        side_effect=lambda job_name, build_number: TestFailures(
+            len(failures[job_name]), failures[job_name]
+        ),
+    )
+
+    for job_name, result in [
+        ("job-A", "FAILURE"),
+        ("job-B", "SUCCESS"),
+        ("job-C", "UNSTABLE"),
+    ]:
+        request = DummyRequest(
+            number="2",
+            job_name=job_name,
+            event="jenkins.job.completed",
+            result=result,
+            userId="fry",
+            url="job/{}/2/".format(job_name),
+        )
+        assert jenkins_plugin.jenkins(request) == "OK"
+    jenkins_plugin._webhook_dispatcher.join()
+    assert notifier.send_message.call_count == 0
+
+    wait_until(lambda: notifier.send_message.call_count == 1)
+    jenkins_plugin._webhook_dispatcher.join()
+    assert notifier.send_message.call_count == 1
+    text, user = notifier.send_message.call_args[0]
+    assert user == "@fry"
+    assert "3 Jobs Completed" in text
+    assert ":x: 1 FAILURE" in text
+    assert ":white_check_mark: 1 SUCCESS" in text
+    assert "[job-C](https://my-server.com/jenkins/job/job-C/2/)" in text
+    assert (
+        "job-A: **1 failed tests**\n`test_foo`\n\njob-C: **2 failed tests**\n" in text
+    )
+
+    # a started event delivers the pending completions first
+    jenkins_plugin.config["NOTIFY_COALESCE_SECONDS"] = 60
+    jenkins_plugin.jenkins(
+        DummyRequest(
+            number="3",
+            job_name="job-A",
+            event="jenkins.job.completed",
+            result="FAILURE",
+            userId="fry",
+            url="job/job-A/3/",
+        )
+    )
+    jenkins_plugin.jenkins(
+        DummyRequest(
+            number="4",
+            job_name="job-A",
+            event="jenkins.job.started",
+            builtOn="agent",
+            userId="fry",
+            url="job/job-A/4/",
+        )
+    )
+    jenkins_plugin._webhook_dispatcher.join()
+    texts = [args[0] for (args, kwargs) in notifier.send_message.call_args_list[1:]]
+    assert len(texts) == 2
+    assert "Job Completed" in texts[0]
+    assert "Job Started" in texts[1]
+
+
+def test_completed_digest_test_failures(jenkins_plugin, mocker):
+    notifier = mocker.patch.object(jenkins_plugin, "_get_notifier").return_value
+
+    def make_info(job_name, failure_names, count):
+        return {
+            "status": ":x:",
+            "result": "FAILURE",
+            "job_name": job_name,
+            "url": "job/{}/2/".format(job_name),
+            "number": "2",
+            "test_failures": [
+                {"name": x, "status": "FAILED"} for x in failure_names[:10]
+            ],
+            "test_failures_count": count,
+        }
+
+    names = ["test_{}".format(i) for i in range(12)]
+    jenkins_plugin._send_completed_notifications(
+        "fry",
+        [
+            make_info("job-A", names, 12),
+            make_info("job-B", [], 0),
+            make_info("job-C", names[:2], 2),
+        ],
+    )
+    text, user = notifier.send_message.call_args[0]
+    assert text.endswith(
+        "job-A: **12 failed tests**\n"
+        + "".join("`test_{}`\n".format(i) for i in range(10))
+        + "... and 2 more\n\n"
+        "job-C: **2 failed tests**\n`test_0`\n`test_1`"
+    )
+    assert "job-B:" not in text
+
+
+TEST_REPORT = {
+    "_class": "hudson.tasks.junit.TestResult",
+    "suites": [
+        {
+            "_class": "hudson.tasks.junit.SuiteResult",
+            "cases": [
+                {"_class": "CaseResult", "name": "test_a", "status": "PASSED"},
+                {"_class": "CaseResult", "name": "test_b [x]", "status": "FAILED"},
+            ],
+        },
+        {"_class": "hudson.tasks.junit.SuiteResult", "cases": []},
+        {
+            "_class": "hudson.tasks.junit.SuiteResult",
+            "cases": [
+                {"_class": "CaseResult", "name": 'test_"cases":[', "status": "SKIPPED"},
+                {
+                    "_class": "CaseResult",
+                    "name": 'test_"status":"FAILED"',
+                    "status": "PASSED",
+                },
+                {"_class": "CaseResult", "name": "test_d", "status": "REGRESSION"},
+                {"_class": "CaseResult", "name": "test_e", "status": "FIXED"},
+                {"_class": "CaseResult", "name": "test_f", "status": "FAILED"},
+            ],
+        },
+    ],
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_failed_test_cases(chunk_size, indent):
+    import json
+    from esss_jenkins import iter_failed_test_cases
+
+    text = json.dumps(TEST_REPORT, indent=indent)
+    chunks = (text[i : i + chunk_size] for i in range(0, len(text), chunk_size))
+    assert [x["name"] for x in iter_failed_test_cases(chunks)] == [
+        "test_b [x]",
+        "test_d",
+        "test_f",
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("max_cases", [0, 1, 10])
+def test_summarize_test_report(chunk_size, indent, max_cases):
+    import json
+    from esss_jenkins import summarize_test_report
+
+    text = json.dumps(TEST_REPORT, indent=indent)
+    chunks = (text[i : i + chunk_size] for i in range(0, len(text), chunk_size))
+    failures = summarize_test_report(chunks, max_cases)
+    assert failures.count == 3
+    assert [x["name"] for x in failures.cases] == ["test_b [x]", "test_d", "test_f"][
+        :max_cases
+    ]
+
+
+def test_get_build_test_errors(jenkins_plugin, mocker):
+    import json
+
+    request = mocker.patch.object(
+        jenkins_plugin,
+        "_jenkins_request",
+        return_value=make_response(200, json.dumps(TEST_REPORT).encode(), stream=True),
+    )
+    failures = jenkins_plugin._get_build_test_errors("eden", "12", max_cases=2)
+    assert failures.count == 3
+    assert [x["name"] for x in failures.cases] == ["test_b [x]", "test_d"]
+    args, kwargs = request.call_args
+    assert args == ("GET", "job/eden/12/testReport/api/json")
+    assert kwargs["stream"]
+
+    request.return_value = make_response(404, stream=True)
+    assert jenkins_plugin._get_build_test_errors("eden", "13") == (0, [])
+
+
+def test_finished_build_test_errors_not_cached_on_failure(jenkins_plugin, mocker):
+    import json
+
+    request = mocker.patch.object(
+        jenkins_plugin, "_jenkins_request", return_value=make_response(404, stream=True)
+    )
+    assert jenkins_plugin._get_finished_build_test_errors("eden", "12") == (0, [])
+    request.return_value = make_response(
+        200, b'{"suites": [{"cases": [{"name": "test_a"}]}]}', stream=True
+    )
+    assert jenkins_plugin._get_finished_build_test_errors("eden", "12") == (0, [])
+    assert jenkins_plugin._test_failures_cache.get("eden", "12") is None
+
+    request.return_value = make_response(
+        200, json.dumps(TEST_REPORT).encode(), stream=True
+    )
+    failures = jenkins_plugin._get_finished_build_test_errors("eden", "12")
+    assert failures.count == 3
+    assert jenkins_plugin._test_failures_cache.get("eden", "12").count == 3
+    assert request.call_count == 3
+
+
+def test_test_failures_cache():
+    from esss_jenkins import TestFailures, TestFailuresCache
+
+    storage = {}
+    cache = TestFailuresCache(storage, max_entries=2, max_age=60)
+    assert cache.get("job-A", 1) is None
+    cache.set("job-A", 1, TestFailures(3, [{"name": "test_a", "status": "FAILED"}]))
+    cache.set("job-A", "2", TestFailures(0, []))
+    assert cache.get("job-A", "1") == (3, [{"name": "test_a", "status": "FAILED"}])
+
+    # job-A#2 is the least recently used
+    cache.set("job-B", 7, TestFailures(0, []))
+    assert cache.get("job-A", 2) is None
+    assert sorted(storage) == [
+        "test_failures:job-A#1",
+        "test_failures:job-B#7",
+        "test_failures_cache",
+    ]
+
+    # entries are persisted in the storage
+    cache = TestFailuresCache(storage, max_entries=2, max_age=60)
+    assert cache.get("job-B", 7) == (0, [])
+    assert cache.get_stats() == {"entries": 2, "hits": 1, "misses": 0}
+
+    # the order of hits is persisted too
+    cache.set("job-C", 1, TestFailures(0, []))
+    assert cache.get("job-B", 7) == (0, [])
+    cache = TestFailuresCache(storage, max_entries=2, max_age=60)
+    cache.set("job-D", 1, TestFailures(0, []))
+    assert cache.get("job-B", 7) == (0, [])
+    assert cache.get("job-C", 1) is None
+
+    cache = TestFailuresCache(storage, max_entries=2, max_age=0)
+    assert cache.get("job-B", 7) is None
+    assert sorted(storage) == ["test_failures:job-D#1", "test_failures_cache"]
+
+
+def test_failures(testbot, jenkins_plugin, mocker):
+    from esss_jenkins import TestFailures
+
+    get_request = mocker.patch.object(
+        jenkins_plugin,
+        "_get_jenkins_json_request",
+        return_value={"number": 12, "building": False},
+    )
+    get_test_errors = mocker.patch.object(
+        jenkins_plugin,
+        "_get_build_test_errors",
+        return_value=TestFailures(2, [{"name": "test_a"}, {"name": "test_b"}]),
+    )
+    testbot.push_message("!failures job-A 12")
+    response = testbot.pop_message()
+    assert "Failed tests in job-A" in response
+    assert "2 failed tests" in response
+    assert "test_b" in response
+    get_test_errors.assert_called_once_with("job-A", "12")
+    assert get_request.call_args[0][0] == "job/job-A/12/api/json"
+
+    # finished builds are cached
+    testbot.push_message("!failures job-A 12")
+    assert "2 failed tests" in testbot.pop_message()
+    assert get_request.call_count == 1
+    assert get_test_errors.call_count == 1
+
+    settings = jenkins_plugin.load_user_settings("fry")
+    settings["last_job_listing"] = ["job-A"]
+    jenkins_plugin.save_user_settings("fry", settings)
+    testbot.push_message("!failures 0")
+    assert "2 failed tests" in testbot.pop_message()
+    assert get_request.call_args[0][0] == "job/job-A/lastBuild/api/json"
+    assert get_test_errors.call_count == 1
+
+
+def test_webhook_missing_parameters(jenkins_plugin):
+    request = DummyRequest(job_name="fett-master-linux64", event="jenkins.job.started")
+    assert jenkins_plugin.jenkins(request) == "Missing parameters: userId"
+
+
+def test_event_dispatcher():
+    import logging
+    import threading
+    from esss_jenkins import EventDispatcher
+
+    release = threading.Event()
+    processed = []
+
+    def handler(event):
+        release.wait(5)
+        if event == ("fry", "bad"):
+            raise RuntimeError("bad event")
+        processed.append(event)
+
+    dispatcher = EventDispatcher(
+        handler, workers=2, queue_size=3, log=logging.getLogger(__name__)
+    )
+    try:
+        # the first event is taken by the worker, the others wait in its queue
+        events = [("fry", "started"), ("fry", "bad"), ("fry", "completed")]
+        for event in events:
+            assert dispatcher.submit("fry", event)
+        wait_until(lambda: dispatcher.get_stats()["queued"] == 2)
+        assert dispatcher.submit("fry", ("fry", "extra"))
+        assert not dispatcher.submit("fry", ("fry", "dropped"))
+
+        release.set()
+        dispatcher.join()
+        assert processed == [("fry", "started"), ("fry", "completed"), ("fry", "extra")]
+        assert dispatcher.get_stats() == {
+            "submitted": 4,
+            "processed": 4,
+            "errors": 1,
+            "dropped": 1,
+            "queued": 0,
+        }
+    finally:
+        dispatcher.stop()
+
+
+def test_rocketchat_notifier(mocker):
+    from esss_jenkins import RocketChatNotifier
+
+    login_response = make_response(
+        200, b'{"status": "success", "data": {"authToken": "T1", "userId": "U1"}}'
+    )
+    post = mocker.patch.object(
+        requests.Session,
+        "post",
+        autospec=True,
+        side_effect=[
+            login_response,
+            make_response(200, b'{"success": true}'),
+            make_response(200, b'{"success": true}'),
+            make_response(401, b'{"status": "error"}'),
+            login_response,
+            make_response(200, b'{"success": true}'),
+        ],
+    )
+
+    notifier = RocketChatNotifier("https://my-server.com/rocketchat/", "bot", "secret")
+    notifier.send_message("first", "@fry")
+    notifier.send_message("second", "@fry")
+    assert notifier.logins == 1
+    # token expired: logs in again and retries
+    notifier.send_message("third", "@fry")
+    assert notifier.logins == 2
+
+    urls = [args[1] for (args, kwargs) in post.call_args_list]
+    assert urls == [
+        "https://my-server.com/rocketchat/api/v1/login",
+        "https://my-server.com/rocketchat/api/v1/chat.postMessage",
+        "https://my-server.com/rocketchat/api/v1/chat.postMessage",
+        "https://my-server.com/rocketchat/api/v1/chat.postMessage",
+        "https://my-server.com/rocketchat/api/v1/login",
+        "https://my-server.com/rocketchat/api/v1/chat.postMessage",
+    ]
+    args, kwargs = post.call_args
+    assert kwargs["json"] == {"text": "third", "roomId": "@fry"}
+    assert kwargs["headers"] == {"X-Auth-Token": "T1", "X-User-Id": "U1"}
+
 
 def test_find_string_basic():
     from esss_jenkins import filter_jobs_by_find_string
@@ -214,6 +858,71 @@ def test_find_string_glob():
     )
 
 
+@pytest.mark.parametrize(
+    "query",
+    [
+        "ASIM-501 app win64,linux64",
+        "asim 50? win64",
+        "network-refacto* linux*",
+        "part[15] 27",
+        "eden win64,linux64 27,35",
+        '"eden-win64-27"',
+        '"*rb*kra*" 35',
+        '"etk-*" win64',
+        "unknown",
+        "rb-",
+    ],
+)
+def test_job_name_index(query):
+    from esss_jenkins import JobNameIndex
+
+    index = JobNameIndex(JOBS + ["etk--rb-win64"])
+    expected = filter_jobs_by_find_string_linear(
+        JOBS + ["etk--rb-win64"], query.split()
+    )
+    assert index.find(query.split()) == expected
+
+
+def test_job_name_index_folders():
+    from esss_jenkins import JobNameIndex
+
+    index = JobNameIndex(
+        ["eden/master-win64", "eden/fb-ASIM-501-win64", "etk/master-win64"]
+    )
+    assert index.find(["eden", "win64"]) == [
+        "eden/master-win64",
+        "eden/fb-ASIM-501-win64",
+    ]
+    assert index.find(["eden/master"]) == ["eden/master-win64"]
+    assert index.find(['"etk/*"']) == ["etk/master-win64"]
+
+
+def filter_jobs_by_find_string_linear(job_names, input_factors):
+    """
+    Reference implementation which scans all job names, used to check ``JobNameIndex``.
+    """
+    from fnmatch import fnmatch
+
+    factors = []
+    for factor in input_factors:
+        if factor.startswith('"') and factor.endswith('"'):
+            word = factor[1:-1].lower()
+            job_names = [x for x in job_names if fnmatch(x.lower(), word)]
+        else:
+            factors.extend(factor.lower().split("-"))
+
+    and_factors = [x for x in factors if "," not in x]
+    or_factors = [y for x in factors if "," in x for y in x.split(",")]
+
+    def matches(fields):
+        fields = {x.lower() for x in fields}
+        if not all(any(fnmatch(x, f) for x in fields) for f in and_factors):
+            return False
+        return not or_factors or any(fnmatch(x, f) for f in or_factors for x in fields)
+
+    return [x for x in job_names if matches(set(x.split("-")))]
+
+
 def test_bhist(jenkins_plugin, testbot, mocker, LineMatcher):
     settings = jenkins_plugin.load_user_settings("fry")
     assert settings["jobs"] == []
@@ -224,6 +933,7 @@ def test_bhist(jenkins_plugin, testbot, mocker, LineMatcher):
 
     settings["jobs"] = [dict(job_name="job-A"), dict(job_name="job-B")]
     jenkins_plugin.save_user_settings("fry", settings)
+    mocker.patch.object(jenkins_plugin, "_fetch_bulk_job_statuses", return_value={})
     mocker.patch.object(
         jenkins_plugin, "_fetch_job_status", autospec=True, return_value="RUNNING"
     )
@@ -239,6 +949,111 @@ def test_bhist(jenkins_plugin, testbot, mocker, LineMatcher):
     assert settings["last_job_listing"] == ["job-A", "job-B"]
 
 
+def test_find_pages(jenkins_plugin, testbot, mocker):
+    job_names = ["job-{:03d}".format(i) for i in range(120)]
+    mocker.patch.object(jenkins_plugin, "_fetch_all_job_names", return_value=job_names)
+    fetch_statuses = mocker.patch.object(
+        jenkins_plugin,
+        "_iter_job_statuses",
+        side_effect=lambda names: [(x, "SUCCESS") for x in names],
+    )
+
+    testbot.push_message("!find job")
+    assert testbot.pop_message() == "Hold on, lemme check..."
+    response = testbot.pop_message()
+    assert "Found 120 jobs, showing page 1 of 3:" in response
+    assert "job-000" in response
+    assert "job-049" in response
+    assert "job-050" not in response
+    assert "To see the next page, use !more" in response
+    # only the jobs in the page have their status fetched
+    fetch_statuses.assert_called_once_with(job_names[:50])
+
+    testbot.push_message("!more")
+    response = testbot.pop_message()
+    assert "showing page 2 of 3:" in response
+    assert "job-049" not in response
+    assert "50. " in response
+    assert "job-050" in response
+    assert "job-099" in response
+
+    testbot.push_message("!find job --page 3")
+    testbot.pop_message()
+    response = testbot.pop_message()
+    assert "showing page 3 of 3:" in response
+    assert "job-119" in response
+    assert "!more" not in response
+    fetch_statuses.assert_called_with(job_names[100:])
+
+    testbot.push_message("!more")
+    assert testbot.pop_message() == "No more jobs to show."
+
+    testbot.push_message("!find job --page 4")
+    testbot.pop_message()
+    assert testbot.pop_message() == "There are only 3 pages of jobs."
+
+    testbot.push_message("!find job --page x")
+    assert testbot.pop_message() == "Invalid page number: x"
+
+    # a page alone is not a search
+    testbot.push_message("!find --page 2")
+    assert testbot.pop_message().startswith("Pass some search factors")
+
+    # indexes refer to the whole result, regardless of the page shown
+    jenkins_plugin.save_user_settings("fry", {"token": "secret-token"})
+    trigger = mocker.patch.object(jenkins_plugin, "_trigger_job")
+    testbot.push_message("!build 5 105")
+    testbot.pop_message()
+    assert [c[0][0] for c in trigger.call_args_list] == ["job-005", "job-105"]
+
+
+def test_find_streams_slow_statuses(jenkins_plugin, testbot, mocker):
+    import threading
+
+    jenkins_plugin.config["LISTING_STATUS_WAIT"] = 0.1
+    jenkins_plugin.config["LISTING_UPDATE_INTERVAL"] = 0.1
+    mocker.patch.object(
+        jenkins_plugin, "_fetch_all_job_names", return_value=["job-A", "job-B", "job-C"]
+    )
+    slow_job_released = threading.Event()
+
+    def iter_job_statuses(job_names):
+        yield "job-A", "SUCCESS"
+        yield "job-C", "FAILURE"
+        slow_job_released.wait(timeout=10)
+        yield "job-B", "RUNNING"
+
+    mocker.patch.object(
+        jenkins_plugin, "_iter_job_statuses", side_effect=iter_job_statuses
+    )
+    testbot.push_message("!find job")
+    testbot.pop_message()
+    # the listing is sent without waiting for the slow job
+    response = testbot.pop_message()
+    assert "Found these 3 jobs:" in response
+    assert "0. :white_check_mark: job-A" in response
+    assert "1. :hourglass_flowing_sand: job-B" in response
+    assert "2. :x: job-C" in response
+
+    slow_job_released.set()
+    response = testbot.pop_message()
+    assert "Status update:" in response
+    assert "1. :arrows_counterclockwise: job-B" in response
+    assert "job-A" not in response
+    assert "job-C" not in response
+
+
+def test_parse_page_argument():
+    from esss_jenkins import parse_page_argument
+
+    assert parse_page_argument(["etk", "win64"]) == (["etk", "win64"], 1)
+    assert parse_page_argument(["etk", "--page", "3", "win64"]) == (["etk", "win64"], 3)
+    assert parse_page_argument(["--page=2", "etk"]) == (["etk"], 2)
+    for args in (["--page"], ["--page", "0"], ["--page=-1"]):
+        with pytest.raises(ValueError):
+            parse_page_argument(args)
+
+
 @pytest.mark.parametrize(
     "expected, return_value",
     [
@@ -257,8 +1072,7 @@ def test_fetch_job_status(jenkins_plugin, mocker, expected, return_value):
 
 
 def test_fetch_job_status_not_started(jenkins_plugin, mocker):
-    response_404 = requests.Response()
-    response_404.status_code = 404
+    response_404 = make_response(404)
     mocker.patch.object(
         jenkins_plugin,
         "_get_jenkins_json_request",
@@ -270,6 +1084,774 @@ def test_fetch_job_status_not_started(jenkins_plugin, mocker):
     assert jenkins_plugin._fetch_job_status("dummy") == "NOT_STARTED"
 
 
+def test_fetch_job_statuses(jenkins_plugin, mocker):
+    import time
+
+    jenkins_plugin.config["JENKINS_MAX_WORKERS"] = 4
+    statuses = {
+        "job-A": "SUCCESS",
+        "job-B": "RUNNING",
+        "job-C": None,
+        "job-D": "FAILURE",
+    }
+
+    def fetch_job_status(job_name):
+        # make the first jobs finish last to check the results are kept in order
+        time.sleep(0.05 if job_name in ("job-A", "job-B") else 0)
+        return statuses[job_name]
+
+    mocker.patch.object(jenkins_plugin, "_fetch_bulk_job_statuses", return_value={})
+    mocker.patch.object(
+        jenkins_plugin, "_fetch_job_status", side_effect=fetch_job_status
+    )
+    job_names = sorted(statuses)
+    assert jenkins_plugin._fetch_job_statuses(job_names) == [
+        "SUCCESS",
+        "RUNNING",
+        None,
+        "FAILURE",
+    ]
+
+
+def test_fetch_job_statuses_bulk(jenkins_plugin, mocker):
+    get_request = mocker.patch.object(
+        jenkins_plugin,
+        "_get_jenkins_json_request",
+        return_value={
+            "jobs": [
+                {"fullName": "job-A", "color": "blue", "lastBuild": None},
+                {
+                    "fullName": "job-B",
+                    "color": "blue_anime",
+                    "lastBuild": {"building": True, "result": None},
+                },
+                {
+                    "fullName": "job-C",
+                    "color": "red",
+                    "lastBuild": {"building": False, "result": "FAILURE"},
+                },
+            ]
+        },
+    )
+    fetch_job_status = mocker.patch.object(
+        jenkins_plugin, "_fetch_job_status", return_value=None
+    )
+    statuses = jenkins_plugin._fetch_job_statuses(["job-C", "job-X", "job-A", "job-B"])
+    assert statuses == ["FAILURE", None, "NOT_STARTED", "RUNNING"]
+    assert get_request.call_count == 1
+    fetch_job_status.assert_called_once_with("job-X")
+
+
+def test_job_catalog():
+    import logging
+    from esss_jenkins import JobCatalog
+
+    fetched = []
+
+    def fetch():
+        fetched.append(None)
+        return ["job-{}".format(len(fetched))]
+
+    catalog = JobCatalog(fetch, logging.getLogger(__name__))
+    assert catalog.get_job_names(ttl=60) == ["job-1"]
+    assert catalog.get_job_names(ttl=60) == ["job-1"]
+    assert len(fetched) == 1
+
+    # stale names are returned while they are refreshed in the background
+    assert catalog.get_job_names(ttl=0) == ["job-1"]
+    wait_until(lambda: catalog.refreshes == 2)
+    assert catalog.get_job_names(ttl=60) == ["job-2"]
+
+    catalog.invalidate_if_unknown("job-2")
+    assert catalog.invalidations == 0
+    catalog.invalidate_if_unknown("job-new")
+    wait_until(lambda: catalog.refreshes == 3)
+    assert catalog.get_job_names(ttl=60) == ["job-3"]
+
+    stats = catalog.get_stats()
+    del stats["age"]
+    assert stats == {
+        "jobs": 1,
+        "hits": 3,
+        "stale_hits": 1,
+        "misses": 1,
+        "refreshes": 3,
+        "invalidations": 1,
+    }
+
+
+def test_jenkins_stats(jenkins_plugin, mocker):
+    mocker.patch.object(
+        jenkins_plugin, "_fetch_all_job_names", return_value=["job-A", "job-B"]
+    )
+    assert jenkins_plugin._get_job_name_index().job_names == ["job-A", "job-B"]
+    assert jenkins_plugin._find_all_job_names_filtered(["B"]) == ["job-B"]
+    response = jenkins_plugin.jenkins_stats(None, "")
+    assert "Job catalog: 2 jobs" in response
+    assert "hits: 1, stale hits: 0, misses: 1" in response
+
+
+def wait_until(predicate, timeout=5.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timeout waiting for condition"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize(
+    "job_name, expected",
+    [
+        ("eden-win64", "job/eden-win64"),
+        ("eden/master-win64", "job/eden/job/master-win64"),
+        ("org/eden/fb-ASIM-501", "job/org/job/eden/job/fb-ASIM-501"),
+    ],
+)
+def test_get_job_path(job_name, expected):
+    from esss_jenkins import get_job_path
+
+    assert get_job_path(job_name) == expected
+
+
+def test_job_folder_crawler():
+    from esss_jenkins import JobFolderCrawler
+
+    folders = {
+        "": [("job-A", False), ("eden", True), ("empty", True)],
+        "eden": [("master", False), ("fb", True)],
+        "eden/fb": [("ASIM-501", False)],
+        "empty": [],
+    }
+    fetched = []
+
+    def fetch_folders(folder_names):
+        fetched.extend(folder_names)
+        return [list(folders[x]) for x in folder_names]
+
+    crawler = JobFolderCrawler(fetch_folders)
+    expected = ["job-A", "eden/master", "eden/fb/ASIM-501"]
+    assert crawler.crawl(ttl=60) == expected
+    assert fetched == ["", "eden", "empty", "eden/fb"]
+
+    # cached folders are not fetched again
+    del fetched[:]
+    assert crawler.crawl(ttl=60) == expected
+    assert fetched == []
+
+    # known jobs don't invalidate anything
+    crawler.invalidate_if_unknown("eden/fb/ASIM-501")
+    crawler.invalidate_if_unknown("job-A")
+    assert crawler.get_stats()["invalidations"] == 0
+
+    # only the folder where a new job should be is fetched again
+    folders["eden/fb"].append(("ASIM-502", False))
+    crawler.invalidate_if_unknown("eden/fb/ASIM-502")
+    assert crawler.crawl(ttl=60) == expected + ["eden/fb/ASIM-502"]
+    assert fetched == ["eden/fb"]
+
+    # a job in a new folder invalidates the parent of that folder
+    del fetched[:]
+    folders["eden"].append(("rb", True))
+    folders["eden/rb"] = [("v1.0", False)]
+    crawler.invalidate_if_unknown("eden/rb/v1.0")
+    assert crawler.crawl(ttl=60)[-1] == "eden/rb/v1.0"
+    assert fetched == ["eden", "eden/rb"]
+    assert crawler.get_stats() == {
+        "folders": 5,
+        "fetches": 7,
+        "reuses": 10,
+        "invalidations": 2,
+    }
+
+    # everything is fetched again after the ttl
+    del fetched[:]
+    crawler.crawl(ttl=0)
+    assert len(fetched) == 5
+
+
+def test_job_catalog_refresh_fetches_folders(jenkins_plugin, mocker):
+    folders = {"": [("job-A", False), ("eden", True)], "eden": [("master", False)]}
+    mocker.patch.object(
+        jenkins_plugin,
+        "_fetch_folders_items",
+        side_effect=lambda names: [list(folders[x]) for x in names],
+    )
+    jenkins_plugin.config["JOB_CATALOG_TTL"] = 60
+    now = [100.0]
+    mocker.patch("time.monotonic", side_effect=lambda: now[0])
+    assert jenkins_plugin._job_catalog.refresh().job_names == ["job-A", "eden/master"]
+
+    # a new top-level job is listed once the catalog is stale
+    folders[""].append(("job-B", False))
+    now[0] += 61
+    assert jenkins_plugin._job_catalog.refresh().job_names == [
+        "job-A",
+        "job-B",
+        "eden/master",
+    ]
+
+
+def test_fetch_folder_items(jenkins_plugin, mocker):
+    get_request = mocker.patch.object(
+        jenkins_plugin,
+        "_get_jenkins_json_request",
+        return_value={
+            "jobs": [
+                {"_class": "hudson.model.FreeStyleProject", "name": "master"},
+                {
+                    "_class": "org.jenkinsci.plugins.workflow.multibranch."
+                    "WorkflowMultiBranchProject",
+                    "name": "fb",
+                },
+            ]
+        },
+    )
+    assert jenkins_plugin._fetch_folder_items("org/eden") == [
+        ("master", False),
+        ("fb", True),
+    ]
+    get_request.assert_called_once_with(
+        "job/org/job/eden/api/json", params={"tree": "jobs[name]"}
+    )
+    jenkins_plugin._fetch_folder_items("")
+    get_request.assert_called_with("api/json", params={"tree": "jobs[name]"})
+
+
+@pytest.mark.parametrize(
+    "query_url, expected",
+    [
+        ("api/json", "api/json"),
+        ("job/eden-win64/api/json", "job/*/api/json"),
+        ("job/eden-win64/12/testReport/api/json", "job/*/*/testReport/api/json"),
+        ("job/eden-win64/buildWithParameters?A=1", "job/*/buildWithParameters"),
+        ("job/folder/job/eden-2/lastBuild/api/json", "job/*/job/*/lastBuild/api/json"),
+    ],
+)
+def test_get_endpoint_name(query_url, expected):
+    from esss_jenkins import get_endpoint_name
+
+    assert get_endpoint_name(query_url) == expected
+
+
+def test_jenkins_requests_share_session(jenkins_plugin, mocker):
+    response = make_response(
+        200, b'{"jobs": []}', url="https://my-server.com/jenkins/api/json"
+    )
+    request = mocker.patch.object(
+        requests.Session, "request", autospec=True, return_value=response
+    )
+
+    assert jenkins_plugin._get_jenkins_json_request("api/json") == {"jobs": []}
+    jenkins_plugin.save_user_settings("fry", {"token": "fry-token"})
+    jenkins_plugin._post_jenkins_json_request("job/eden-win64/build", "fry")
+
+    assert request.call_count == 2
+    (get_session, get_method, get_url), get_kwargs = request.call_args_list[0]
+    (post_session, post_method, post_url), post_kwargs = request.call_args_list[1]
+    assert get_session is post_session
+    assert (get_method, get_url) == ("GET", "https://my-server.com/jenkins/api/json")
+    assert get_kwargs["auth"] == ("jenkins-user", "jenkins-secret-token")
+    assert get_kwargs["timeout"] == 30
+    assert (post_method, post_url) == (
+        "POST",
+        "https://my-server.com/jenkins/job/eden-win64/build",
+    )
+    assert post_kwargs["auth"] == ("fry", "fry-token")
+
+    response = jenkins_plugin.jenkins_stats(None, "")
+    assert "GET api/json: 1 requests, 0 errors, 12 B" in response
+    assert "POST job/*/build: 1 requests, 0 errors" in response
+
+
+def test_tracer():
+    import threading
+    from esss_jenkins import Tracer
+
+    tracer = Tracer()
+    users = []
+    with tracer.trace("find", "fry"):
+        with tracer.span("filter"):
+            pass
+
+        def fetch():
+            users.append(tracer.get_user())
+            with tracer.span("status_fetch"):
+                pass
+
+        thread = threading.Thread(target=tracer.bind(fetch))
+        thread.start()
+        thread.join()
+    with tracer.span("notify"):
+        pass
+
+    stats = tracer.get_stats()
+    assert sorted(stats, key=str) == [
+        ("find", "filter"),
+        ("find", "status_fetch"),
+        ("find", "total"),
+        (None, "notify"),
+    ]
+    assert stats[("find", "total")]["count"] == 1
+    assert users == ["fry"]
+    assert (tracer.get_command(), tracer.get_user()) == (None, None)
+
+
+def test_histogram():
+    from esss_jenkins import Histogram, get_histogram_percentile
+
+    histogram = Histogram([0.1, 1.0])
+    for value in [0.05, 0.05, 0.5, 3.0]:
+        histogram.observe(value)
+    stats = histogram.get_stats()
+    assert stats["buckets"] == [(0.1, 2), (1.0, 3)]
+    assert (stats["count"], stats["total"], stats["max"]) == (4, 3.6, 3.0)
+    assert get_histogram_percentile(stats, 50) == 0.1
+    assert get_histogram_percentile(stats, 75) == 1.0
+    assert get_histogram_percentile(stats, 99) == 3.0
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [(0, "0 B"), (1023, "1023 B"), (1536, "1.5 KiB"), (3 * 1024 ** 3, "3072.0 MiB")],
+)
+def test_format_size(size, expected):
+    from esss_jenkins import format_size
+
+    assert format_size(size) == expected
+
+
+def test_rate_limiter(mocker):
+    from esss_jenkins import RateLimiter
+
+    now = [100.0]
+    mocker.patch("time.monotonic", side_effect=lambda: now[0])
+    limiter = RateLimiter(rate=10, burst=4, user_share=0.5)
+
+    assert limiter.reserve("fry", max_delay=1) == 0
+    assert limiter.reserve("fry", max_delay=1) == 0
+    # fry used up his share of the burst, and waits for his own bucket
+    assert limiter.reserve("fry", max_delay=1) == pytest.approx(0.2)
+    # the global bucket still has a token for others
+    assert limiter.reserve("bender", max_delay=1) == 0
+    assert limiter.reserve(None, max_delay=0.05) is None
+    assert limiter.reserve(None, max_delay=1) == pytest.approx(0.1)
+
+    now[0] += 10
+    assert limiter.reserve("fry", max_delay=0) == 0
+    assert limiter.get_stats() == {"acquired": 6, "throttled": 2, "rejected": 1}
+
+    unlimited = RateLimiter(rate=0, burst=0, user_share=0.5)
+    assert all(unlimited.reserve("fry", max_delay=0) == 0 for _ in range(100))
+
+
+def test_circuit_breaker(mocker):
+    from esss_jenkins import CircuitBreaker
+
+    now = [100.0]
+    mocker.patch("time.monotonic", side_effect=lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    assert breaker.allow()
+    breaker.record(ok=False)
+    breaker.record(ok=True)
+    breaker.record(ok=False)
+    assert breaker.allow()
+    breaker.record(ok=False)
+    assert not breaker.allow()
+    assert breaker.get_retry_after() == 30
+
+    # a single trial request after reset_timeout, which fails
+    now[0] += 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(ok=False)
+    assert not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record(ok=True)
+    assert breaker.allow()
+    assert breaker.get_stats() == {
+        "state": "closed",
+        "failures": 0,
+        "opens": 1,
+        "rejected": 3,
+    }
+
+
+def test_jenkins_unavailable(jenkins_plugin, testbot, mocker):
+    from esss_jenkins import CircuitBreaker
+
+    jenkins_plugin._circuit_breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=30
+    )
+    reserve = mocker.spy(jenkins_plugin._rate_limiter, "reserve")
+    request = mocker.patch.object(
+        requests.Session,
+        "request",
+        autospec=True,
+        side_effect=requests.ConnectionError("connection refused"),
+    )
+    cached_key = ("job/job-A/api/json", ())
+    jenkins_plugin._json_response_cache.set(cached_key, {"ETag": '"1"'}, {"id": 1})
+
+    jenkins_plugin.config["JENKINS_RETRY_BACKOFF"] = 0
+
+    # each retry counts as a failure, so retrying stops as soon as the circuit opens
+    with jenkins_plugin._tracer.attach("find", "fry"):
+        with pytest.raises(requests.ConnectionError):
+            jenkins_plugin._get_jenkins_json_request("api/json")
+    assert reserve.call_args_list == [mocker.call("fry", 30)] * 2
+
+    # the circuit is open: fail fast, serving cached responses when there is one
+    with pytest.raises(jenkins_plugin.UnavailableError, match="not responding"):
+        jenkins_plugin._get_jenkins_json_request("api/json")
+    assert jenkins_plugin._get_jenkins_json_request("job/job-A/api/json") == {"id": 1}
+    assert list(jenkins_plugin._iter_job_statuses(["job-A", "job-B"])) == [
+        ("job-A", "UNKNOWN"),
+        ("job-B", "UNKNOWN"),
+    ]
+    testbot.push_message("!find job")
+    assert testbot.pop_message() == "Hold on, lemme check..."
+    assert testbot.pop_message().startswith(
+        "Can't list the jobs: Jenkins is not responding, trying again in"
+    )
+    jenkins_plugin.save_user_settings(
+        "fry", {"token": "fry-token", "aliases": {"a": (["job"], None)}}
+    )
+    testbot.push_message("!build a")
+    assert testbot.pop_message().startswith(
+        "Can't list the jobs: Jenkins is not responding, trying again in"
+    )
+    assert request.call_count == 2
+
+    response = jenkins_plugin.jenkins_stats(None, "")
+    assert "Circuit breaker: open, 2 consecutive failures, 1 opens" in response
+
+
+def test_jenkins_request_retries(jenkins_plugin, http_server, mocker):
+    from esss_jenkins import CircuitBreaker
+
+    http_server.responses = {
+        ("GET", "/jenkins/api/json"): (503, None),
+        ("POST", "/jenkins/job/job-A/build"): (500, None),
+    }
+    jenkins_plugin.config["JENKINS_URL"] = http_server.url
+    jenkins_plugin.config["JENKINS_RETRY_BACKOFF"] = 0
+    jenkins_plugin._circuit_breaker = CircuitBreaker(
+        failure_threshold=10, reset_timeout=30
+    )
+    reserve = mocker.spy(jenkins_plugin._rate_limiter, "reserve")
+
+    # every attempt goes through the rate limiter and the circuit breaker
+    r = jenkins_plugin._jenkins_request("GET", "api/json", auth=None)
+    assert r.status_code == 503
+    assert len(http_server.requests) == 4
+    assert reserve.call_count == 4
+    assert jenkins_plugin._circuit_breaker.get_stats()["failures"] == 4
+
+    # build triggers are not retried after reaching Jenkins
+    del http_server.requests[:]
+    r = jenkins_plugin._jenkins_request("POST", "job/job-A/build", auth=None)
+    assert r.status_code == 500
+    assert len(http_server.requests) == 1
+
+    # timeouts are never retried
+    request = mocker.patch.object(
+        requests.Session, "request", side_effect=requests.ReadTimeout("timed out")
+    )
+    with pytest.raises(requests.ReadTimeout):
+        jenkins_plugin._jenkins_request("GET", "api/json", auth=None)
+    assert request.call_count == 1
+    assert jenkins_plugin._circuit_breaker.get_stats()["failures"] == 6
+
+
+def test_async_jenkins_client_retries(jenkins_plugin, http_server, mocker):
+    import asyncio
+    from esss_jenkins import CircuitBreaker
+
+    pytest.importorskip("aiohttp")
+    http_server.responses = {("GET", "/jenkins/api/json"): (503, None)}
+    jenkins_plugin.config["JENKINS_URL"] = http_server.url
+    jenkins_plugin.config["JENKINS_ASYNC_CLIENT"] = True
+    jenkins_plugin.config["JENKINS_RETRY_BACKOFF"] = 0
+    jenkins_plugin._circuit_breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=30
+    )
+    client = jenkins_plugin._get_async_jenkins()
+
+    # retries stop as soon as the circuit opens
+    response, body = client.run(client.request("GET", "api/json"))
+    assert response.status_code == 503
+    assert len(http_server.requests) == 2
+    with pytest.raises(jenkins_plugin.UnavailableError):
+        client.run(client.request("GET", "api/json"))
+
+    # timeouts are never retried
+    jenkins_plugin._circuit_breaker = client.circuit_breaker = CircuitBreaker(
+        failure_threshold=10, reset_timeout=30
+    )
+    request = mocker.patch.object(
+        client._session, "request", side_effect=asyncio.TimeoutError()
+    )
+    with pytest.raises(asyncio.TimeoutError):
+        client.run(client.request("GET", "api/json"))
+    assert request.call_count == 1
+    assert client.circuit_breaker.get_stats()["failures"] == 1
+
+
+def test_jenkins_trace(jenkins_plugin, testbot, mocker):
+    mocker.patch.object(
+        jenkins_plugin, "_fetch_all_job_names", return_value=["job-A", "job-B"]
+    )
+    mocker.patch.object(
+        jenkins_plugin,
+        "_iter_job_statuses",
+        side_effect=lambda names: [(x, "SUCCESS") for x in names],
+    )
+    assert jenkins_plugin.jenkins_trace(None, "") == "No commands traced yet."
+
+    testbot.push_message("!find job")
+    testbot.pop_message()
+    testbot.pop_message()
+    wait_until(lambda: ("find", "total") in jenkins_plugin._tracer.get_stats())
+    jenkins_plugin._request_stats.record("GET api/json", 0.2, size=2048)
+
+    response = jenkins_plugin.jenkins_trace(None, "")
+    lines = response.splitlines()
+    find_index = lines.index("find:")
+    assert lines[find_index + 1].startswith("  total: 1 calls, avg")
+    for span in ["catalog_fetch", "filter", "status_fetch", "storage_load"]:
+        assert "  {}: 1 calls".format(span) in response
+    assert "  GET api/json: 2.0 KiB, 1 calls, avg 200 ms, p50 200 ms" in response
+
+
+def test_jenkins_metrics(jenkins_plugin):
+    jenkins_plugin._request_stats.record("GET api/json", 0.2, size=2048)
+    jenkins_plugin._request_stats.record("GET api/json", 20.0, ok=False)
+    with jenkins_plugin._tracer.trace("find"):
+        pass
+
+    response = jenkins_plugin.jenkins_metrics(None)
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    lines = response.body.splitlines()
+    assert "# TYPE errbot_jenkins_request_duration_seconds histogram" in lines
+    labels = 'endpoint="GET api/json"'
+    assert (
+        'errbot_jenkins_request_duration_seconds_bucket{%s,le="0.25"} 1' % labels
+        in lines
+    )
+    assert (
+        'errbot_jenkins_request_duration_seconds_bucket{%s,le="+Inf"} 2' % labels
+        in lines
+    )
+    assert "errbot_jenkins_request_duration_seconds_sum{%s} 20.2" % labels in lines
+    assert "errbot_jenkins_request_duration_seconds_count{%s} 2" % labels in lines
+    assert "errbot_jenkins_request_errors_total{%s} 1" % labels in lines
+    assert "errbot_jenkins_response_bytes_total{%s} 2048" % labels in lines
+    assert (
+        'errbot_jenkins_command_duration_seconds_count{command="find",span="total"} 1'
+        in lines
+    )
+
+
+def test_identical_requests_are_coalesced(jenkins_plugin, mocker):
+    import threading
+
+    release = threading.Event()
+    response = make_response(200, b'{"jobs": []}')
+
+    def jenkins_request(method, query_url, auth, params, headers):
+        release.wait(timeout=10)
+        return response
+
+    request = mocker.patch.object(
+        jenkins_plugin, "_jenkins_request", side_effect=jenkins_request
+    )
+    results = []
+
+    def get(params):
+        results.append(jenkins_plugin._get_jenkins_json_request("api/json", params))
+
+    threads = [
+        threading.Thread(target=get, args=({"tree": "jobs[name]"},)),
+        threading.Thread(target=get, args=({"tree": "jobs[name]"},)),
+        threading.Thread(target=get, args=({"tree": "jobs[color]"},)),
+    ]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: jenkins_plugin._single_flight.get_stats()["shared"] == 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [{"jobs": []}] * 3
+    assert request.call_count == 2
+    assert jenkins_plugin._single_flight.get_stats() == {"calls": 2, "shared": 1}
+
+    # results are not kept once the call finishes
+    response.status_code = 500
+    with pytest.raises(jenkins_plugin.ResponseError):
+        jenkins_plugin._get_jenkins_json_request("api/json")
+    assert request.call_count == 3
+
+
+def test_conditional_json_requests(jenkins_plugin, mocker):
+    responses = [
+        make_response(200, b'{"jobs": [1]}', {"ETag": '"v1"'}),
+        make_response(304),
+        make_response(200, b'{"jobs": [2]}', {"Last-Modified": "Tue, 01 Jan 2019"}),
+        make_response(200, b'{"jobs": [3]}'),
+        make_response(200, b'{"jobs": [4]}'),
+    ]
+    request = mocker.patch.object(
+        jenkins_plugin, "_jenkins_request", side_effect=responses
+    )
+
+    def get():
+        return jenkins_plugin._get_jenkins_json_request("api/json", {"tree": "jobs"})
+
+    def sent_headers():
+        return request.call_args[1]["headers"]
+
+    assert get() == {"jobs": [1]}
+    assert sent_headers() == {"Accept-Encoding": "gzip"}
+    # not modified: the previous body is reused
+    assert get() == {"jobs": [1]}
+    assert sent_headers() == {"Accept-Encoding": "gzip", "If-None-Match": '"v1"'}
+    assert get() == {"jobs": [2]}
+    assert sent_headers() == {"Accept-Encoding": "gzip", "If-None-Match": '"v1"'}
+    assert get() == {"jobs": [3]}
+    assert sent_headers() == {
+        "Accept-Encoding": "gzip",
+        "If-Modified-Since": "Tue, 01 Jan 2019",
+    }
+    # responses without validators are not kept
+    assert get() == {"jobs": [4]}
+    assert sent_headers() == {"Accept-Encoding": "gzip"}
+
+    assert jenkins_plugin._json_response_cache.get_stats() == {
+        "entries": 0,
+        "not_modified": 1,
+        "modified": 2,
+        "misses": 2,
+    }
+
+
+@pytest.fixture
+def http_server():
+    """
+    Local HTTP server answering with the ``(status_code, payload)`` given by the test for each
+    ``(method, path)``, recording the requests received.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        responses = {}
+        requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self):
+            self.server.requests.append(
+                (self.command, self.path, self.headers.get("Authorization"))
+            )
+            status_code, payload = self.server.responses.get(
+                (self.command, self.path.split("?")[0]), (404, None)
+            )
+            body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+            self.send_response(status_code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    server = Server(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://{}:{}/jenkins".format(*server.server_address)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_jenkins_client(jenkins_plugin, testbot, http_server, mocker):
+    import base64
+
+    pytest.importorskip("aiohttp")
+    folder_class = "com.cloudbees.hudson.plugins.folder.Folder"
+    http_server.responses = {
+        ("GET", "/jenkins/job/job-A/lastBuild/api/json"): (200, {"result": "SUCCESS"}),
+        ("GET", "/jenkins/job/job-B/lastBuild/api/json"): (200, {"result": None}),
+        ("GET", "/jenkins/job/job-A/api/json"): (200, {}),
+        ("GET", "/jenkins/job/job-C/api/json"): (200, {}),
+        ("GET", "/jenkins/job/job-E/api/json"): (200, {}),
+        ("GET", "/jenkins/api/json"): (
+            200,
+            {"jobs": [{"name": "job-A"}, {"name": "eden", "_class": folder_class}]},
+        ),
+        ("GET", "/jenkins/job/eden/api/json"): (200, {"jobs": [{"name": "master"}]}),
+        ("GET", "/jenkins/job/job-P/api/json"): (
+            200,
+            {
+                "actions": [{"parameterDefinitions": [{"name": "MODE"}]}],
+                "lastBuild": {
+                    "number": 3,
+                    "actions": [{"parameters": [{"name": "MODE", "value": "src"}]}],
+                },
+            },
+        ),
+        ("POST", "/jenkins/job/job-A/build"): (201, None),
+        ("POST", "/jenkins/job/job-P/buildWithParameters"): (201, None),
+        ("POST", "/jenkins/job/job-E/build"): (500, None),
+    }
+    jenkins_plugin.config["JENKINS_URL"] = http_server.url
+    jenkins_plugin.config["JENKINS_ASYNC_CLIENT"] = True
+    jenkins_plugin.config["JENKINS_RETRY_BACKOFF"] = 0
+    mocker.patch.object(jenkins_plugin, "_fetch_bulk_job_statuses", return_value={})
+
+    statuses = jenkins_plugin._fetch_job_statuses(["job-A", "job-B", "job-C", "job-X"])
+    assert statuses == ["SUCCESS", "RUNNING", "NOT_STARTED", None]
+    assert jenkins_plugin._fetch_all_job_names() == ["job-A", "eden/master"]
+    bot_auth = (
+        "Basic " + base64.b64encode(b"jenkins-user:jenkins-secret-token").decode()
+    )
+    assert {auth for (method, path, auth) in http_server.requests} == {bot_auth}
+
+    del http_server.requests[:]
+    jenkins_plugin.save_user_settings(
+        "fry", {"token": "fry-token", "last_job_listing": ["job-A", "job-P", "job-E"]}
+    )
+    testbot.push_message("!build 0 1 2")
+    response = testbot.pop_message()
+    assert "Triggered 2 jobs:" in response
+    assert "Failed to trigger 1 jobs:" in response
+    assert "job-E" in response and "Jenkins answered 500" in response
+
+    fry_auth = "Basic " + base64.b64encode(b"fry:fry-token").decode()
+    posts = sorted(
+        (path, auth)
+        for (method, path, auth) in http_server.requests
+        if method == "POST"
+    )
+    assert posts == [
+        ("/jenkins/job/job-A/build", fry_auth),
+        ("/jenkins/job/job-E/build", fry_auth),
+        ("/jenkins/job/job-P/buildWithParameters?MODE=src", fry_auth),
+    ]
+    # failed triggers are not retried
+    assert len(http_server.requests) == 6
+    assert "GET job/*/lastBuild/api/json" in jenkins_plugin._request_stats.get_stats()
+
+
 JOBS = [
     "alfasim-fb-ASIM-501-network-refactorings-part1-app-win64",
     "alfasim-fb-ASIM-501-network-refactorings-part1-app-win64g",
@@ -283,3 +1865,114 @@ JOBS = [
     "etk-rb-KRA-v2.5.0-win64-27",
     "etk-rb-KRA-v2.5.0-win64-35",
 ]
+
+
+def test_job_watches():
+    from esss_jenkins import JobWatches
+
+    storage = {}
+    watches = JobWatches(storage)
+    watches.add("fry", {"job-A": "SUCCESS", "job-B": "UNKNOWN"})
+    watches.add("bender", {"job-A": "SUCCESS"})
+    assert watches.get_job_names() == ["job-A", "job-B"]
+    assert watches.get_jobs("fry") == {"job-A": "SUCCESS", "job-B": "UNKNOWN"}
+
+    assert watches.update("job-A", "SUCCESS") == []
+    assert watches.update("job-A", "RUNNING", notified_user="bender") == ["fry"]
+    assert watches.update("job-A", "UNKNOWN") == []
+    assert watches.update("job-A", "FAILURE") == ["bender", "fry"]
+    # the status of job-B was not known, so it is not a change
+    assert watches.update("job-B", "SUCCESS") == []
+    assert watches.update("job-C", "SUCCESS") == []
+
+    assert JobWatches(storage).get_jobs("fry") == {
+        "job-A": "FAILURE",
+        "job-B": "SUCCESS",
+    }
+    assert watches.remove("fry", ["job-B", "job-C"]) == ["job-B"]
+    assert watches.remove("fry") == ["job-A"]
+    assert watches.get_stats() == {"jobs": 1, "watches": 1, "updates": 3}
+    assert JobWatches(storage).get_job_names() == ["job-A"]
+
+
+def test_watch(jenkins_plugin, testbot, mocker):
+    notifier = mocker.patch.object(jenkins_plugin, "_get_notifier").return_value
+    statuses = {"job-A": "SUCCESS", "job-B": "RUNNING", "job-C": "FAILURE"}
+    fetch_bulk_job_statuses = mocker.patch.object(
+        jenkins_plugin, "_fetch_bulk_job_statuses", side_effect=lambda: dict(statuses)
+    )
+    jenkins_plugin.save_user_settings(
+        "fry",
+        {
+            "last_job_listing": ["job-A", "job-B", "job-C"],
+            "aliases": {"c": (["job-C"], None)},
+        },
+    )
+    mocker.patch.object(
+        jenkins_plugin, "_fetch_all_job_names", return_value=sorted(statuses)
+    )
+
+    testbot.push_message("!watch")
+    assert testbot.pop_message().startswith("You are not watching any jobs")
+    testbot.push_message("!watch 0 5")
+    assert testbot.pop_message() == "No job with index 5 in your last listing."
+    testbot.push_message("!watch unknown-alias")
+    assert testbot.pop_message().startswith("Pass indexes of your last listing")
+
+    testbot.push_message("!watch 0 1")
+    response = testbot.pop_message()
+    assert "Watching 2 jobs" in response
+    assert (
+        ":white_check_mark: job-A (https://my-server.com/jenkins/job/job-A)" in response
+    )
+    testbot.push_message("!watch c")
+    assert "Watching 1 jobs" in testbot.pop_message()
+    testbot.push_message("!watch")
+    response = testbot.pop_message()
+    assert "job-A" in response and "job-B" in response and "job-C" in response
+
+    # updates are pushed by webhook events of builds by other users
+    event = {
+        "number": "7",
+        "job_name": "job-A",
+        "timestamp": "1508516240981",
+        "builtOn": "ci01",
+        "event": "jenkins.job.started",
+        "userId": "bender",
+        "url": "job/job-A/7/",
+    }
+    jenkins_plugin.jenkins(DummyRequest(**event))
+    jenkins_plugin._webhook_dispatcher.join()
+    assert notifier.send_message.call_count == 2
+    text, user = notifier.send_message.call_args[0]
+    assert user == "@fry"
+    assert (
+        ":arrows_counterclockwise: [job-A](https://my-server.com/jenkins/job/job-A/7/) "
+        "build **7** started by bender" in text
+    )
+
+    # jobs without events are polled in a batch, notifying only about changes; the status
+    # of job-A is still known from the webhook event
+    notifier.send_message.reset_mock()
+    fetch_bulk_job_statuses.reset_mock()
+    jenkins_plugin._poll_watched_jobs()
+    assert notifier.send_message.call_count == 0
+    statuses["job-B"] = "UNSTABLE"
+    statuses["job-C"] = "SUCCESS"
+    jenkins_plugin._poll_watched_jobs()
+    assert fetch_bulk_job_statuses.call_count == 2
+    assert notifier.send_message.call_count == 1
+    text, user = notifier.send_message.call_args[0]
+    assert user == "@fry"
+    assert "job-A" not in text
+    assert (
+        "[job-B](https://my-server.com/jenkins/job/job-B) is now **UNSTABLE**" in text
+    )
+    assert "[job-C](https://my-server.com/jenkins/job/job-C) is now **SUCCESS**" in text
+
+    testbot.push_message("!unwatch 2")
+    assert testbot.pop_message() == "Stopped watching 1 jobs."
+    testbot.push_message("!unwatch")
+    assert testbot.pop_message() == "Stopped watching 2 jobs."
+    testbot.push_message("!unwatch")
+    assert testbot.pop_message() == "You were not watching those jobs."